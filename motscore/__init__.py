@@ -20,6 +20,27 @@ def create_app(test_config: dict[str, Any] | None = None) -> Flask:
     app.config.from_mapping(
         SECRET_KEY="dev",
         DATABASE=os.path.join(app.instance_path, "motscore.sqlite"),
+        DB_POOL_SIZE=8,
+        DB_JOURNAL_MODE="wal",
+        DB_SYNCHRONOUS="normal",
+        DB_BUSY_TIMEOUT=5000,
+        DB_MMAP_SIZE=256 * 2**20,
+        DB_CACHED_STATEMENTS=256,
+        ASSIGNMENT_SCHEDULER="random",
+        REVIEWS_PER_VOLUME=3,
+        SLICE_CACHE=os.path.join(app.instance_path, "slice_cache"),
+        SLICE_ENCODING="png",
+        SLICE_ENCODING_OPTIONS={},
+        SLICE_SAMPLING={},
+        SLICE_NORMALIZATION={},
+        SLICE_BACKEND="nibabel",
+        SLICE_MEMORY_CACHE=32,
+        PREFETCH_DEPTH=2,
+        PREFETCH_WORKERS=2,
+        COMPRESS_MIN_SIZE=500,
+        SCORE_WRITE_BEHIND=False,
+        SCORE_BATCH_SIZE=64,
+        SCORE_FLUSH_INTERVAL=0.005,
     )
 
     if test_config is not None:
@@ -31,6 +52,30 @@ def create_app(test_config: dict[str, Any] | None = None) -> Flask:
 
     db.init_app(app)
 
+    from . import slice_cache
+
+    slice_cache.init_app(app)
+
+    from . import prefetch
+
+    prefetch.init_app(app)
+
+    from . import score_writer
+
+    score_writer.init_app(app)
+
+    from . import compress
+
+    compress.init_app(app)
+
+    from . import labels
+
+    labels.init_app(app)
+
+    from . import bench
+
+    bench.init_app(app)
+
     from . import auth
 
     app.register_blueprint(auth.bp)
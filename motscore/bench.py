@@ -0,0 +1,246 @@
+"""Module defining benchmark commands used to tune the server."""
+
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+
+from motscore.db import create_user, get_db, init_db, insert_volumes
+from motscore.rand_bids import normalization, sampler
+from motscore.utils import Encoding, benchmark_encodings
+
+bench_cli = AppGroup("bench", help="Measure the cost of server operations.")
+
+BENCH_ENCODINGS = [
+    Encoding("png", {"compress_level": 1}),
+    Encoding("png", {"compress_level": 6}),
+    Encoding("png", {"compress_level": 9}),
+    Encoding("webp", {"lossless": True, "method": 0}),
+    Encoding("webp", {"lossless": True, "method": 4}),
+    Encoding("webp", {"lossless": False, "quality": 90}),
+    Encoding("jpeg", {"quality": 95}),
+    Encoding("jpeg", {"quality": 85}),
+    Encoding("raw"),
+]
+
+
+@bench_cli.command("encodings")
+@click.option("--vol_path", required=True, help="Volume to sample slices from")
+@click.option("--repeat", type=int, default=5, help="Number of timed runs")
+def bench_encodings_command(vol_path: str, repeat: int):
+    """Report encode time and size of a volume's slices for each encoding."""
+    slices = sampler.retrieve_three_slices(vol_path)
+    click.echo(
+        f"{'encoding':<45}{'time (ms)':>12}{'size (KiB)':>12}{'base64 (KiB)':>14}"
+    )
+    for report in benchmark_encodings(list(slices), BENCH_ENCODINGS, repeat):
+        options = ", ".join(f"{k}={v}" for k, v in report.encoding.options.items())
+        click.echo(
+            f"{report.encoding.name + ' ' + options:<45}"
+            f"{report.seconds * 1000:>12.2f}"
+            f"{report.n_bytes / 1024:>12.1f}"
+            f"{report.n_bytes * 4 / 3 / 1024:>14.1f}"
+        )
+
+
+def _legacy_rescale(vol: np.ndarray) -> np.ndarray:
+    # Previous `sampler.rescale`, kept as the benchmark reference
+    vol = vol.astype(np.float64)
+    return ((vol - vol.min()) * 255.0 / (vol.max() - vol.min())).astype(np.uint8)
+
+
+def _best_time(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@bench_cli.command("normalization")
+@click.option("--vol_path", required=True, help="Volume to sample slices from")
+@click.option("--stride", type=int, default=4, help="Subsample stride")
+@click.option("--repeat", type=int, default=5, help="Number of timed runs")
+def bench_normalization_command(vol_path: str, stride: int, repeat: int):
+    """Report the cost of normalizing a volume's slices with each method."""
+    read_time = _best_time(lambda: sampler.read_sampled_slices(vol_path), repeat)
+    read_sample_time = _best_time(
+        lambda: sampler.read_sampled_slices(vol_path, sample_stride=stride), repeat
+    )
+    *planes, sample = sampler.read_sampled_slices(vol_path, sample_stride=stride)
+    slices = [image for images in planes for image in images]
+
+    click.echo(f"read slices: {read_time * 1000:.2f} ms")
+    click.echo(
+        f"read slices and subsample (stride {stride}): {read_sample_time * 1000:.2f} ms"
+    )
+    click.echo(f"{'method':<30}{'time (ms)':>12}")
+    timings = [
+        ("legacy rescale", lambda: [_legacy_rescale(image) for image in slices]),
+        ("rescale", lambda: [sampler.rescale(image) for image in slices]),
+    ]
+    for method in ("minmax", "percentile"):
+        norm = normalization.Normalization(method, stride=stride)
+        timings.append(
+            (
+                f"volume {method}",
+                lambda norm=norm: normalization.normalize_slices(slices, sample, norm),
+            )
+        )
+    for name, func in timings:
+        click.echo(f"{name:<30}{_best_time(func, repeat) * 1000:>12.3f}")
+
+
+def _measure_backend(vol_path: str, backend: str) -> tuple[float, int, int]:
+    # Run in a fresh process so peak RSS only reflects this backend
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    sampler.retrieve_contact_sheets(vol_path, backend=backend)
+    seconds = time.perf_counter() - start
+    return seconds, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@bench_cli.command("backends")
+@click.option(
+    "--vol_path",
+    required=True,
+    multiple=True,
+    help="Volume to sample slices from, can be repeated",
+)
+@click.option("--repeat", type=int, default=3, help="Number of timed runs")
+def bench_backends_command(vol_path: tuple[str, ...], repeat: int):
+    """Report wall time and peak RSS of each slice backend per volume."""
+    context = multiprocessing.get_context("spawn")
+    click.echo(
+        f"{'volume':<40}{'backend':<12}{'size (MiB)':>12}"
+        f"{'time (ms)':>12}{'base RSS (MiB)':>16}{'peak RSS (MiB)':>16}"
+    )
+    for path in vol_path:
+        size = os.path.getsize(path) / 2**20
+        for backend in sampler.BACKENDS:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    runs.append(
+                        executor.submit(_measure_backend, path, backend).result()
+                    )
+            seconds = min(run[0] for run in runs)
+            # ru_maxrss is in KiB on Linux, the baseline covers imports
+            baseline = max(run[1] for run in runs) / 1024
+            peak = max(run[2] for run in runs) / 1024
+            click.echo(
+                f"{os.path.basename(path)[:39]:<40}{backend:<12}{size:>12.1f}"
+                f"{seconds * 1000:>12.1f}{baseline:>16.1f}{peak:>16.1f}"
+            )
+
+
+# Database settings compared by `bench scores`
+BENCH_DB_SETTINGS = {
+    "per-request, rollback journal": {
+        "DB_POOL_SIZE": 0,
+        "DB_JOURNAL_MODE": "delete",
+        "DB_SYNCHRONOUS": "full",
+    },
+    "pooled, WAL": {
+        "DB_POOL_SIZE": 8,
+        "DB_JOURNAL_MODE": "wal",
+        "DB_SYNCHRONOUS": "normal",
+    },
+    "pooled, WAL, write-behind": {
+        "DB_POOL_SIZE": 8,
+        "DB_JOURNAL_MODE": "wal",
+        "DB_SYNCHRONOUS": "normal",
+        "SCORE_WRITE_BEHIND": True,
+    },
+}
+
+
+def _post_scores(app, user_code: str, vol_ids: list[int], errors: list[str]):
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": user_code})
+        for vol_id in vol_ids:
+            response = client.post(
+                "/score",
+                json={"vol_id": vol_id, "score": 1, "blur": False, "lines": False},
+            )
+            if response.status_code != 200:
+                errors.append(f"{response.status_code}")
+
+
+def bench_scores(
+    settings: dict, users: int, posts: int, folder: str
+) -> tuple[float, int]:
+    """Post scores from concurrent users on a scratch database.
+
+    Args:
+        settings (dict): app config overrides, typically `DB_*` settings
+        users (int): number of concurrent users, one thread each
+        posts (int): number of scores posted by each user
+        folder (str): folder holding the scratch database
+
+    Returns:
+        tuple[float, int]: elapsed seconds and number of failed posts
+    """
+    # Imported here as this module is loaded by the app factory
+    from motscore import create_app
+
+    app = create_app(
+        {
+            "DATABASE": os.path.join(folder, f"bench_{time.time_ns()}.sqlite"),
+            "SLICE_CACHE": None,
+            "PREFETCH_DEPTH": 0,
+            **settings,
+        }
+    )
+    with app.app_context():
+        init_db()
+        for user in range(users):
+            create_user(f"bench{user}@example.com", f"bench{user}")
+        insert_volumes(
+            (str(i), "", f"/bench/{i}.nii.gz", "bench", None) for i in range(posts)
+        )
+        get_db().commit()
+
+    errors: list[str] = []
+    threads = [
+        threading.Thread(
+            target=_post_scores,
+            args=(app, f"bench{user}", list(range(1, posts + 1)), errors),
+        )
+        for user in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer = app.extensions.get("motscore.score_writer")
+    if writer is not None:
+        # Queued scores count once written
+        writer.close()
+    return time.perf_counter() - start, len(errors)
+
+
+@bench_cli.command("scores")
+@click.option("--users", type=int, default=8, help="Number of concurrent users")
+@click.option("--posts", type=int, default=50, help="Number of scores per user")
+def bench_scores_command(users: int, posts: int):
+    """Report /score throughput of concurrent users for each db setting."""
+    click.echo(f"{'setting':<32}{'scores/s':>12}{'failed':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for name, settings in BENCH_DB_SETTINGS.items():
+            seconds, failed = bench_scores(settings, users, posts, folder)
+            click.echo(f"{name:<32}{users * posts / seconds:>12.1f}{failed:>8}")
+
+
+def init_app(app):
+    """Add commands to app."""
+    app.cli.add_command(bench_cli)
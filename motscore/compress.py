@@ -0,0 +1,64 @@
+"""Module implementing the compression of JSON responses."""
+
+import gzip
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is an optional dependency
+    brotli = None
+
+
+def choose_encoding(accept_encoding) -> str | None:
+    """Pick the best content coding accepted by the client.
+
+    Args:
+        accept_encoding (werkzeug.datastructures.Accept): request's
+         Accept-Encoding header
+
+    Returns:
+        str | None: "br" or "gzip", None if no supported coding is accepted
+    """
+    codings = ["gzip"] if brotli is None else ["br", "gzip"]
+    return accept_encoding.best_match(codings)
+
+
+def compress_response(response: Response) -> Response:
+    """Compress JSON responses when the client accepts it.
+
+    Small bodies are left as is, as compressing them saves less than the
+    cost of the coding.
+
+    Args:
+        response (Response): response to send
+
+    Returns:
+        Response: response, compressed if worth it
+    """
+    if response.mimetype != "application/json":
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.content_length is None
+        or response.content_length < current_app.config["COMPRESS_MIN_SIZE"]
+    ):
+        return response
+
+    coding = choose_encoding(request.accept_encodings)
+    if coding is None:
+        return response
+    data = response.get_data()
+    if coding == "br":
+        response.set_data(brotli.compress(data, quality=4))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = coding
+    return response
+
+
+def init_app(app):
+    """Compress app's JSON responses."""
+    app.after_request(compress_response)
@@ -1,38 +1,123 @@
 """Module defining db related functions and commands."""
 
 import base64
+import csv
+import json
 import os
+import queue
 import random
 import sqlite3
 from collections import namedtuple
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime
 from typing import Any
 
 import click
-import pandas as pd
 from flask import current_app, g
 
-from motscore.rand_bids import explorer
+from motscore.rand_bids import explorer, sampler
 
 Review = namedtuple("Review", ["vol_id", "judge_code", "score", "timestamp"])
 
 
+def connect(config, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open a db connection configured for concurrent raters.
+
+    Args:
+        config (flask.Config): app config, giving `DATABASE` and the `DB_*`
+         connection settings
+        check_same_thread (bool, optional): forbid using the connection from
+         another thread. Defaults to True.
+
+    Returns:
+        sqlite3.Connection: db connection
+    """
+    db = sqlite3.connect(
+        config["DATABASE"],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        timeout=config["DB_BUSY_TIMEOUT"] / 1000,
+        cached_statements=config["DB_CACHED_STATEMENTS"],
+        check_same_thread=check_same_thread,
+    )
+    db.row_factory = sqlite3.Row
+    if config["DB_JOURNAL_MODE"]:
+        db.execute(f"PRAGMA journal_mode = {config['DB_JOURNAL_MODE']}")
+    db.execute(f"PRAGMA synchronous = {config['DB_SYNCHRONOUS']}")
+    db.execute(f"PRAGMA mmap_size = {int(config['DB_MMAP_SIZE'])}")
+    return db
+
+
+class ConnectionPool:
+    """Keep db connections open between requests.
+
+    Reusing connections saves opening the file, setting pragmas and preparing
+    statements on every request: each connection keeps its own cache of
+    prepared statements.
+    """
+
+    def __init__(self, config, size: int):
+        """Create a new pool.
+
+        Args:
+            config (flask.Config): app config used to open connections
+            size (int): maximum number of idle connections kept open
+        """
+        self.config = config
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(size)
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one if none is left.
+
+        Returns:
+            sqlite3.Connection: db connection
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.config, check_same_thread=False)
+
+    def release(self, db: sqlite3.Connection) -> None:
+        """Give a connection back, uncommitted changes are rolled back.
+
+        Args:
+            db (sqlite3.Connection): connection taken with `acquire`
+        """
+        if db.in_transaction:
+            db.rollback()
+        try:
+            self._idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+    def close(self) -> None:
+        """Close idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
 def get_db():
     """Fetch db object."""
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = current_app.extensions.get("motscore.db_pool")
+        g.db = pool.acquire() if pool is not None else connect(current_app.config)
 
     return g.db
 
 
 def close_db(e=None):
-    """Close db."""
+    """Close db, or give it back to the pool."""
     db = g.pop("db", None)
 
     if db is not None:
-        db.close()
+        pool = current_app.extensions.get("motscore.db_pool")
+        if pool is not None:
+            pool.release(db)
+        else:
+            db.close()
 
 
 def init_db():
@@ -42,27 +127,237 @@ def init_db():
     with current_app.open_resource("schema.sql") as f:
         db.executescript(f.read().decode("utf8"))
 
+    # schema.sql always describes the latest version
+    migrations = list_migrations()
+    latest = migrations[-1][0] if migrations else 0
+    db.execute(f"PRAGMA user_version = {latest}")
+
+
+def list_migrations() -> list[tuple[int, str]]:
+    """List available migrations.
+
+    Migrations are SQL scripts stored in the migrations folder and named
+    `<version>_<description>.sql`.
+
+    Returns:
+        list[tuple[int, str]]: version and script name, sorted by version
+    """
+    folder = os.path.join(current_app.root_path, "migrations")
+    migrations = []
+    for name in os.listdir(folder):
+        version, _, _ = name.partition("_")
+        if name.endswith(".sql") and version.isdigit():
+            migrations.append((int(version), name))
+    return sorted(migrations)
+
+
+def migrate_db() -> list[int]:
+    """Upgrade the db in place by applying pending migrations.
+
+    The current version is stored in `PRAGMA user_version`. Each migration is
+    applied in its own transaction along with the version bump.
+
+    Returns:
+        list[int]: versions applied
+    """
+    db = get_db()
+    current: int = db.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for version, name in list_migrations():
+        if version <= current:
+            continue
+        with current_app.open_resource(os.path.join("migrations", name)) as f:
+            script = f.read().decode("utf8")
+        try:
+            db.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
+
 
-def get_next_volume_to_review(user_code: str) -> sqlite3.Row:
-    """Retrieve a random volume not yet reviewed by user.
+def random_tiers(reviews_per_volume: int) -> list[tuple[str, tuple]]:
+    """Assign volumes uniformly at random.
+
+    Args:
+        reviews_per_volume (int): target reviews per volume, unused
+
+    Returns:
+        list[tuple[str, tuple]]: a single tier holding every volume
+    """
+    return [("1", ())]
+
+
+def coverage_tiers(reviews_per_volume: int) -> list[tuple[str, tuple]]:
+    """Assign volumes with the fewest reviews first, until each has enough.
+
+    Args:
+        reviews_per_volume (int): target reviews per volume
+
+    Returns:
+        list[tuple[str, tuple]]: a tier per review count below the target,
+         then every volume
+    """
+    return [("V.review_count = ?", (count,)) for count in range(reviews_per_volume)] + [
+        ("1", ())
+    ]
+
+
+def disagreement_tiers(reviews_per_volume: int) -> list[tuple[str, tuple]]:
+    """Assign volumes like coverage, then volumes whose reviews disagree.
+
+    Reviews disagree when some keep the volume and others reject it.
+
+    Args:
+        reviews_per_volume (int): target reviews per volume
+
+    Returns:
+        list[tuple[str, tuple]]: coverage tiers with disputed volumes before
+         the last one
+    """
+    tiers = coverage_tiers(reviews_per_volume)
+    return tiers[:-1] + [("V.disputed = 1", ())] + tiers[-1:]
+
+
+# Assignment schedulers give the tiers in which volumes are served: the
+# volumes of a tier are served in random order before those of the next one.
+# Each tier condition must be served by a volume index ending with rand_key.
+SCHEDULERS = {
+    "random": random_tiers,
+    "coverage": coverage_tiers,
+    "disagreement": disagreement_tiers,
+}
+
+
+def get_volumes_to_review(
+    user_code: str,
+    limit: int,
+    exclude: Iterable[int] = (),
+    scheduler: str | None = None,
+    reviews_per_volume: int | None = None,
+) -> list[sqlite3.Row]:
+    """Retrieve volumes not yet reviewed by user, following a scheduler.
+
+    Each volume holds a random key. Within each tier of the scheduler, a
+    random pivot is drawn and active volumes are walked in key order from it,
+    wrapping around, through an index ending with rand_key.
+    The user's reviews are checked with the (judge_code, vol_id) index, so the
+    cost is a bounded index seek per tier instead of sorting the whole table.
 
     Args:
         user_code (str): User code to use
+        limit (int): maximum number of volumes to retrieve
+        exclude (Iterable[int], optional): volume ids to skip. Defaults to ().
+        scheduler (str | None, optional): one of SCHEDULERS. Defaults to None
+         (ASSIGNMENT_SCHEDULER setting).
+        reviews_per_volume (int | None, optional): target reviews per volume.
+         Defaults to None (REVIEWS_PER_VOLUME setting).
 
     Returns:
-        sqlite3.Row: volume informations
+        list[sqlite3.Row]: volumes informations
     """
+    if scheduler is None:
+        scheduler = current_app.config["ASSIGNMENT_SCHEDULER"]
+    if reviews_per_volume is None:
+        reviews_per_volume = current_app.config["REVIEWS_PER_VOLUME"]
+    exclude = list(exclude)
     db = get_db()
-    req: list[sqlite3.Row] = db.execute(
-        f"""SELECT V.*, R.*
-            FROM volume V
-            LEFT JOIN review R ON V.id = R.vol_id AND R.judge_code = '{user_code}'
-            WHERE R.vol_id IS NULL
-            ORDER BY RANDOM()
-            """
-    ).fetchall()
+    volumes: list[sqlite3.Row] = []
+    for tier, tier_params in SCHEDULERS[scheduler](reviews_per_volume):
+        pivot = random.randint(-(2**63), 2**63 - 1)
+        for condition in ("V.rand_key >= ?", "V.rand_key < ?"):
+            if len(volumes) >= limit:
+                return volumes
+            skip = exclude + [volume["id"] for volume in volumes]
+            volumes += db.execute(
+                f"""SELECT V.*
+                    FROM volume V
+                    WHERE V.retired = 0
+                        AND {tier}
+                        AND {condition}
+                        AND NOT EXISTS (
+                            SELECT 1 FROM review R
+                            WHERE R.judge_code = ? AND R.vol_id = V.id
+                        )
+                        AND V.id NOT IN ({",".join("?" * len(skip))})
+                    ORDER BY V.rand_key
+                    LIMIT ?
+                    """,
+                (*tier_params, pivot, user_code, *skip, limit - len(volumes)),
+            ).fetchall()
+    return volumes
+
+
+def get_next_volume_to_review(
+    user_code: str, exclude: Iterable[int] = ()
+) -> sqlite3.Row | None:
+    """Retrieve the next volume to review, following the app's scheduler.
+
+    Args:
+        user_code (str): User code to use
+        exclude (Iterable[int], optional): volume ids to skip. Defaults to ().
+
+    Returns:
+        sqlite3.Row | None: volume informations, None when all volumes are reviewed
+    """
+    volumes = get_volumes_to_review(user_code, 1, exclude)
+    return volumes[0] if volumes else None
 
-    return req[0]
+
+def get_volume(vol_id: int) -> sqlite3.Row | None:
+    """Retrieve a volume by id.
+
+    Args:
+        vol_id (int): volume id
+
+    Returns:
+        sqlite3.Row | None: volume informations, None if it does not exist
+    """
+    return get_db().execute("SELECT * FROM volume WHERE id = ?", (vol_id,)).fetchone()
+
+
+def is_reviewed(user_code: str, vol_id: int) -> bool:
+    """Check if a user already reviewed a volume.
+
+    Args:
+        user_code (str): User code to use
+        vol_id (int): volume to check
+
+    Returns:
+        bool: True if a review exists
+    """
+    db = get_db()
+    req = db.execute(
+        "SELECT 1 FROM review WHERE judge_code = ? AND vol_id = ?",
+        (user_code, vol_id),
+    ).fetchone()
+    return req is not None
+
+
+def write_reviews(
+    db: sqlite3.Connection, reviews: Iterable[tuple[str, int, int, bool, bool]]
+) -> None:
+    """Insert reviews in bulk, without committing.
+
+    A new review of a volume replaces the user's previous one.
+
+    Args:
+        db (sqlite3.Connection): db connection
+        reviews (Iterable[tuple[str, int, int, bool, bool]]): judge_code, vol_id,
+         score, blur and lines of each review
+    """
+    db.executemany(
+        """INSERT INTO review(judge_code, vol_id, score,blur,lines) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(judge_code, vol_id) DO UPDATE SET
+            score = excluded.score,
+            blur = excluded.blur,
+            lines = excluded.lines,
+            created_at = CURRENT_TIMESTAMP""",
+        reviews,
+    )
 
 
 def score_volume(
@@ -81,34 +376,48 @@ def score_volume(
         None|Any: commit results
     """
     db = get_db()
-    cur = db.cursor()
-    # Insert vote into the database
-    cur.execute(
-        "INSERT INTO review(judge_code, vol_id, score,blur,lines) VALUES (?, ?, ?, ?, ?)",
-        (judge_code, vol_id, score, blur, lines),
-    )
+    write_reviews(db, [(judge_code, vol_id, score, blur, lines)])
     return db.commit()
 
 
-def get_last_reviewed_volume(user_code: str) -> sqlite3.Row:
-    """Retrieve a user's last reviewed volume.
+def get_last_reviewed_volumes(user_code: str, steps: int = 1) -> list[sqlite3.Row]:
+    """Retrieve a user's last reviewed volumes, most recent first.
+
+    Reviews are walked backward on the (judge_code, created_at) index, so the
+    cost does not depend on the number of reviews of the user. Retired volumes
+    are skipped, as they can no longer be scored again.
 
     Args:
         user_code (str): user code to use
+        steps (int, optional): number of volumes to retrieve. Defaults to 1.
 
     Returns:
-        sqlite3.Row: last reviewed volume
+        list[sqlite3.Row]: last reviewed volumes
     """
     db = get_db()
-    req: list[sqlite3.Row] = db.execute(
-        f"""SELECT V.*, R.*
-            FROM volume V
-            LEFT JOIN review R ON V.id = R.vol_id AND R.judge_code = '{user_code}'
-            WHERE R.vol_id IS NOT NULL
-            """
+    return db.execute(
+        """SELECT V.*, R.id AS review_id
+            FROM review R
+            JOIN volume V ON V.id = R.vol_id
+            WHERE R.judge_code = ? AND V.retired = 0
+            ORDER BY R.created_at DESC, R.id DESC
+            LIMIT ?
+            """,
+        (user_code, steps),
     ).fetchall()
 
-    return req[-1]
+
+def get_last_reviewed_volume(user_code: str) -> sqlite3.Row | None:
+    """Retrieve a user's last reviewed volume.
+
+    Args:
+        user_code (str): user code to use
+
+    Returns:
+        sqlite3.Row | None: last reviewed volume, None if the user has no review
+    """
+    volumes = get_last_reviewed_volumes(user_code)
+    return volumes[0] if volumes else None
 
 
 def remove_review(volume_id: int, user_code: str):
@@ -126,11 +435,18 @@ def remove_review(volume_id: int, user_code: str):
     db.commit()
 
 
-def get_review_status(user_code: str) -> tuple[int, int, int]:
+def get_review_status(
+    user_code: str, pending: Iterable[tuple[int, int]] = ()
+) -> tuple[int, int, int]:
     """Get review statistics for a user.
 
+    Statistics are read from counters maintained by triggers on the volume
+    and review tables, in a single indexed lookup.
+
     Args:
         user_code (str): user on which we compute stats
+        pending (Iterable[tuple[int, int]], optional): vol_id and score of
+         reviews not written yet, counted as if they were. Defaults to ().
 
     Returns:
         dict[str, str]: returns three number for volume :
@@ -139,23 +455,57 @@ def get_review_status(user_code: str) -> tuple[int, int, int]:
             - Kept : volume with sufficient score
     """
     db = get_db()
-    to_do: sqlite3.Row = db.execute(
-        """SELECT count(V.id) as n_vol
-            FROM volume V"""
+    status: sqlite3.Row = db.execute(
+        """SELECT T.n_vol, coalesce(P.done, 0) AS done, coalesce(P.kept, 0) AS kept
+            FROM volume_total T
+            LEFT JOIN user_progress P ON P.judge_code = ?""",
+        (user_code,),
     ).fetchone()
+    done, kept = status["done"], status["kept"]
 
-    done: sqlite3.Row = db.execute(
-        f"""SELECT count(R.vol_id) as n_vol
-            FROM review R
-            WHERE judge_code = '{user_code}'"""
-    ).fetchone()
+    pending = dict(pending)
+    if pending:
+        previous = dict(
+            db.execute(
+                f"""SELECT vol_id, score FROM review
+                    WHERE judge_code = ? AND vol_id IN ({",".join("?" * len(pending))})""",
+                (user_code, *pending),
+            ).fetchall()
+        )
+        done += len(pending.keys() - previous.keys())
+        kept += sum(score in (0, 1) for score in pending.values())
+        kept -= sum(score in (0, 1) for score in previous.values())
+    return status["n_vol"], done, kept
+
+
+def rebuild_progress():
+    """Recompute progress and review counters from the volume and review tables.
 
-    kept: sqlite3.Row = db.execute(
-        f"""SELECT count(R.vol_id) as n_vol
+    Reviews of retired volumes are not counted in the user progress.
+    """
+    db = get_db()
+    db.execute("DELETE FROM user_progress")
+    db.execute(
+        """INSERT INTO user_progress (judge_code, done, kept)
+            SELECT R.judge_code,
+                sum(NOT coalesce(V.retired, 0)),
+                sum(R.score IN (0, 1) AND NOT coalesce(V.retired, 0))
             FROM review R
-            WHERE judge_code = '{user_code}' and (score=0 or score=1)"""
-    ).fetchone()
-    return to_do["n_vol"], done["n_vol"], kept["n_vol"]
+            LEFT JOIN volume V ON V.id = R.vol_id
+            GROUP BY R.judge_code"""
+    )
+    db.execute(
+        "UPDATE volume_total SET n_vol = (SELECT count(*) FROM volume WHERE retired = 0)"
+    )
+    db.execute(
+        """UPDATE volume
+            SET review_count = (SELECT count(*) FROM review R WHERE R.vol_id = volume.id),
+                kept_count = (
+                    SELECT count(*) FROM review R
+                    WHERE R.vol_id = volume.id AND R.score IN (0, 1)
+                )"""
+    )
+    db.commit()
 
 
 @click.command("init-db")
@@ -165,6 +515,14 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
+@click.command("migrate-db")
+def migrate_db_command():
+    """Upgrade the existing database without losing data."""
+    applied = migrate_db()
+    version = get_db().execute("PRAGMA user_version").fetchone()[0]
+    click.echo(f"Applied {len(applied)} migrations, database at version {version}.")
+
+
 def create_user(user_email, force_code: None | str = None) -> str:
     """Insert a new user in db.
 
@@ -200,6 +558,13 @@ def create_user(user_email, force_code: None | str = None) -> str:
     return ""
 
 
+@click.command("rebuild-progress")
+def rebuild_progress_command():
+    """Reconcile progress counters with reviews."""
+    rebuild_progress()
+    click.echo("Rebuilt progress counters.")
+
+
 @click.command("create-user")
 @click.option("--email", type=str)
 def create_user_command(email):
@@ -208,11 +573,128 @@ def create_user_command(email):
     click.echo(f"User inserted, code : {user_code} .")
 
 
-def populate_volume(dataset_path: str) -> int:
+def optimized_volume_path(optimized_dir: str, dataset_path: str, vol_path: str) -> str:
+    """Compute where the uncompressed copy of a volume is stored.
+
+    Args:
+        optimized_dir (str): root folder of uncompressed copies
+        dataset_path (str): path to BIDS dataset
+        vol_path (str): volume path
+
+    Returns:
+        str: path of the uncompressed copy
+    """
+    rel_path = os.path.relpath(vol_path, dataset_path)
+    if rel_path.endswith(".gz"):
+        rel_path = rel_path[: -len(".gz")]
+    dataset = os.path.basename(os.path.normpath(dataset_path))
+    return os.path.join(optimized_dir, dataset, rel_path)
+
+
+@contextmanager
+def bulk_load() -> Iterator[sqlite3.Connection]:
+    """Run a large write transaction with pragmas tuned for loading.
+
+    Durability is relaxed and the page cache enlarged for the duration of the
+    transaction, then restored. The transaction is committed on success and
+    rolled back on error.
+
+    Yields:
+        Iterator[sqlite3.Connection]: db connection
+    """
+    db = get_db()
+    synchronous = db.execute("PRAGMA synchronous").fetchone()[0]
+    cache_size = db.execute("PRAGMA cache_size").fetchone()[0]
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("PRAGMA cache_size = -65536")
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.execute(f"PRAGMA synchronous = {int(synchronous)}")
+        db.execute(f"PRAGMA cache_size = {int(cache_size)}")
+
+
+def insert_volumes(
+    volumes: Iterable[tuple[str, str, str, str, str | None]],
+    skip_existing: bool = False,
+) -> int:
+    """Insert volumes in bulk, without committing.
+
+    Args:
+        volumes (Iterable[tuple[str, str, str, str, str | None]]): sub_id, ses_id,
+         volume_path, dataset and optimized_path of each volume
+        skip_existing (bool, optional): ignore volumes whose path is already in
+         the table instead of failing. Defaults to False.
+
+    Returns:
+        int: Number of volume inserted
+    """
+    verb = "INSERT OR IGNORE" if skip_existing else "INSERT"
+    cur = get_db().executemany(
+        f"""{verb} INTO volume(sub_id,ses_id,volume_path,dataset,optimized_path,rand_key)
+        VALUES(?,?,?,?,?,random())""",
+        volumes,
+    )
+    return max(0, cur.rowcount)
+
+
+def volume_rows(
+    volumes: Iterable[explorer.Volume],
+    dataset_path: str,
+    optimized_dir: str | None = None,
+) -> tuple[list[tuple[str, str, str, str, str | None]], list[tuple[str, str]]]:
+    """Convert a dataset's volumes to volume table rows.
+
+    Uncompressed copies are written here, before any write transaction is
+    opened. Volumes that fail to transcode are skipped.
+
+    Args:
+        volumes (Iterable[explorer.Volume]): volumes found in the dataset
+        dataset_path (str): path to BIDS dataset
+        optimized_dir (str | None, optional): folder where uncompressed RPI copies
+         of volumes are written for fast slicing. Defaults to None (no copy).
+
+    Returns:
+        tuple[list[tuple[str, str, str, str, str | None]], list[tuple[str, str]]]:
+         volume rows, and path and error of each volume that failed to transcode
+    """
+    rows = []
+    failed = []
+    for vol in volumes:
+        optimized_path = None
+        if optimized_dir is not None:
+            try:
+                optimized_path = sampler.transcode(
+                    vol.path,
+                    optimized_volume_path(optimized_dir, dataset_path, vol.path),
+                )
+            except Exception as e:
+                failed.append((vol.path, str(e)))
+                continue
+        rows.append((*vol, optimized_path))
+    return rows, failed
+
+
+def populate_volume(
+    dataset_path: str,
+    optimized_dir: str | None = None,
+    skip_existing: bool = False,
+    indexer: str = "fs",
+) -> int:
     """Populate database with volume inside dataset.
 
     Args:
         dataset_path (str): path to BIDS dataset
+        optimized_dir (str | None, optional): folder where uncompressed RPI copies
+         of volumes are written for fast slicing. Defaults to None (no copy).
+        skip_existing (bool, optional): ignore volumes already in the table
+         instead of failing. Defaults to False.
+        indexer (str, optional): "fs" to scan file names, "pybids" to build
+         a full BIDS layout. Defaults to "fs".
 
     Returns:
         int: Number of volume inserted
@@ -220,19 +702,37 @@ def populate_volume(dataset_path: str) -> int:
     db = get_db()
 
     if isinstance(db, sqlite3.Connection):
-        volumes = explorer.list_volumes(dataset_path)
-        random.shuffle(volumes)
-        for vol in volumes:
-            cur = db.cursor()
-            cur.execute(
-                "INSERT INTO volume(sub_id,ses_id,volume_path,dataset) VALUES(?,?,?,?)",
-                vol,
-            )
-        db.commit()
-        return len(volumes)
+        if indexer == "fs":
+            volumes: Iterable[explorer.Volume] = explorer.scan_volumes(dataset_path)
+        else:
+            volumes = explorer.list_volumes(dataset_path, indexer=indexer)
+        rows, failed = volume_rows(volumes, dataset_path, optimized_dir)
+        for path, error in failed:
+            current_app.logger.warning("Failed to transcode %s (%s)", path, error)
+        with bulk_load():
+            return insert_volumes(rows, skip_existing)
     return 0
 
 
+def list_datasets(dataset_path: str, multiple: bool) -> list[str]:
+    """List datasets targeted by a command.
+
+    Args:
+        dataset_path (str): path to a BIDS dataset, or to a folder of datasets
+        multiple (bool): true if dataset_path contains multiple datasets
+
+    Returns:
+        list[str]: paths to datasets
+    """
+    if not multiple:
+        return [dataset_path]
+    return [
+        os.path.join(dataset_path, ds)
+        for ds in sorted(os.listdir(dataset_path))
+        if os.path.isdir(os.path.join(dataset_path, ds))
+    ]
+
+
 @click.command("populate-volumes")
 @click.option("--dataset_path", type=str)
 @click.option(
@@ -242,56 +742,479 @@ def populate_volume(dataset_path: str) -> int:
     is_flag=True,
     type=bool,
 )
-def populate_volume_command(dataset_path: str, multiple: bool):
+@click.option(
+    "--optimized_dir",
+    help="Folder where uncompressed RPI copies of volumes are written for fast slicing",
+    type=str,
+    default=None,
+)
+@click.option(
+    "--skip_existing",
+    help="Skip volumes already in the database instead of failing",
+    is_flag=True,
+    type=bool,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of processes indexing datasets. Defaults to the number of CPUs",
+)
+@click.option(
+    "--indexer",
+    help="Scan BIDS file names (fs) or build a validated pybids layout (pybids)",
+    type=click.Choice(explorer.INDEXERS),
+    default="fs",
+)
+def populate_volume_command(
+    dataset_path: str,
+    multiple: bool,
+    optimized_dir: str,
+    skip_existing: bool,
+    jobs: int | None,
+    indexer: str,
+):
     """Populate volume table with dataset volumes."""
-    if multiple:
-        for ds in os.listdir(dataset_path):
-            nb_volume = populate_volume(os.path.join(dataset_path, ds))
-            click.echo(f"Inserted {nb_volume} volumes.")
-    else:
-        nb_volume = populate_volume(dataset_path)
-        click.echo(f"Inserted {nb_volume} volumes.")
+    datasets = list_datasets(dataset_path, multiple)
+    # Volumes are transcoded before the write transaction is opened
+    loaded = []
+    results = explorer.index_datasets(datasets, jobs, indexer=indexer)
+    for i, (ds, volumes, error) in enumerate(results, start=1):
+        progress = f"[{i}/{len(datasets)}] {os.path.basename(os.path.normpath(ds))}"
+        if error is not None:
+            click.echo(f"{progress}: failed to index ({error}).", err=True)
+            continue
+        rows, failed = volume_rows(volumes, ds, optimized_dir)
+        for path, transcode_error in failed:
+            click.echo(
+                f"{progress}: failed to transcode {path} ({transcode_error}).",
+                err=True,
+            )
+        loaded.append((progress, rows))
+    try:
+        # All datasets are inserted in a single transaction
+        with bulk_load():
+            for progress, rows in loaded:
+                nb_volume = insert_volumes(rows, skip_existing)
+                click.echo(f"{progress}: Inserted {nb_volume} volumes.")
+    except sqlite3.IntegrityError as e:
+        raise click.ClickException(
+            "Some volumes are already in the database, nothing was inserted. "
+            "Use --skip_existing to only insert new volumes."
+        ) from e
 
 
-def export_csv(output: str):
-    """Export current review as a csv file.
+def sync_volumes(
+    volumes: Iterable[explorer.Volume],
+    dataset_path: str,
+    optimized_dir: str | None = None,
+) -> tuple[int, int, int]:
+    """Synchronize the volume table with a dataset and commit.
+
+    Listed volumes are loaded in a temporary table and diffed against the
+    volume table with set-based statements: new paths are inserted, volumes
+    of the dataset missing from the listing are retired and retired volumes
+    listed again are restored. Reviews are never deleted. New volumes are
+    transcoded before the write transaction is opened, and volumes that fail
+    to transcode are skipped until the next sync.
 
     Args:
-        output (str): csv file path
+        volumes (Iterable[explorer.Volume]): volumes currently in the dataset
+        dataset_path (str): path to BIDS dataset
+        optimized_dir (str | None, optional): folder where uncompressed RPI copies
+         of new volumes are written for fast slicing. Defaults to None (no copy).
+
+    Returns:
+        tuple[int, int, int]: number of volumes added, retired and restored
     """
     db = get_db()
-    reviews = db.execute(
-        """SELECT sub_id, ses_id, volume_path, judge_code, score, blur, lines, dataset
-        FROM review R 
-        LEFT JOIN volume V ON V.id = R.vol_id  """
+    dataset = os.path.basename(os.path.normpath(dataset_path))
+    db.execute(
+        """CREATE TEMP TABLE IF NOT EXISTS sync_volume (
+            sub_id TEXT, ses_id TEXT, volume_path TEXT PRIMARY KEY, dataset TEXT
+        )"""
+    )
+    db.execute("DELETE FROM temp.sync_volume")
+    db.executemany(
+        "INSERT OR IGNORE INTO temp.sync_volume VALUES (?,?,?,?)",
+        (tuple(vol) for vol in volumes),
+    )
+    new_volumes = db.execute(
+        """SELECT S.sub_id, S.ses_id, S.volume_path, S.dataset
+            FROM temp.sync_volume S
+            WHERE NOT EXISTS (
+                SELECT 1 FROM volume V WHERE V.volume_path = S.volume_path
+            )"""
     ).fetchall()
-    pd.DataFrame.from_records(
-        reviews,
-        columns=[
-            "sub_id",
-            "ses_id",
-            "volume_path",
-            "judge_code",
-            "score",
-            "blur",
-            "lines",
-            "dataset",
-        ],
-    ).to_csv(output)
+    # Only the temporary table was written, no lock is held while transcoding
+    db.commit()
+
+    rows, failed = volume_rows(
+        (explorer.Volume(*vol) for vol in new_volumes), dataset_path, optimized_dir
+    )
+    for path, error in failed:
+        current_app.logger.warning("Failed to transcode %s (%s)", path, error)
+
+    try:
+        # Paths inserted since the diff are left alone
+        added = insert_volumes(rows, skip_existing=True)
+        restored = db.execute(
+            """UPDATE volume SET retired = 0
+                WHERE retired = 1
+                    AND volume_path IN (SELECT volume_path FROM temp.sync_volume)"""
+        ).rowcount
+        retired = db.execute(
+            """UPDATE volume SET retired = 1
+                WHERE dataset = ?
+                    AND retired = 0
+                    AND volume_path NOT IN (
+                        SELECT volume_path FROM temp.sync_volume
+                    )""",
+            (dataset,),
+        ).rowcount
+        db.execute("DELETE FROM temp.sync_volume")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return added, retired, restored
+
+
+@click.command("sync-volumes")
+@click.option("--dataset_path", type=str)
+@click.option(
+    "-m",
+    "--multiple",
+    help="Toggle when dataset_path is a parent folder that contain multiple dataset",
+    is_flag=True,
+    type=bool,
+)
+@click.option(
+    "--optimized_dir",
+    help="Folder where uncompressed RPI copies of volumes are written for fast slicing",
+    type=str,
+    default=None,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of processes indexing datasets. Defaults to the number of CPUs",
+)
+@click.option(
+    "--indexer",
+    help="Scan BIDS file names (fs) or build a validated pybids layout (pybids)",
+    type=click.Choice(explorer.INDEXERS),
+    default="fs",
+)
+def sync_volumes_command(
+    dataset_path: str,
+    multiple: bool,
+    optimized_dir: str,
+    jobs: int | None,
+    indexer: str,
+):
+    """Add new volumes and retire missing ones, keeping reviews."""
+    datasets = list_datasets(dataset_path, multiple)
+    # Each dataset is committed on its own, so scoring is never blocked for long
+    results = explorer.index_datasets(datasets, jobs, indexer=indexer)
+    for i, (ds, volumes, error) in enumerate(results, start=1):
+        progress = f"[{i}/{len(datasets)}] {os.path.basename(os.path.normpath(ds))}"
+        if error is not None:
+            click.echo(f"{progress}: failed to index ({error}).", err=True)
+            continue
+        added, retired, restored = sync_volumes(volumes, ds, optimized_dir)
+        click.echo(
+            f"{progress}: {added} added, {retired} retired, {restored} restored."
+        )
+
+
+# Columns of exported reviews
+EXPORT_COLUMNS = [
+    "sub_id",
+    "ses_id",
+    "volume_path",
+    "judge_code",
+    "score",
+    "blur",
+    "lines",
+    "dataset",
+]
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+# Review timestamps are stored in UTC by CURRENT_TIMESTAMP
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def iter_reviews(
+    datasets: Iterable[str] = (),
+    judges: Iterable[str] = (),
+    since: str | None = None,
+    until: str | None = None,
+    chunk_size: int = 1000,
+) -> Iterator[list[sqlite3.Row]]:
+    """Read reviews in chunks.
+
+    Args:
+        datasets (Iterable[str], optional): only read reviews of these
+         datasets. Defaults to () (all datasets).
+        judges (Iterable[str], optional): only read reviews of these users.
+         Defaults to () (all users).
+        since (str | None, optional): only read reviews created at or after
+         this timestamp. Defaults to None.
+        until (str | None, optional): only read reviews created before this
+         timestamp. Defaults to None.
+        chunk_size (int, optional): number of reviews per chunk. Defaults to 1000.
+
+    Yields:
+        Iterator[list[sqlite3.Row]]: reviews, with EXPORT_COLUMNS
+    """
+    datasets, judges = list(datasets), list(judges)
+    conditions, params = [], []
+    if datasets:
+        conditions.append(f"V.dataset IN ({','.join('?' * len(datasets))})")
+        params.extend(datasets)
+    if judges:
+        conditions.append(f"R.judge_code IN ({','.join('?' * len(judges))})")
+        params.extend(judges)
+    if since is not None:
+        conditions.append("R.created_at >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("R.created_at < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cursor = get_db().execute(
+        f"""SELECT {", ".join(EXPORT_COLUMNS)}
+        FROM review R
+        LEFT JOIN volume V ON V.id = R.vol_id
+        {where}""",
+        params,
+    )
+    while rows := cursor.fetchmany(chunk_size):
+        yield rows
+
+
+def write_csv(chunks: Iterable[list[sqlite3.Row]], output: str) -> int:
+    """Write reviews as a csv file, with a leading index column.
+
+    Args:
+        chunks (Iterable[list[sqlite3.Row]]): reviews in chunks
+        output (str): csv file path
+
+    Returns:
+        int: number of reviews written
+    """
+    count = 0
+    with open(output, "w", newline="", encoding="utf8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["", *EXPORT_COLUMNS])
+        for rows in chunks:
+            writer.writerows([i, *row] for i, row in enumerate(rows, start=count))
+            count += len(rows)
+    return count
+
+
+def write_jsonl(chunks: Iterable[list[sqlite3.Row]], output: str) -> int:
+    """Write reviews as a JSON Lines file.
+
+    Args:
+        chunks (Iterable[list[sqlite3.Row]]): reviews in chunks
+        output (str): jsonl file path
+
+    Returns:
+        int: number of reviews written
+    """
+    count = 0
+    with open(output, "w", encoding="utf8") as f:
+        for rows in chunks:
+            f.writelines(json.dumps(dict(row)) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def write_parquet(chunks: Iterable[list[sqlite3.Row]], output: str) -> int:
+    """Write reviews as a Parquet file, one row group per chunk.
+
+    Args:
+        chunks (Iterable[list[sqlite3.Row]]): reviews in chunks
+        output (str): parquet file path
+
+    Returns:
+        int: number of reviews written
+    """
+    try:
+        # Imported here as pyarrow is optional and slow to import
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet export requires pyarrow: pip install motionscore[parquet]"
+        ) from e
+
+    integers = {"score", "blur", "lines"}
+    schema = pa.schema(
+        [(c, pa.int64() if c in integers else pa.string()) for c in EXPORT_COLUMNS]
+    )
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        for rows in chunks:
+            writer.write_table(
+                pa.Table.from_pylist([dict(row) for row in rows], schema=schema)
+            )
+            count += len(rows)
+    return count
+
+
+EXPORT_WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+
+def export_reviews(
+    output: str,
+    export_format: str = "csv",
+    datasets: Iterable[str] = (),
+    judges: Iterable[str] = (),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    watermark: str | None = None,
+) -> int:
+    """Export reviews to a file, streaming them from the db.
+
+    With a watermark name, only reviews created since the previous export
+    with the same name are written, up to the current second. The watermark
+    is then moved forward.
+
+    Args:
+        output (str): file path
+        export_format (str, optional): one of EXPORT_FORMATS. Defaults to "csv".
+        datasets (Iterable[str], optional): only export reviews of these
+         datasets. Defaults to () (all datasets).
+        judges (Iterable[str], optional): only export reviews of these users.
+         Defaults to () (all users).
+        since (datetime | None, optional): only export reviews created at or
+         after this UTC time. Defaults to None.
+        until (datetime | None, optional): only export reviews created before
+         this UTC time. Defaults to None.
+        watermark (str | None, optional): name of the incremental export.
+         Defaults to None (export every review).
+
+    Returns:
+        int: number of reviews exported
+    """
+    if export_format not in EXPORT_WRITERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    db = get_db()
+    since_ts = since.strftime(TIMESTAMP_FORMAT) if since is not None else None
+    until_ts = until.strftime(TIMESTAMP_FORMAT) if until is not None else None
+    if watermark is not None:
+        previous = db.execute(
+            "SELECT exported_until FROM export_watermark WHERE name = ?",
+            (watermark,),
+        ).fetchone()
+        if previous is not None:
+            since_ts = max(since_ts or "", previous["exported_until"])
+        # Reviews of the current second may still be written
+        now = db.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        until_ts = min(until_ts or now, now)
+
+    count = EXPORT_WRITERS[export_format](
+        iter_reviews(datasets, judges, since_ts, until_ts), output
+    )
+
+    if watermark is not None:
+        db.execute(
+            """INSERT INTO export_watermark (name, exported_until) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE
+            SET exported_until = max(exported_until, excluded.exported_until)""",
+            (watermark, until_ts),
+        )
+        db.commit()
+    return count
+
+
+def export_csv(output: str) -> int:
+    """Export current review as a csv file.
+
+    Args:
+        output (str): csv file path
+
+    Returns:
+        int: number of reviews exported
+    """
+    return export_reviews(output, "csv")
 
 
 @click.command("export-csv")
 @click.option("-o", "--output", type=str)
-def export_csv_command(output: str):
-    """Populate volume table with dataset volumes."""
-    export_csv(output)
+@click.option(
+    "-f",
+    "--format",
+    "export_format",
+    type=click.Choice(EXPORT_FORMATS),
+    default=None,
+    help="Output format. Defaults to the output extension, or csv",
+)
+@click.option("--dataset", multiple=True, help="Only export this dataset's reviews")
+@click.option("--judge", multiple=True, help="Only export this user's reviews")
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    default=None,
+    help="Only export reviews created at or after this UTC time",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    default=None,
+    help="Only export reviews created before this UTC time",
+)
+@click.option(
+    "--incremental",
+    "watermark",
+    type=str,
+    default=None,
+    help="Only export reviews created since the last export with this name",
+)
+def export_csv_command(
+    output: str,
+    export_format: str | None,
+    dataset: tuple[str, ...],
+    judge: tuple[str, ...],
+    since: datetime | None,
+    until: datetime | None,
+    watermark: str | None,
+):
+    """Export reviews as csv, jsonl or parquet."""
+    if export_format is None:
+        extension = os.path.splitext(output)[1].lstrip(".")
+        export_format = extension if extension in EXPORT_FORMATS else "csv"
+    try:
+        count = export_reviews(
+            output, export_format, dataset, judge, since, until, watermark
+        )
+    except ImportError as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f"Exported {count} reviews.")
     click.echo(f"Write at {output}.")
 
 
 def init_app(app):
-    """Add commands to app."""
+    """Set up connection pooling and add commands to app."""
+    if app.config["ASSIGNMENT_SCHEDULER"] not in SCHEDULERS:
+        raise ValueError(
+            f"Unknown assignment scheduler: {app.config['ASSIGNMENT_SCHEDULER']}"
+        )
+    if app.config["DB_POOL_SIZE"] > 0:
+        app.extensions["motscore.db_pool"] = ConnectionPool(
+            app.config, app.config["DB_POOL_SIZE"]
+        )
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(rebuild_progress_command)
     app.cli.add_command(create_user_command)
     app.cli.add_command(populate_volume_command)
+    app.cli.add_command(sync_volumes_command)
     app.cli.add_command(export_csv_command)
@@ -0,0 +1,441 @@
+"""Module aggregating reviews into consensus labels and agreement statistics."""
+
+import csv
+import itertools
+import json
+from collections import namedtuple
+from collections.abc import Iterable, Iterator
+
+import click
+import numpy as np
+
+from motscore.db import get_db
+
+# Scores range from 0 (clean) to 5 (corrupted), volumes scored 0 or 1 are kept
+N_SCORES = 6
+KEPT_SCORES = (0, 1)
+# Maps scores to rejected (column 0) and kept (column 1)
+KEPT_MAP = np.stack(
+    [
+        ~np.isin(np.arange(N_SCORES), KEPT_SCORES),
+        np.isin(np.arange(N_SCORES), KEPT_SCORES),
+    ],
+    axis=1,
+).astype(np.int64)
+
+# Reviews of a chunk of volumes: `counts` has one column per score, `blur`
+# and `lines` count reviews flagging them and `scores` holds the score given
+# by each judge, -1 when the judge did not review the volume
+ReviewChunk = namedtuple(
+    "ReviewChunk", ["vol_ids", "counts", "blur", "lines", "scores"]
+)
+
+# Consensus of a chunk of volumes: majority score and flags, and the share of
+# reviews agreeing with the majority score
+Consensus = namedtuple("Consensus", ["score", "blur", "lines", "agreement"])
+
+# Sums over volumes needed by Fleiss' kappa, so it is computed in chunks
+FleissTerms = namedtuple("FleissTerms", ["agreement", "volumes", "totals"])
+
+LABEL_COLUMNS = [
+    "vol_id",
+    "sub_id",
+    "ses_id",
+    "volume_path",
+    "dataset",
+    "score",
+    "blur",
+    "lines",
+    "kept",
+    "n_reviews",
+    "agreement",
+]
+
+
+def _volume_filter(datasets: list[str], retired: bool = False) -> tuple[str, list[str]]:
+    conditions = [] if retired else ["V.retired = 0"]
+    if datasets:
+        conditions.append(f"V.dataset IN ({','.join('?' * len(datasets))})")
+    return " AND ".join(conditions) or "1", datasets
+
+
+def _chunk(rows: list, judges: dict[str, int]) -> ReviewChunk:
+    vol_ids, inverse = np.unique(
+        np.fromiter((row[0] for row in rows), np.int64, len(rows)),
+        return_inverse=True,
+    )
+    judge = np.fromiter((judges[row[1]] for row in rows), np.int64, len(rows))
+    values = np.array([row[2:] for row in rows], dtype=np.int64)
+    score, blur, lines = values[:, 0], values[:, 1], values[:, 2]
+
+    counts = np.bincount(
+        inverse * N_SCORES + score, minlength=len(vol_ids) * N_SCORES
+    ).reshape(len(vol_ids), N_SCORES)
+    scores = np.full((len(vol_ids), len(judges)), -1, dtype=np.int64)
+    scores[inverse, judge] = score
+    return ReviewChunk(
+        vol_ids,
+        counts,
+        np.bincount(inverse, blur, len(vol_ids)).astype(np.int64),
+        np.bincount(inverse, lines, len(vol_ids)).astype(np.int64),
+        scores,
+    )
+
+
+def iter_review_chunks(
+    judges: dict[str, int], datasets: Iterable[str] = (), chunk_size: int = 50000
+) -> Iterator[ReviewChunk]:
+    """Stream reviews grouped by volume, in chunks.
+
+    Reviews are read in a single pass ordered by volume, each chunk holds
+    every review of its volumes.
+
+    Args:
+        judges (dict[str, int]): column of each judge in `scores`
+        datasets (Iterable[str], optional): only read these datasets.
+         Defaults to () (all datasets).
+        chunk_size (int, optional): number of reviews read at once.
+         Defaults to 50000.
+
+    Yields:
+        Iterator[ReviewChunk]: reviews of a chunk of volumes
+    """
+    condition, params = _volume_filter(list(datasets))
+    cursor = get_db().execute(
+        f"""SELECT R.vol_id, R.judge_code, R.score, R.blur, R.lines
+        FROM review R
+        JOIN volume V ON V.id = R.vol_id
+        WHERE {condition} AND R.score BETWEEN 0 AND {N_SCORES - 1}
+        ORDER BY R.vol_id""",
+        params,
+    )
+    pending: list = []
+    while rows := cursor.fetchmany(chunk_size):
+        rows = pending + rows
+        # Reviews of the last volume may continue in the next rows
+        last = len(rows)
+        while last > 0 and rows[last - 1][0] == rows[-1][0]:
+            last -= 1
+        if last == 0:
+            pending = rows
+            continue
+        pending = rows[last:]
+        yield _chunk(rows[:last], judges)
+    if pending:
+        yield _chunk(pending, judges)
+
+
+def consensus(counts: np.ndarray, blur: np.ndarray, lines: np.ndarray) -> Consensus:
+    """Compute the majority vote of each volume.
+
+    Ties between scores go to the highest, most conservative, score. Flags
+    are set when more than half of the reviews raise them.
+
+    Args:
+        counts (np.ndarray): reviews per volume and score, (n_volumes, N_SCORES)
+        blur (np.ndarray): reviews flagging blur per volume
+        lines (np.ndarray): reviews flagging lines per volume
+
+    Returns:
+        Consensus: consensus of each volume
+    """
+    n_reviews = counts.sum(axis=1)
+    score = N_SCORES - 1 - counts[:, ::-1].argmax(axis=1)
+    return Consensus(
+        score,
+        2 * blur > n_reviews,
+        2 * lines > n_reviews,
+        counts.max(axis=1) / n_reviews,
+    )
+
+
+def kept_counts(counts: np.ndarray) -> np.ndarray:
+    """Collapse score counts into rejected and kept counts.
+
+    Args:
+        counts (np.ndarray): reviews per volume and score, (n_volumes, N_SCORES)
+
+    Returns:
+        np.ndarray: rejected and kept reviews per volume, (n_volumes, 2)
+    """
+    return counts @ KEPT_MAP
+
+
+def fleiss_terms(counts: np.ndarray) -> FleissTerms:
+    """Compute the sums over volumes needed by Fleiss' kappa.
+
+    Volumes with a single review are ignored.
+
+    Args:
+        counts (np.ndarray): reviews per volume and category
+
+    Returns:
+        FleissTerms: sums of the chunk, added to the sums of other chunks
+    """
+    n_reviews = counts.sum(axis=1)
+    counts = counts[n_reviews > 1]
+    n_reviews = n_reviews[n_reviews > 1]
+    agreement = (counts * (counts - 1)).sum(axis=1) / (n_reviews * (n_reviews - 1))
+    return FleissTerms(float(agreement.sum()), len(counts), counts.sum(axis=0))
+
+
+def fleiss_kappa(counts: np.ndarray | FleissTerms) -> float | None:
+    """Compute Fleiss' kappa, allowing a varying number of reviews per volume.
+
+    Volumes with a single review are ignored.
+
+    Args:
+        counts (np.ndarray | FleissTerms): reviews per volume and category, or
+         their sums computed by `fleiss_terms`
+
+    Returns:
+        float | None: kappa, None when undefined
+    """
+    if not isinstance(counts, FleissTerms):
+        counts = fleiss_terms(counts)
+    if counts.volumes == 0:
+        return None
+    observed = counts.agreement / counts.volumes
+    shares = counts.totals / counts.totals.sum()
+    expected = (shares**2).sum()
+    if expected == 1:
+        return None
+    return float((observed - expected) / (1 - expected))
+
+
+def cohen_kappa(confusion: np.ndarray) -> float | None:
+    """Compute Cohen's kappa from the confusion matrix of two judges.
+
+    Args:
+        confusion (np.ndarray): volumes per pair of scores, (K, K)
+
+    Returns:
+        float | None: kappa, None when undefined
+    """
+    total = confusion.sum()
+    if total == 0:
+        return None
+    observed = np.trace(confusion) / total
+    expected = (confusion.sum(axis=0) * confusion.sum(axis=1)).sum() / total**2
+    if expected == 1:
+        return None
+    return float((observed - expected) / (1 - expected))
+
+
+def pair_confusions(scores: np.ndarray) -> np.ndarray:
+    """Compute the score confusion matrix of each pair of judges.
+
+    Args:
+        scores (np.ndarray): score of each judge per volume, -1 when missing,
+         (n_volumes, n_judges)
+
+    Returns:
+        np.ndarray: (n_judges, n_judges, N_SCORES, N_SCORES) matrices, only
+         filled for judge pairs a < b
+    """
+    n_judges = scores.shape[1]
+    confusions = np.zeros((n_judges, n_judges, N_SCORES, N_SCORES), dtype=np.int64)
+    for a, b in itertools.combinations(range(n_judges), 2):
+        both = (scores[:, a] >= 0) & (scores[:, b] >= 0)
+        confusions[a, b] = np.bincount(
+            scores[both, a] * N_SCORES + scores[both, b], minlength=N_SCORES**2
+        ).reshape(N_SCORES, N_SCORES)
+    return confusions
+
+
+def judge_confusions(scores: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """Compare each judge's scores with the consensus scores.
+
+    Args:
+        scores (np.ndarray): score of each judge per volume, -1 when missing,
+         (n_volumes, n_judges)
+        labels (np.ndarray): consensus score per volume
+
+    Returns:
+        np.ndarray: (n_judges, N_SCORES, N_SCORES) matrices, rows are the
+         judge's scores and columns the consensus scores
+    """
+    n_judges = scores.shape[1]
+    confusions = np.zeros((n_judges, N_SCORES, N_SCORES), dtype=np.int64)
+    for judge in range(n_judges):
+        reviewed = scores[:, judge] >= 0
+        confusions[judge] = np.bincount(
+            scores[reviewed, judge] * N_SCORES + labels[reviewed],
+            minlength=N_SCORES**2,
+        ).reshape(N_SCORES, N_SCORES)
+    return confusions
+
+
+def aggregate_labels(
+    datasets: Iterable[str] = (), min_reviews: int = 1, chunk_size: int = 50000
+) -> dict:
+    """Write consensus labels to the volume_label table and report agreement.
+
+    Reviews are streamed once, ordered by volume, and every statistic is
+    accumulated chunk by chunk. Labels of the aggregated datasets are
+    replaced in a single transaction, other datasets keep theirs.
+
+    Args:
+        datasets (Iterable[str], optional): only aggregate these datasets.
+         Defaults to () (all datasets).
+        min_reviews (int, optional): skip volumes with fewer reviews.
+         Defaults to 1.
+        chunk_size (int, optional): number of reviews read at once.
+         Defaults to 50000.
+
+    Returns:
+        dict: agreement report, JSON serializable
+    """
+    datasets = list(datasets)
+    db = get_db()
+    judge_codes = [
+        row[0]
+        for row in db.execute("SELECT DISTINCT judge_code FROM review ORDER BY 1")
+    ]
+    judges = {judge: i for i, judge in enumerate(judge_codes)}
+    score_terms = FleissTerms(0.0, 0, np.zeros(N_SCORES, dtype=np.int64))
+    kept_terms = FleissTerms(0.0, 0, np.zeros(2, dtype=np.int64))
+    pairs = np.zeros((len(judges), len(judges), N_SCORES, N_SCORES), dtype=np.int64)
+    confusions = np.zeros((len(judges), N_SCORES, N_SCORES), dtype=np.int64)
+
+    # Labels of other datasets are kept, those of retired volumes are dropped
+    condition, params = _volume_filter(datasets, retired=True)
+    db.execute(
+        f"""DELETE FROM volume_label
+        WHERE vol_id IN (SELECT id FROM volume V WHERE {condition})""",
+        params,
+    )
+    for chunk in iter_review_chunks(judges, datasets, chunk_size):
+        n_reviews = chunk.counts.sum(axis=1)
+        chunk = ReviewChunk(*(field[n_reviews >= min_reviews] for field in chunk))
+        labels = consensus(chunk.counts, chunk.blur, chunk.lines)
+        db.executemany(
+            """INSERT INTO volume_label
+            (vol_id, score, blur, lines, kept, n_reviews, agreement)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            zip(
+                chunk.vol_ids.tolist(),
+                labels.score.tolist(),
+                labels.blur.tolist(),
+                labels.lines.tolist(),
+                np.isin(labels.score, KEPT_SCORES).tolist(),
+                chunk.counts.sum(axis=1).tolist(),
+                labels.agreement.tolist(),
+                strict=True,
+            ),
+        )
+        score_terms = _add_terms(score_terms, fleiss_terms(chunk.counts))
+        kept_terms = _add_terms(kept_terms, fleiss_terms(kept_counts(chunk.counts)))
+        pairs += pair_confusions(chunk.scores)
+        confusions += judge_confusions(chunk.scores, labels.score)
+    db.commit()
+
+    condition, params = _volume_filter(datasets)
+    kept_rates = db.execute(
+        f"""SELECT V.dataset, count(*) AS volumes, avg(L.kept) AS kept
+        FROM volume_label L
+        JOIN volume V ON V.id = L.vol_id
+        WHERE {condition}
+        GROUP BY V.dataset""",
+        params,
+    )
+    volumes, reviews = db.execute(
+        f"""SELECT count(*), coalesce(sum(L.n_reviews), 0)
+        FROM volume_label L
+        JOIN volume V ON V.id = L.vol_id
+        WHERE {condition}""",
+        params,
+    ).fetchone()
+    return {
+        "volumes": volumes,
+        "reviews": reviews,
+        "fleiss_kappa": {
+            "score": fleiss_kappa(score_terms),
+            "kept": fleiss_kappa(kept_terms),
+        },
+        "cohen_kappa": [
+            {
+                "judges": [judge_codes[a], judge_codes[b]],
+                "volumes": int(pairs[a, b].sum()),
+                "score": cohen_kappa(pairs[a, b]),
+                "kept": cohen_kappa(KEPT_MAP.T @ pairs[a, b] @ KEPT_MAP),
+            }
+            for a, b in itertools.combinations(range(len(judges)), 2)
+            if pairs[a, b].sum() > 0
+        ],
+        "confusion": {
+            judge: confusions[i].tolist()
+            for i, judge in enumerate(judge_codes)
+            if confusions[i].sum() > 0
+        },
+        "datasets": {
+            row["dataset"]: {"volumes": row["volumes"], "kept": row["kept"]}
+            for row in kept_rates
+        },
+    }
+
+
+def _add_terms(a: FleissTerms, b: FleissTerms) -> FleissTerms:
+    return FleissTerms(
+        a.agreement + b.agreement, a.volumes + b.volumes, a.totals + b.totals
+    )
+
+
+def write_labels(output: str, chunk_size: int = 10000) -> int:
+    """Write the volume_label table as a csv file.
+
+    Args:
+        output (str): csv file path
+        chunk_size (int, optional): number of rows read at once. Defaults to 10000.
+
+    Returns:
+        int: number of labels written
+    """
+    cursor = get_db().execute(
+        """SELECT L.vol_id, V.sub_id, V.ses_id, V.volume_path, V.dataset,
+            L.score, L.blur, L.lines, L.kept, L.n_reviews, L.agreement
+        FROM volume_label L
+        JOIN volume V ON V.id = L.vol_id
+        ORDER BY L.vol_id"""
+    )
+    count = 0
+    with open(output, "w", newline="", encoding="utf8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(LABEL_COLUMNS)
+        while rows := cursor.fetchmany(chunk_size):
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+@click.command("aggregate-labels")
+@click.option("-o", "--output", type=str, help="Csv file of consensus labels")
+@click.option("--report", type=str, default=None, help="Json file of agreement")
+@click.option("--dataset", multiple=True, help="Only aggregate this dataset")
+@click.option(
+    "--min_reviews",
+    type=int,
+    default=1,
+    help="Only label volumes with at least this number of reviews",
+)
+def aggregate_labels_command(
+    output: str | None, report: str | None, dataset: tuple[str, ...], min_reviews: int
+):
+    """Compute consensus labels and inter-rater agreement."""
+    results = aggregate_labels(dataset, min_reviews)
+    click.echo(
+        f"Labeled {results['volumes']} volumes from {results['reviews']} reviews."
+    )
+    click.echo(f"Fleiss' kappa: {results['fleiss_kappa']['score']}")
+    if output is not None:
+        write_labels(output)
+        click.echo(f"Write at {output}.")
+    if report is not None:
+        with open(report, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Write at {report}.")
+
+
+def init_app(app):
+    """Add commands to app."""
+    app.cli.add_command(aggregate_labels_command)
@@ -0,0 +1,25 @@
+-- Columns added for fast slice sampling and volume selection
+ALTER TABLE volume ADD COLUMN optimized_path TEXT;
+
+ALTER TABLE volume ADD COLUMN rand_key INTEGER NOT NULL DEFAULT 0;
+
+UPDATE volume SET rand_key = random();
+
+CREATE INDEX IF NOT EXISTS volume_rand_key_idx ON volume (rand_key);
+
+CREATE INDEX IF NOT EXISTS volume_dataset_idx ON volume (dataset);
+
+-- Keep only the latest review of a volume by a judge before enforcing uniqueness
+DELETE FROM review
+WHERE
+    id NOT IN (
+        SELECT max(id)
+        FROM review
+        GROUP BY judge_code, vol_id
+    );
+
+DROP INDEX IF EXISTS review_judge_vol_idx;
+
+CREATE UNIQUE INDEX review_judge_vol_idx ON review (judge_code, vol_id);
+
+CREATE INDEX review_judge_created_idx ON review (judge_code, created_at);
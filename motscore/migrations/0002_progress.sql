@@ -0,0 +1,65 @@
+-- Progress counters maintained by triggers, read by get_review_status
+CREATE TABLE
+    user_progress (
+        judge_code TEXT PRIMARY KEY,
+        done INTEGER NOT NULL DEFAULT 0,
+        kept INTEGER NOT NULL DEFAULT 0
+    );
+
+CREATE TABLE
+    volume_total (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        n_vol INTEGER NOT NULL DEFAULT 0
+    );
+
+INSERT INTO volume_total (id, n_vol) SELECT 1, count(*) FROM volume;
+
+INSERT INTO
+    user_progress (judge_code, done, kept)
+SELECT judge_code, count(*), sum(score IN (0, 1))
+FROM review
+GROUP BY judge_code;
+
+CREATE TRIGGER review_progress_insert AFTER INSERT ON review
+BEGIN
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code;
+END;
+
+CREATE TRIGGER review_progress_delete AFTER DELETE ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code;
+END;
+
+CREATE TRIGGER review_progress_update AFTER UPDATE OF judge_code, score ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code;
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code;
+END;
+
+CREATE TRIGGER volume_total_insert AFTER INSERT ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol + 1;
+END;
+
+CREATE TRIGGER volume_total_delete AFTER DELETE ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol - 1;
+END;
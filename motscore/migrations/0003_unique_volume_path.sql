@@ -0,0 +1,33 @@
+-- Merge duplicated volumes into the first inserted one before enforcing uniqueness
+UPDATE OR IGNORE review
+SET
+    vol_id = (
+        SELECT min(V2.id)
+        FROM volume V1
+        JOIN volume V2 ON V2.volume_path = V1.volume_path
+        WHERE V1.id = review.vol_id
+    )
+WHERE
+    vol_id NOT IN (
+        SELECT min(id)
+        FROM volume
+        GROUP BY volume_path
+    );
+
+DELETE FROM review
+WHERE
+    vol_id NOT IN (
+        SELECT min(id)
+        FROM volume
+        GROUP BY volume_path
+    );
+
+DELETE FROM volume
+WHERE
+    id NOT IN (
+        SELECT min(id)
+        FROM volume
+        GROUP BY volume_path
+    );
+
+CREATE UNIQUE INDEX volume_path_idx ON volume (volume_path);
@@ -0,0 +1,83 @@
+-- Volumes removed from their dataset are retired instead of deleted
+ALTER TABLE volume ADD COLUMN retired BOOLEAN NOT NULL DEFAULT False;
+
+DROP INDEX IF EXISTS volume_rand_key_idx;
+
+CREATE INDEX volume_retired_rand_key_idx ON volume (retired, rand_key);
+
+-- Retired volumes are not counted in the volumes to review
+DROP TRIGGER IF EXISTS volume_total_insert;
+
+DROP TRIGGER IF EXISTS volume_total_delete;
+
+CREATE TRIGGER volume_total_insert AFTER INSERT ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol + (NEW.retired = 0);
+END;
+
+CREATE TRIGGER volume_total_delete AFTER DELETE ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol - (OLD.retired = 0);
+END;
+
+CREATE TRIGGER volume_total_retire AFTER UPDATE OF retired ON volume
+BEGIN
+    UPDATE volume_total
+    SET n_vol = n_vol + (NEW.retired = 0) - (OLD.retired = 0);
+    UPDATE user_progress
+    SET done = done + (NEW.retired = 0) - (OLD.retired = 0),
+        kept = kept + ((NEW.retired = 0) - (OLD.retired = 0)) * (
+            SELECT R.score IN (0, 1) FROM review R
+            WHERE R.vol_id = NEW.id AND R.judge_code = user_progress.judge_code
+        )
+    WHERE judge_code IN (SELECT judge_code FROM review WHERE vol_id = NEW.id);
+END;
+
+-- Reviews of retired volumes are not counted in the user progress
+DROP TRIGGER IF EXISTS review_progress_insert;
+
+DROP TRIGGER IF EXISTS review_progress_delete;
+
+DROP TRIGGER IF EXISTS review_progress_update;
+
+CREATE TRIGGER review_progress_insert AFTER INSERT ON review
+BEGIN
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = NEW.vol_id AND retired
+    );
+END;
+
+CREATE TRIGGER review_progress_delete AFTER DELETE ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = OLD.vol_id AND retired
+    );
+END;
+
+CREATE TRIGGER review_progress_update AFTER UPDATE OF judge_code, score ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = OLD.vol_id AND retired
+    );
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = NEW.vol_id AND retired
+    );
+END;
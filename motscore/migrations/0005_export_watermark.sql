@@ -0,0 +1,8 @@
+-- Latest review time covered by each incremental export
+CREATE TABLE
+    export_watermark (
+        name TEXT PRIMARY KEY,
+        exported_until DATETIME NOT NULL
+    );
+
+CREATE INDEX review_created_idx ON review (created_at);
@@ -0,0 +1,15 @@
+-- Consensus labels written by the aggregate-labels command
+CREATE TABLE
+    volume_label (
+        vol_id INTEGER PRIMARY KEY,
+        score INTEGER NOT NULL,
+        blur BOOLEAN NOT NULL,
+        lines BOOLEAN NOT NULL,
+        kept BOOLEAN NOT NULL,
+        n_reviews INTEGER NOT NULL,
+        agreement REAL NOT NULL,
+        FOREIGN KEY (vol_id) REFERENCES volume (id)
+    );
+
+-- Reviews are grouped and self-joined by volume
+CREATE INDEX review_vol_score_idx ON review (vol_id, score);
@@ -0,0 +1,48 @@
+-- Reviews per volume, maintained by triggers, used to schedule assignments
+ALTER TABLE volume ADD COLUMN review_count INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE volume ADD COLUMN kept_count INTEGER NOT NULL DEFAULT 0;
+
+-- Reviewers disagree on keeping the volume
+ALTER TABLE volume ADD COLUMN disputed BOOLEAN GENERATED ALWAYS AS (
+    kept_count > 0 AND kept_count < review_count
+) VIRTUAL;
+
+UPDATE volume
+SET review_count = (SELECT count(*) FROM review R WHERE R.vol_id = volume.id),
+    kept_count = (
+        SELECT count(*) FROM review R
+        WHERE R.vol_id = volume.id AND R.score IN (0, 1)
+    );
+
+CREATE INDEX volume_retired_count_idx ON volume (retired, review_count, rand_key);
+
+CREATE INDEX volume_retired_disputed_idx ON volume (retired, disputed, rand_key);
+
+CREATE TRIGGER review_count_insert AFTER INSERT ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count + 1,
+        kept_count = kept_count + (NEW.score IN (0, 1))
+    WHERE id = NEW.vol_id;
+END;
+
+CREATE TRIGGER review_count_delete AFTER DELETE ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count - 1,
+        kept_count = kept_count - (OLD.score IN (0, 1))
+    WHERE id = OLD.vol_id;
+END;
+
+CREATE TRIGGER review_count_update AFTER UPDATE OF vol_id, score ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count - 1,
+        kept_count = kept_count - (OLD.score IN (0, 1))
+    WHERE id = OLD.vol_id;
+    UPDATE volume
+    SET review_count = review_count + 1,
+        kept_count = kept_count + (NEW.score IN (0, 1))
+    WHERE id = NEW.vol_id;
+END;
@@ -1,17 +1,37 @@
 """Module defining the main logique of MotionScore."""
 
-from flask import Blueprint, jsonify, render_template, request, session
+import os
+from typing import Any
 
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    make_response,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+
+from motscore import slice_cache
 from motscore.auth import login_required
 from motscore.db import (
-    get_last_reviewed_volume,
+    get_db,
+    get_last_reviewed_volumes,
     get_next_volume_to_review,
     get_review_status,
+    get_volume,
+    get_volumes_to_review,
+    is_reviewed,
     remove_review,
     score_volume,
+    write_reviews,
 )
+from motscore.prefetch import get_prefetcher
 from motscore.rand_bids import sampler
-from motscore.utils import array_to_str
+from motscore.score_writer import PendingScore, get_score_writer
+from motscore.utils import ENCODINGS
 
 bp = Blueprint("motionscore", __name__)
 
@@ -25,20 +45,102 @@ def index():
     )
 
 
-@bp.route("/get_slices", methods=["GET"])
-@login_required
-def get_slices():
-    """Retrieve and return slices from an unscored volumes."""
-    volume = get_next_volume_to_review(session["user_code"])
-    to_do, done, kept = get_review_status(session["user_code"])
-    slice1, slice2, slice3 = sampler.retrieve_three_slices(volume["volume_path"])
-    # Return slices as JSON response
+def pending_volumes(user_code: str) -> dict[int, int]:
+    """List a user's scores not written to the db yet.
+
+    Args:
+        user_code (str): user code to use
+
+    Returns:
+        dict[int, int]: score of each pending volume
+    """
+    writer = get_score_writer()
+    if writer is None:
+        return {}
+    return {score.vol_id: score.score for score in writer.pending(user_code)}
+
+
+def next_volume(user_code: str) -> Any | None:
+    """Select the next volume to review.
+
+    Volumes reserved by the prefetcher are served first, then the queue is
+    refilled so upcoming slices render while the user is scoring. Volumes
+    with a score waiting in the write-behind queue count as reviewed, and
+    volumes whose file was removed since the last sync are skipped.
+
+    Args:
+        user_code (str): user code to use
+
+    Returns:
+        Any | None: volume, None when all volumes are reviewed
+    """
+    prefetcher = get_prefetcher()
+    pending = pending_volumes(user_code)
+    volume = None
+    missing = []
+    if prefetcher is not None:
+        volume = prefetcher.pop(
+            user_code,
+            lambda vol_id: vol_id in pending or is_reviewed(user_code, vol_id),
+        )
+        if volume is not None and not os.path.exists(volume["volume_path"]):
+            missing.append(volume["id"])
+            volume = None
+
+    while volume is None:
+        volume = get_next_volume_to_review(user_code, exclude=[*pending, *missing])
+        if volume is None:
+            return None
+        if not os.path.exists(volume["volume_path"]):
+            missing.append(volume["id"])
+            volume = None
+
+    if prefetcher is not None:
+        upcoming = get_volumes_to_review(
+            user_code,
+            prefetcher.missing(user_code),
+            exclude=[
+                volume["id"],
+                *prefetcher.reserved(user_code),
+                *pending,
+                *missing,
+            ],
+        )
+        prefetcher.push(user_code, [dict(vol) for vol in upcoming])
+    return volume
+
+
+def volume_response(volume: Any, user_code: str) -> Response | tuple[Response, int]:
+    """Describe a volume to review and the user's progress.
+
+    Slices are not embedded, their URLs are given instead so the browser
+    fetches them in parallel and caches them. URLs carry the volume's cache
+    key, so they change whenever the slices do.
+
+    Args:
+        volume (Any): volume to review
+        user_code (str): user code to use
+
+    Returns:
+        Response | tuple[Response, int]: JSON response, 404 when the volume
+         file is missing
+    """
+    to_do, done, kept = get_review_status(user_code, pending_volumes(user_code).items())
+    try:
+        key = slice_cache.cache_key(
+            volume["volume_path"], slice_cache.get_render_settings(), volume["id"]
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "Volume file is missing."}), 404
     return jsonify(
         {
             "vol_id": volume["id"],
-            "slice1": array_to_str(slice1),
-            "slice2": array_to_str(slice2),
-            "slice3": array_to_str(slice3),
+            "slices": {
+                plane: url_for(
+                    "motionscore.get_slice", vol_id=volume["id"], plane=plane, v=key
+                )
+                for plane in sampler.PLANES
+            },
             "done": done,
             "to_do": to_do,
             "kept": kept,
@@ -46,39 +148,140 @@ def get_slices():
     )
 
 
-@bp.route("/score", methods=["POST"])
+@bp.route("/get_slices", methods=["GET"])
 @login_required
-def apply_score():
-    """Apply a score on a volume."""
+def get_slices():
+    """Return the next unscored volume with the URLs of its slices."""
+    volume = next_volume(session["user_code"])
+    if volume is None:
+        return jsonify({"error": "No volume left to review."}), 404
+    return volume_response(volume, session["user_code"])
+
+
+@bp.route("/slice/<int:vol_id>/<plane>", methods=["GET"])
+@login_required
+def get_slice(vol_id: int, plane: str):
+    """Send the encoded image of a volume's slice.
+
+    Responses may be cached by the browser indefinitely, as slice URLs change
+    with the volume file and rendering settings. The ETag is derived from the
+    same cache key, so revalidation requests are answered with 304 without
+    rendering anything.
+    """
+    volume = get_volume(vol_id)
+    if volume is None or volume["retired"] or plane not in sampler.PLANES:
+        return jsonify({"error": "No such slice."}), 404
+
+    settings = slice_cache.get_render_settings()
+    try:
+        key = slice_cache.cache_key(volume["volume_path"], settings, vol_id)
+        etag = f"{key}-{plane}"
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            slices = slice_cache.get_slices(
+                volume["volume_path"], volume["optimized_path"], vol_id
+            )
+            response = make_response(slices[sampler.PLANES.index(plane)])
+            response.content_type = ENCODINGS[settings.encoding.name][0]
+    except FileNotFoundError:
+        # The volume was removed from its dataset since the last sync
+        return jsonify({"error": "No such slice."}), 404
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+
+def record_score(judge_code: str, commit: bool = True) -> int:
+    """Record the score posted in the request.
+
+    With write-behind enabled, the score is queued and acknowledged before
+    being written.
+
+    Args:
+        judge_code (str): user code to use
+        commit (bool, optional): commit the review, otherwise the caller's
+         transaction is left open. Defaults to True.
+
+    Returns:
+        int: scored volume id
+    """
     vol_id = int(request.json.get("vol_id"))
     score = int(request.json.get("score"))
     blur = bool(request.json.get("blur"))
     lines = bool(request.json.get("lines"))
 
-    judge_code = session.get("user_code")
+    writer = get_score_writer()
+    if writer is not None:
+        writer.submit(PendingScore(judge_code, vol_id, score, blur, lines))
+    elif commit:
+        score_volume(judge_code, vol_id, score, blur, lines)
+    else:
+        write_reviews(get_db(), [(judge_code, vol_id, score, blur, lines)])
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.discard(judge_code, vol_id)
+    return vol_id
 
-    score_volume(judge_code, vol_id, score, blur, lines)
 
+@bp.route("/score", methods=["POST"])
+@login_required
+def apply_score():
+    """Apply a score on a volume."""
+    record_score(session.get("user_code"))
     return jsonify({"success": True})
 
 
+@bp.route("/score_and_next", methods=["POST"])
+@login_required
+def score_and_next():
+    """Apply a score on a volume and return the next volume to review.
+
+    The score is written and the next volume selected in a single
+    transaction, saving the round trip of a separate /get_slices. The score
+    is committed even if selecting the next volume fails.
+    """
+    judge_code = session["user_code"]
+    record_score(judge_code, commit=False)
+    try:
+        volume = next_volume(judge_code)
+        if volume is None:
+            return jsonify({"error": "Score saved, no volume left to review."}), 404
+        return volume_response(volume, judge_code)
+    finally:
+        get_db().commit()
+
+
 @bp.route("/back", methods=["GET"])
 @login_required
 def back():
-    """Remove review and resend previous slices."""
-    volume = get_last_reviewed_volume(session["user_code"])
-    remove_review(volume["id"], session["user_code"])
-    to_do, done, kept = get_review_status(session["user_code"])
-    slice1, slice2, slice3 = sampler.retrieve_three_slices(volume["volume_path"])
-    # Return slices as JSON response
-    return jsonify(
-        {
-            "vol_id": volume["id"],
-            "slice1": array_to_str(slice1),
-            "slice2": array_to_str(slice2),
-            "slice3": array_to_str(slice3),
-            "done": done,
-            "to_do": to_do,
-            "kept": kept,
-        }
-    )
+    """Remove reviews and resend the previous volume.
+
+    The `steps` query argument sets how many reviews are undone, the oldest
+    undone volume is sent. Nothing is undone when a volume file is missing.
+    """
+    steps = max(1, request.args.get("steps", 1, type=int))
+    writer = get_score_writer()
+    if writer is not None:
+        # Undo the latest scores, queued ones included
+        writer.flush()
+    volumes = get_last_reviewed_volumes(session["user_code"], steps)
+    if not volumes:
+        return jsonify({"error": "No review to undo."}), 404
+    if not all(os.path.exists(volume["volume_path"]) for volume in volumes):
+        return jsonify({"error": "Volume file is missing, review kept."}), 404
+    for volume in volumes:
+        remove_review(volume["id"], session["user_code"])
+    return volume_response(volumes[-1], session["user_code"])
+
+
+@bp.route("/prefetch_stats", methods=["GET"])
+@login_required
+def prefetch_stats():
+    """Report the prefetch queue hit rate."""
+    prefetcher = get_prefetcher()
+    if prefetcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **prefetcher.stats()})
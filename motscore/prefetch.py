@@ -0,0 +1,174 @@
+"""Module implementing the read-ahead queue of volumes to review."""
+
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from flask import current_app
+
+from motscore import slice_cache
+
+
+class Prefetcher:
+    """Reserve upcoming volumes per user and render their slices ahead of time.
+
+    Each user owns a bounded queue of volumes whose slices are rendered by a
+    background thread pool. Renders go through the shared slice renderer, so
+    slice requests of a reserved volume reuse its render, even one that is
+    still running.
+    """
+
+    def __init__(
+        self,
+        depth: int,
+        cache_dir: str | None,
+        workers: int = 2,
+        settings: slice_cache.RenderSettings = slice_cache.DEFAULT_RENDER,
+        renderer: slice_cache.SliceRenderer | None = None,
+    ):
+        """Create a new prefetcher.
+
+        Args:
+            depth (int): maximum number of volumes reserved per user
+            cache_dir (str | None): slice cache folder, None disables caching
+            workers (int, optional): number of render threads. Defaults to 2.
+            settings (slice_cache.RenderSettings, optional): rendering settings.
+             Defaults to slice_cache.DEFAULT_RENDER.
+            renderer (slice_cache.SliceRenderer | None, optional): renderer shared
+             with slice requests. Defaults to None (a new renderer).
+        """
+        self.depth = depth
+        self.cache_dir = cache_dir
+        self.settings = settings
+        self.renderer = renderer or slice_cache.SliceRenderer()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self._queues: dict[str, deque[dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.stale = 0
+
+    def reserved(self, user_code: str) -> list[int]:
+        """List volumes currently reserved for a user.
+
+        Args:
+            user_code (str): user code to use
+
+        Returns:
+            list[int]: reserved volume ids
+        """
+        with self._lock:
+            return [volume["id"] for volume in self._queues.get(user_code, ())]
+
+    def pop(
+        self, user_code: str, is_stale: Callable[[int], bool]
+    ) -> dict[str, Any] | None:
+        """Pop the next valid volume reserved for a user.
+
+        Args:
+            user_code (str): user code to use
+            is_stale (Callable[[int], bool]): tell if a volume id must be dropped,
+             typically because it has been reviewed since it was reserved
+
+        Returns:
+            dict[str, Any] | None: next volume, None if the queue is empty
+        """
+        while True:
+            with self._lock:
+                queue = self._queues.get(user_code)
+                if not queue:
+                    return None
+                volume = queue.popleft()
+            if not is_stale(volume["id"]):
+                return volume
+            with self._lock:
+                self.stale += 1
+
+    def discard(self, user_code: str, vol_id: int) -> None:
+        """Drop a volume from a user's queue.
+
+        Args:
+            user_code (str): user code to use
+            vol_id (int): volume to drop
+        """
+        with self._lock:
+            queue = self._queues.get(user_code)
+            if queue is None:
+                return
+            kept = [volume for volume in queue if volume["id"] != vol_id]
+            self.stale += len(queue) - len(kept)
+            self._queues[user_code] = deque(kept)
+
+    def missing(self, user_code: str) -> int:
+        """Count free slots in a user's queue.
+
+        Args:
+            user_code (str): user code to use
+
+        Returns:
+            int: number of volumes to reserve to fill the queue
+        """
+        with self._lock:
+            return max(0, self.depth - len(self._queues.get(user_code, ())))
+
+    def push(self, user_code: str, volumes: list[dict[str, Any]]) -> None:
+        """Reserve volumes for a user and start rendering their slices.
+
+        Args:
+            user_code (str): user code to use
+            volumes (list[dict[str, Any]]): volumes to reserve
+        """
+        with self._lock:
+            queue = self._queues.setdefault(user_code, deque())
+            for volume in volumes[: max(0, self.depth - len(queue))]:
+                self._executor.submit(
+                    self.renderer.load,
+                    volume["volume_path"],
+                    self.cache_dir,
+                    volume.get("optimized_path"),
+                    self.settings,
+                    volume["id"],
+                    prefetch=True,
+                )
+                queue.append(volume)
+
+    def stats(self) -> dict[str, float]:
+        """Report queue efficiency.
+
+        Hits are slices served from a render started by the prefetcher,
+        misses are slices it did not render ahead of time.
+
+        Returns:
+            dict[str, float]: hits, misses, stale entries and hit rate
+        """
+        with self._lock:
+            served, hits = self.renderer.served, self.renderer.prefetched
+            return {
+                "hits": hits,
+                "misses": served - hits,
+                "stale": self.stale,
+                "hit_rate": hits / served if served else 0.0,
+            }
+
+
+def get_prefetcher() -> Prefetcher | None:
+    """Fetch the app's prefetcher.
+
+    Returns:
+        Prefetcher | None: prefetcher, None when prefetching is disabled
+    """
+    return current_app.extensions.get("motscore.prefetch")
+
+
+def init_app(app):
+    """Attach a prefetcher to app when enabled."""
+    if app.config["PREFETCH_DEPTH"] > 0:
+        app.extensions["motscore.prefetch"] = Prefetcher(
+            app.config["PREFETCH_DEPTH"],
+            app.config["SLICE_CACHE"],
+            app.config["PREFETCH_WORKERS"],
+            slice_cache.render_settings(app.config),
+            app.extensions["motscore.slice_renderer"],
+        )
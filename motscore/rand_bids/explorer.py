@@ -1,30 +1,138 @@
 """Module implementing function to explore bids data."""
 
 import os
+import re
 from collections import namedtuple
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import bids
 
 Volume = namedtuple("Volume", ["sub_id", "ses_id", "path", "dataset"])
+IndexResult = namedtuple("IndexResult", ["dataset_path", "volumes", "error"])
+INDEXERS = ("fs", "pybids")
 
+BIDS_FILENAME = re.compile(
+    r"^sub-(?P<sub>[a-zA-Z0-9]+)"
+    r"(?:_ses-(?P<ses>[a-zA-Z0-9]+))?"
+    r"(?:_[a-zA-Z0-9]+-[a-zA-Z0-9]+)*"
+    r"_(?P<suffix>[a-zA-Z0-9]+)"
+    r"(?P<extension>\.[^_]+)$"
+)
 
-def list_volumes(dataset_path: str, modality: str = r"T1w") -> list[Volume]:
+
+def scan_volumes(
+    dataset_path: str, modality: str = r"T1w", extension: str = "nii.gz"
+) -> Iterator[Volume]:
+    """Lazily find volumes in dataset from BIDS file names.
+
+    Only `sub-*` folders are walked and no sidecar is parsed, which is much
+    faster than building a pybids layout but performs no validation.
+
+    Args:
+        dataset_path (str): path to dataset
+        modality (str): volume acquisition modality. Defaults to "T1w"
+        extension (str): volume file extension. Defaults to "nii.gz"
+
+    Yields:
+        Iterator[Volume]: volumes found, with an empty ses_id when the dataset
+         has no session
+    """
+    ds_name = os.path.basename(os.path.normpath(dataset_path))
+    extension = "." + extension.lstrip(".")
+    with os.scandir(dataset_path) as entries:
+        folders = [
+            entry.path
+            for entry in entries
+            if entry.name.startswith("sub-") and entry.is_dir()
+        ]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    folders.append(entry.path)
+                    continue
+                match = BIDS_FILENAME.match(entry.name)
+                if (
+                    match is not None
+                    and match["suffix"] == modality
+                    and match["extension"] == extension
+                ):
+                    yield Volume(
+                        match["sub"],
+                        match["ses"] or "",
+                        os.path.abspath(entry.path),
+                        ds_name,
+                    )
+
+
+def list_volumes(
+    dataset_path: str,
+    modality: str = r"T1w",
+    extension: str = "nii.gz",
+    indexer: str = "fs",
+) -> list[Volume]:
     """Return list of individual volume in dataset.
 
     Args:
         dataset_path (str): path to dataset
         modality (str): volume acquisition modality. Defaults to "T1w"
+        extension (str): volume file extension. Defaults to "nii.gz"
+        indexer (str): "fs" to scan file names, "pybids" to build a full
+         BIDS layout. Defaults to "fs"
 
     Returns:
         list[Volume]: list of volumes found
     """
+    if indexer == "fs":
+        return list(scan_volumes(dataset_path, modality, extension))
+    if indexer != "pybids":
+        raise ValueError(f"Unknown indexer: {indexer}")
+
     layout = bids.BIDSLayout(dataset_path, validate=False)
-    files = layout.get(suffix=modality, extension="nii.gz")
+    files = layout.get(suffix=modality, extension=extension)
     volumes = []
-    ds_name = os.path.basename(dataset_path)
+    ds_name = os.path.basename(os.path.normpath(dataset_path))
     for bids_volume in files:
         path = bids_volume.path
         sub = bids_volume.entities["subject"]
-        ses = bids_volume.entities["session"]
+        ses = bids_volume.entities.get("session", "")
         volumes.append(Volume(sub, ses, path, ds_name))
     return volumes
+
+
+def index_datasets(
+    dataset_paths: list[str],
+    jobs: int | None = None,
+    modality: str = r"T1w",
+    extension: str = "nii.gz",
+    indexer: str = "fs",
+) -> Iterator[IndexResult]:
+    """Index datasets concurrently in a process pool.
+
+    Results are yielded as soon as each dataset is indexed. A dataset failing
+    to index is reported in its result without stopping the others.
+
+    Args:
+        dataset_paths (list[str]): paths to datasets
+        jobs (int | None, optional): number of worker processes.
+         Defaults to None (CPU count).
+        modality (str): volume acquisition modality. Defaults to "T1w"
+        extension (str): volume file extension. Defaults to "nii.gz"
+        indexer (str): indexer used by `list_volumes`. Defaults to "fs"
+
+    Yields:
+        Iterator[IndexResult]: dataset path with its volumes, or the error raised
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(list_volumes, path, modality, extension, indexer): path
+            for path in dataset_paths
+        }
+        for future in as_completed(futures):
+            try:
+                yield IndexResult(futures[future], future.result(), None)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                yield IndexResult(futures[future], [], e)
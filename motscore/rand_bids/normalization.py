@@ -0,0 +1,88 @@
+"""Module to map MRI intensities to 8-bit grey levels."""
+
+from collections import namedtuple
+
+import numpy as np
+
+# Intensity range mapped to [0, 255]
+Window = namedtuple("Window", ["low", "high"])
+
+# How slices are normalized: "slice" windows each slice on its own min and
+# max, "minmax" and "percentile" compute one window per volume on a subsample
+# keeping one voxel every `stride` along each axis
+Normalization = namedtuple(
+    "Normalization",
+    ["method", "percentiles", "stride"],
+    defaults=["slice", (0.5, 99.5), 4],
+)
+DEFAULT_NORMALIZATION = Normalization()
+METHODS = ("slice", "minmax", "percentile")
+
+
+def compute_window(
+    data: np.ndarray, method: str = "minmax", percentiles=(0.5, 99.5)
+) -> Window:
+    """Compute the intensity window of an array.
+
+    Args:
+        data (np.ndarray): intensities, usually a volume subsample
+        method (str, optional): "minmax" or "percentile". Defaults to "minmax".
+        percentiles (tuple[float, float], optional): low and high percentiles
+         used by "percentile". Defaults to (0.5, 99.5).
+
+    Returns:
+        Window: intensity window
+    """
+    if method == "percentile":
+        low, high = np.percentile(data, percentiles)
+    elif method == "minmax":
+        low, high = data.min(), data.max()
+    else:
+        raise ValueError(f"Unknown normalization method: {method}")
+    return Window(float(low), float(high))
+
+
+def apply_window(image: np.ndarray, window: Window) -> np.ndarray:
+    """Map a window of intensities to [0, 255].
+
+    Computations are done in place on a single float32 copy. Values outside
+    the window are clipped and flat windows map to 0.
+
+    Args:
+        image (np.ndarray): image or volume
+        window (Window): intensity window
+
+    Returns:
+        np.ndarray: uint8 image
+    """
+    out = np.array(image, dtype=np.float32)
+    out -= window.low
+    if window.high > window.low:
+        out *= 255.0
+        out /= window.high - window.low
+        np.clip(out, 0.0, 255.0, out=out)
+    else:
+        out.fill(0.0)
+    return out.astype(np.uint8)
+
+
+def normalize_slices(
+    slices: list[np.ndarray],
+    sample: np.ndarray | None,
+    normalization: Normalization = DEFAULT_NORMALIZATION,
+) -> list[np.ndarray]:
+    """Normalize the slices of a volume.
+
+    Args:
+        slices (list[np.ndarray]): slices of a volume
+        sample (np.ndarray | None): volume subsample, ignored by "slice"
+        normalization (Normalization, optional): normalization settings.
+         Defaults to DEFAULT_NORMALIZATION.
+
+    Returns:
+        list[np.ndarray]: uint8 slices
+    """
+    if normalization.method == "slice":
+        return [apply_window(image, compute_window(image)) for image in slices]
+    window = compute_window(sample, normalization.method, normalization.percentiles)
+    return [apply_window(image, window) for image in slices]
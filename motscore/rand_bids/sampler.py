@@ -1,7 +1,30 @@
 """Module to sample slices from MRI volumes."""
 
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import nibabel as nib
 import numpy as np
+import SimpleITK as sitk
+
+from motscore.rand_bids import normalization
+
+# Voxel shifts from the center of each RPI axis (sagittal, coronal, axial)
+SLICE_SHIFTS = (-15, 0, -20)
+# Planes of the slices returned by `retrieve_three_slices`, in order
+PLANES = ("coronal", "sagittal", "axial")
+
+# Where slices are taken along each RPI axis: `slices_per_axis` slices at
+# `dim // 2 + shift + round(offset * dim)`, `offsets` being fractions of the
+# axis length (None spreads them evenly between -0.25 and 0.25), plus a
+# random shift of at most `jitter` voxels
+SamplingSpec = namedtuple(
+    "SamplingSpec",
+    ["slices_per_axis", "offsets", "shifts", "jitter"],
+    defaults=[1, None, SLICE_SHIFTS, 0],
+)
+DEFAULT_SAMPLING = SamplingSpec()
 
 
 def rescale(vol: np.ndarray) -> np.ndarray:
@@ -11,9 +34,23 @@ def rescale(vol: np.ndarray) -> np.ndarray:
         vol (np.ndarray): Numpy array containing the MRI
 
     Returns:
-        np.ndarray: Rescaled MRI
+        np.ndarray: Rescaled MRI, zeros if the MRI is flat
     """
-    return ((vol - vol.min()) * 255.0 / (vol.max() - vol.min())).astype(np.uint8)
+    return normalization.apply_window(vol, normalization.compute_window(vol))
+
+
+def rpi_transform(affine: np.ndarray) -> np.ndarray:
+    """Compute the orientation transform bringing a volume on the RPI axis.
+
+    Args:
+        affine (np.ndarray): volume affine
+
+    Returns:
+        np.ndarray: nibabel orientation transform
+    """
+    current_ornt = nib.orientations.io_orientation(affine)
+    target_ornt = nib.orientations.axcodes2ornt(("R", "P", "I"))
+    return nib.orientations.ornt_transform(current_ornt, target_ornt)
 
 
 def orient(vol: np.ndarray, affine: np.ndarray) -> np.ndarray:
@@ -28,10 +65,357 @@ def orient(vol: np.ndarray, affine: np.ndarray) -> np.ndarray:
     Returns:
         np.ndarray: oriented volume
     """
-    current_ornt = nib.orientations.io_orientation(affine)
-    target_ornt = nib.orientations.axcodes2ornt(("R", "P", "I"))
-    transform = nib.orientations.ornt_transform(current_ornt, target_ornt)
-    return nib.orientations.apply_orientation(vol, transform)
+    return nib.orientations.apply_orientation(vol, rpi_transform(affine))
+
+
+def rpi_shape(shape: tuple[int, ...], transform: np.ndarray) -> tuple[int, ...]:
+    """Compute the shape of a volume once oriented on the RPI axis.
+
+    Args:
+        shape (tuple[int, ...]): volume shape on disk
+        transform (np.ndarray): orientation transform from `rpi_transform`
+
+    Returns:
+        tuple[int, ...]: oriented shape
+    """
+    oriented = [0] * len(transform)
+    for in_axis, (out_axis, _) in enumerate(transform):
+        oriented[int(out_axis)] = shape[in_axis]
+    return tuple(oriented)
+
+
+def _disk_plane(transform: np.ndarray, shape: tuple[int, ...], axis: int, index: int):
+    in_axis = int(np.flatnonzero(transform[:, 0] == axis)[0])
+    if transform[in_axis, 1] < 0:
+        index = shape[in_axis] - 1 - index
+    return in_axis, index
+
+
+def read_planes(
+    nib_img: nib.spatialimages.SpatialImage,
+    transform: np.ndarray,
+    planes: list[tuple[int, int]],
+    chunk_bytes: int = 1 << 22,
+) -> list[np.ndarray]:
+    """Read RPI planes through the image data proxy.
+
+    Args:
+        nib_img (nib.spatialimages.SpatialImage): loaded image
+        transform (np.ndarray): orientation transform from `rpi_transform`
+        planes (list[tuple[int, int]]): (RPI axis, index) of each plane
+        chunk_bytes (int, optional): approximate size of streamed chunks.
+         Defaults to 4MB.
+
+    Returns:
+        list[np.ndarray]: planes oriented on the RPI axis
+    """
+    return read_planes_and_sample(nib_img, transform, planes, 0, chunk_bytes)[0]
+
+
+def _memmap(nib_img: nib.spatialimages.SpatialImage) -> np.memmap | None:
+    """Memory map the unscaled data of an uncompressed image.
+
+    Args:
+        nib_img (nib.spatialimages.SpatialImage): loaded image
+
+    Returns:
+        np.memmap | None: on-disk data, None for compressed files or images
+         not stored as a single array
+    """
+    filename = nib_img.file_map["image"].filename
+    dataobj = nib_img.dataobj
+    if (
+        filename is None
+        or nib.filename_parser.splitext_addext(filename)[2]
+        or not isinstance(dataobj, nib.arrayproxy.ArrayProxy)
+    ):
+        return None
+    return np.memmap(
+        filename,
+        dtype=dataobj.dtype,
+        mode="r",
+        offset=dataobj.offset,
+        shape=dataobj.shape,
+        order=dataobj.order,
+    )
+
+
+def read_planes_and_sample(
+    nib_img: nib.spatialimages.SpatialImage,
+    transform: np.ndarray,
+    planes: list[tuple[int, int]],
+    sample_stride: int = 0,
+    chunk_bytes: int = 1 << 22,
+) -> tuple[list[np.ndarray], np.ndarray | None]:
+    """Read RPI planes and a strided subsample of the volume.
+
+    The whole volume is never materialized and the native dtype is kept.
+    Uncompressed files are sliced through a memory map and only the extracted
+    voxels are scaled, while compressed files are streamed once by chunks
+    along the slowest on-disk axis, so gzip is decompressed a single time
+    whatever the number of planes. The subsample is gathered from the same
+    chunks.
+
+    Args:
+        nib_img (nib.spatialimages.SpatialImage): loaded image
+        transform (np.ndarray): orientation transform from `rpi_transform`
+        planes (list[tuple[int, int]]): (RPI axis, index) of each plane
+        sample_stride (int, optional): keep one voxel every `sample_stride`
+         along each axis in the subsample, 0 skips it. Defaults to 0.
+        chunk_bytes (int, optional): approximate size of streamed chunks.
+         Defaults to 4MB.
+
+    Returns:
+        tuple[list[np.ndarray], np.ndarray | None]: planes oriented on the RPI
+         axis and subsample in disk order, None if not requested
+    """
+    shape = nib_img.shape[:3]
+    on_disk = [_disk_plane(transform, shape, axis, index) for axis, index in planes]
+    slabs: list[np.ndarray] = []
+    sample = None
+
+    data = _memmap(nib_img)
+    if data is not None:
+        slope, inter = nib_img.dataobj.slope, nib_img.dataobj.inter
+        for in_axis, index in on_disk:
+            slicer = [slice(None)] * 3
+            slicer[in_axis] = slice(index, index + 1)
+            slabs.append(
+                nib.volumeutils.apply_read_scaling(
+                    np.array(data[tuple(slicer)]), slope, inter
+                )
+            )
+        if sample_stride:
+            stride = slice(None, None, sample_stride)
+            sample = nib.volumeutils.apply_read_scaling(
+                np.array(data[stride, stride, stride]), slope, inter
+            )
+    else:
+        slab_shapes = [
+            tuple(1 if ax == in_axis else dim for ax, dim in enumerate(shape))
+            for in_axis, _ in on_disk
+        ]
+        slabs = [
+            np.empty(slab_shape, nib_img.get_data_dtype()) for slab_shape in slab_shapes
+        ]
+        sample_chunks = []
+        step = max(1, chunk_bytes // (shape[0] * shape[1] * slabs[0].itemsize))
+        for start in range(0, shape[2], step):
+            chunk = np.asanyarray(nib_img.dataobj[:, :, start : start + step])
+            if chunk.dtype != slabs[0].dtype:
+                slabs = [slab.astype(chunk.dtype) for slab in slabs]
+            if sample_stride:
+                # Keep planes whose global index is a multiple of the stride,
+                # copied so the chunk itself can be freed
+                sample_chunks.append(
+                    chunk[
+                        ::sample_stride,
+                        ::sample_stride,
+                        (-start) % sample_stride :: sample_stride,
+                    ].copy()
+                )
+            for slab, (in_axis, index) in zip(slabs, on_disk, strict=True):
+                if in_axis == 2:
+                    if start <= index < start + step:
+                        slab[...] = chunk[:, :, index - start : index - start + 1]
+                elif in_axis == 1:
+                    slab[:, :, start : start + step] = chunk[:, index : index + 1]
+                else:
+                    slab[:, :, start : start + step] = chunk[index : index + 1]
+
+        if sample_stride:
+            sample = np.concatenate(sample_chunks, axis=2)
+
+    oriented = [
+        nib.orientations.apply_orientation(slab, transform).take(0, axis=axis)
+        for slab, (axis, _) in zip(slabs, planes, strict=True)
+    ]
+    return oriented, sample
+
+
+def slice_indices(
+    spec: SamplingSpec, dim_size: tuple[int, ...], seed: int | None = None
+) -> list[list[int]]:
+    """Compute the slice positions of a sampling spec.
+
+    Args:
+        spec (SamplingSpec): sampling spec
+        dim_size (tuple[int, ...]): volume shape on the RPI axis
+        seed (int | None, optional): jitter seed, typically the volume id, so
+         a volume is always sampled the same way. Defaults to None.
+
+    Returns:
+        list[list[int]]: slice indices along each RPI axis
+    """
+    offsets = spec.offsets
+    if offsets is None:
+        offsets = (
+            np.linspace(-0.25, 0.25, spec.slices_per_axis)
+            if spec.slices_per_axis > 1
+            else (0.0,)
+        )
+    if len(offsets) != spec.slices_per_axis:
+        raise ValueError("Sampling offsets must have one value per slice.")
+    rng = np.random.default_rng(seed)
+
+    indices = []
+    for dim, shift in zip(dim_size[:3], spec.shifts, strict=True):
+        jitters = (
+            rng.integers(-spec.jitter, spec.jitter, len(offsets), endpoint=True)
+            if spec.jitter
+            else [0] * len(offsets)
+        )
+        indices.append(
+            [
+                min(dim - 1, max(0, dim // 2 + shift + round(offset * dim) + int(jit)))
+                for offset, jit in zip(offsets, jitters, strict=True)
+            ]
+        )
+    return indices
+
+
+def _split_axes(slices: list[np.ndarray], spec: SamplingSpec):
+    k = spec.slices_per_axis
+    sagittal, coronal, axial = slices[:k], slices[k : 2 * k], slices[2 * k :]
+    return coronal, sagittal, axial
+
+
+def read_sampled_slices_nibabel(
+    vol_path: str, spec: SamplingSpec, seed: int | None, sample_stride: int
+) -> tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray], np.ndarray | None]:
+    """Read sampled slices with nibabel, see `read_sampled_slices`.
+
+    Only the requested planes are read, through the image data proxy.
+    """
+    nib_img = nib.load(vol_path, keep_file_open=True)
+    transform = rpi_transform(nib_img.affine)
+    indices = slice_indices(spec, rpi_shape(nib_img.shape, transform), seed)
+
+    planes = [
+        (axis, index)
+        for axis, axis_indices in enumerate(indices)
+        for index in axis_indices
+    ]
+    slices, sample = read_planes_and_sample(nib_img, transform, planes, sample_stride)
+    return *_split_axes([plane.T for plane in slices], spec), sample
+
+
+def read_sampled_slices_sitk(
+    vol_path: str, spec: SamplingSpec, seed: int | None, sample_stride: int
+) -> tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray], np.ndarray | None]:
+    """Read sampled slices with SimpleITK, see `read_sampled_slices`.
+
+    The volume is read with ITK's multithreaded reader, oriented with
+    `DICOMOrient` ("RPI" gives the same voxel order as nibabel's RPI axis
+    codes) and planes are cut with `Extract`.
+    """
+    image = sitk.ReadImage(vol_path)
+    sample = None
+    if sample_stride:
+        # Same voxels as the nibabel subsample, ITK arrays being in z, y, x order
+        stride = slice(None, None, sample_stride)
+        sample = sitk.GetArrayViewFromImage(image)[stride, stride, stride].copy()
+    image = sitk.DICOMOrient(image, "RPI")
+    size = image.GetSize()
+    indices = slice_indices(spec, size, seed)
+
+    slices = []
+    for axis, axis_indices in enumerate(indices):
+        extract_size = list(size)
+        extract_size[axis] = 0
+        for index in axis_indices:
+            extract_index = [0, 0, 0]
+            extract_index[axis] = index
+            plane = sitk.Extract(image, extract_size, extract_index)
+            slices.append(sitk.GetArrayFromImage(plane))
+    return *_split_axes(slices, spec), sample
+
+
+# Slice reading backends, selected by name
+BACKENDS = {
+    "nibabel": read_sampled_slices_nibabel,
+    "simpleitk": read_sampled_slices_sitk,
+}
+
+
+def read_sampled_slices(
+    vol_path: str,
+    spec: SamplingSpec = DEFAULT_SAMPLING,
+    seed: int | None = None,
+    sample_stride: int = 0,
+    backend: str = "nibabel",
+) -> tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray], np.ndarray | None]:
+    """Read the slices of a sampling spec from a single load, without rescaling.
+
+    Args:
+        vol_path (str): volume path
+        spec (SamplingSpec, optional): sampling spec. Defaults to DEFAULT_SAMPLING.
+        seed (int | None, optional): jitter seed. Defaults to None.
+        sample_stride (int, optional): stride of the volume subsample also
+         returned, 0 skips it. Defaults to 0.
+        backend (str, optional): one of `BACKENDS`. Defaults to "nibabel".
+
+    Returns:
+        tuple[list[np.ndarray], list[np.ndarray], list[np.ndarray], np.ndarray | None]:
+         coronal, sagittal and axial slices in the volume's dtype, and the
+         volume subsample
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown slice backend: {backend}")
+    return BACKENDS[backend](vol_path, spec, seed, sample_stride)
+
+
+def read_three_slices(
+    vol_path: str,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Read the three standard cuts of a volume, without rescaling.
+
+    Args:
+        vol_path (str): volume path
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: coronal, sagittal and axial
+         slices in the volume's dtype
+    """
+    (coronal,), (sagittal,), (axial,), _ = read_sampled_slices(vol_path)
+    return coronal, sagittal, axial
+
+
+def retrieve_contact_sheets(
+    vol_path: str,
+    spec: SamplingSpec = DEFAULT_SAMPLING,
+    seed: int | None = None,
+    norm: normalization.Normalization = normalization.DEFAULT_NORMALIZATION,
+    backend: str = "nibabel",
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Retrieve one contact sheet per plane, slices being stacked vertically.
+
+    All slices, and the subsample used to window intensities, are read from
+    a single load of the volume, so showing K slices per axis costs one
+    decompression instead of K.
+
+    Args:
+        vol_path (str): volume path
+        spec (SamplingSpec, optional): sampling spec. Defaults to DEFAULT_SAMPLING.
+        seed (int | None, optional): jitter seed. Defaults to None.
+        norm (normalization.Normalization, optional): intensity normalization.
+         Defaults to normalization.DEFAULT_NORMALIZATION.
+        backend (str, optional): one of `BACKENDS`. Defaults to "nibabel".
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: coronal, sagittal and axial
+         sheets
+    """
+    stride = 0 if norm.method == "slice" else norm.stride
+    *slices, sample = read_sampled_slices(vol_path, spec, seed, stride, backend)
+    k = spec.slices_per_axis
+    images = normalization.normalize_slices(
+        [image for images in slices for image in images], sample, norm
+    )
+    coronal, sagittal, axial = (
+        np.concatenate(images[i : i + k]) for i in range(0, len(images), k)
+    )
+    return coronal, sagittal, axial
 
 
 def retrieve_three_slices(
@@ -45,17 +429,125 @@ def retrieve_three_slices(
     Returns:
         tuple[np.ndarray, np.ndarray, np.ndarray]: slices
     """
-    nib_img = nib.load(vol_path)
-    vol: np.ndarray = orient(nib_img.get_fdata(), nib_img.affine)
+    return retrieve_contact_sheets(vol_path)
 
-    dim_size = vol.shape
 
-    slice_sagittal = vol.take(indices=max(0, dim_size[0] // 2 - 15), axis=0)
-    slice_coronal = vol.take(indices=max(0, dim_size[1] // 2), axis=1)
-    slice_axial = vol.take(indices=max(0, dim_size[2] // 2 - 20), axis=2)
+def rescale_batch(batch: np.ndarray) -> np.ndarray:
+    """Rescale each image of a batch between 0 and 255.
 
-    return (
-        rescale(slice_coronal.T),
-        rescale(slice_sagittal.T),
-        rescale(slice_axial.T),
-    )
+    NaN pixels are padding: they are ignored by the min and max and set
+    to 0. Flat images are set to 0. The batch is modified in place.
+
+    Args:
+        batch (np.ndarray): float images, the last two axes being rows and
+         columns
+
+    Returns:
+        np.ndarray: rescaled uint8 images
+    """
+    low = np.nanmin(batch, axis=(-2, -1), keepdims=True)
+    high = np.nanmax(batch, axis=(-2, -1), keepdims=True)
+    batch -= low
+    batch *= 255.0
+    # Flat images are already 0 once their minimum is removed
+    np.divide(batch, high - low, out=batch, where=high > low)
+    np.nan_to_num(batch, copy=False, nan=0.0)
+    return batch.astype(np.uint8)
+
+
+def _fit(image: np.ndarray, shape: tuple[int, int]) -> tuple[slice, ...]:
+    """Compute where an image lands once centered in a frame of given shape.
+
+    Returns:
+        tuple[slice, ...]: frame slices followed by image slices, images
+         larger than the frame are cropped
+    """
+    frame, crop = [], []
+    for dim, size in zip(image.shape, shape, strict=True):
+        if dim <= size:
+            start = (size - dim) // 2
+            frame.append(slice(start, start + dim))
+            crop.append(slice(None))
+        else:
+            start = (dim - size) // 2
+            frame.append(slice(None))
+            crop.append(slice(start, start + size))
+    return (*frame, *crop)
+
+
+def retrieve_slices_batch(
+    vol_paths: list[str],
+    shape: tuple[int, int] | None = None,
+    max_workers: int | None = None,
+    batch_size: int = 64,
+) -> np.ndarray:
+    """Retrieve the three standard slices of many volumes as one array.
+
+    Volumes are read by a bounded thread pool, decompression releasing the
+    GIL. Slices are centered in a common frame, padded with 0 or cropped,
+    and rescaled together, `batch_size` volumes at a time to bound the
+    memory of float intermediates.
+
+    Args:
+        vol_paths (list[str]): volume paths
+        shape (tuple[int, int] | None, optional): frame (height, width).
+         Defaults to None, the largest slice dimensions of the batch.
+        max_workers (int | None, optional): number of reading threads.
+         Defaults to None (ThreadPoolExecutor default).
+        batch_size (int, optional): number of volumes rescaled at once.
+         Defaults to 64.
+
+    Returns:
+        np.ndarray: uint8 array of shape (N, 3, height, width), slices being
+         coronal, sagittal and axial as in `retrieve_three_slices`
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        raw_slices = list(executor.map(read_three_slices, vol_paths))
+
+    if shape is None:
+        shape = (
+            max((img.shape[0] for slices in raw_slices for img in slices), default=0),
+            max((img.shape[1] for slices in raw_slices for img in slices), default=0),
+        )
+    batch = np.empty((len(raw_slices), len(PLANES), *shape), dtype=np.uint8)
+    for start in range(0, len(raw_slices), batch_size):
+        chunk = raw_slices[start : start + batch_size]
+        frames = np.full((len(chunk), len(PLANES), *shape), np.nan, np.float32)
+        for frame, slices in zip(frames, chunk, strict=True):
+            for plane, image in zip(frame, slices, strict=True):
+                placement = _fit(image, shape)
+                plane[placement[:2]] = image[placement[2:]]
+        batch[start : start + len(chunk)] = rescale_batch(frames)
+    return batch
+
+
+def transcode(vol_path: str, out_path: str) -> str:
+    """Write an uncompressed copy of a volume oriented on the RPI axis.
+
+    Slices of the copy can be read through a memory map without any
+    decompression or reorientation. The copy is skipped when it is already
+    more recent than the volume.
+
+    Args:
+        vol_path (str): volume path
+        out_path (str): path of the uncompressed copy, must end with ".nii"
+
+    Returns:
+        str: path of the copy
+    """
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(
+        vol_path
+    ):
+        return out_path
+
+    nib_img = nib.load(vol_path)
+    oriented = nib_img.as_reoriented(rpi_transform(nib_img.affine))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = f"{out_path}.tmp.nii"
+    try:
+        nib.save(oriented, tmp_path)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
@@ -4,6 +4,16 @@ DROP TABLE IF EXISTS volume;
 
 DROP TABLE IF EXISTS score;
 
+DROP TABLE IF EXISTS review;
+
+DROP TABLE IF EXISTS user_progress;
+
+DROP TABLE IF EXISTS volume_total;
+
+DROP TABLE IF EXISTS export_watermark;
+
+DROP TABLE IF EXISTS volume_label;
+
 CREATE TABLE
     user (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -17,9 +27,27 @@ CREATE TABLE
         sub_id TEXT NOT NULL,
         ses_id TEXT NOT NULL,
         volume_path TEXT NOT NULL,
-        dataset TEXT NOT NULL
+        dataset TEXT NOT NULL,
+        optimized_path TEXT,
+        rand_key INTEGER NOT NULL DEFAULT (random()),
+        retired BOOLEAN NOT NULL DEFAULT False,
+        review_count INTEGER NOT NULL DEFAULT 0,
+        kept_count INTEGER NOT NULL DEFAULT 0,
+        disputed BOOLEAN GENERATED ALWAYS AS (
+            kept_count > 0 AND kept_count < review_count
+        ) VIRTUAL
     );
 
+CREATE INDEX volume_retired_rand_key_idx ON volume (retired, rand_key);
+
+CREATE INDEX volume_retired_count_idx ON volume (retired, review_count, rand_key);
+
+CREATE INDEX volume_retired_disputed_idx ON volume (retired, disputed, rand_key);
+
+CREATE INDEX volume_dataset_idx ON volume (dataset);
+
+CREATE UNIQUE INDEX volume_path_idx ON volume (volume_path);
+
 CREATE TABLE
     review (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -31,4 +59,138 @@ CREATE TABLE
         created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (vol_id) REFERENCES volume (id),
         FOREIGN KEY (judge_code) REFERENCES user (user_code)
-    );
\ No newline at end of file
+    );
+
+CREATE UNIQUE INDEX review_judge_vol_idx ON review (judge_code, vol_id);
+
+CREATE INDEX review_judge_created_idx ON review (judge_code, created_at);
+
+CREATE INDEX review_created_idx ON review (created_at);
+
+CREATE INDEX review_vol_score_idx ON review (vol_id, score);
+
+CREATE TABLE
+    user_progress (
+        judge_code TEXT PRIMARY KEY,
+        done INTEGER NOT NULL DEFAULT 0,
+        kept INTEGER NOT NULL DEFAULT 0
+    );
+
+CREATE TABLE
+    volume_total (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        n_vol INTEGER NOT NULL DEFAULT 0
+    );
+
+INSERT INTO volume_total (id, n_vol) VALUES (1, 0);
+
+CREATE TABLE
+    export_watermark (
+        name TEXT PRIMARY KEY,
+        exported_until DATETIME NOT NULL
+    );
+
+CREATE TABLE
+    volume_label (
+        vol_id INTEGER PRIMARY KEY,
+        score INTEGER NOT NULL,
+        blur BOOLEAN NOT NULL,
+        lines BOOLEAN NOT NULL,
+        kept BOOLEAN NOT NULL,
+        n_reviews INTEGER NOT NULL,
+        agreement REAL NOT NULL,
+        FOREIGN KEY (vol_id) REFERENCES volume (id)
+    );
+
+CREATE TRIGGER review_progress_insert AFTER INSERT ON review
+BEGIN
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = NEW.vol_id AND retired
+    );
+END;
+
+CREATE TRIGGER review_progress_delete AFTER DELETE ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = OLD.vol_id AND retired
+    );
+END;
+
+CREATE TRIGGER review_progress_update AFTER UPDATE OF judge_code, score ON review
+BEGIN
+    UPDATE user_progress
+    SET done = done - 1, kept = kept - (OLD.score IN (0, 1))
+    WHERE judge_code = OLD.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = OLD.vol_id AND retired
+    );
+    INSERT INTO user_progress (judge_code)
+    SELECT NEW.judge_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM user_progress WHERE judge_code = NEW.judge_code
+    );
+    UPDATE user_progress
+    SET done = done + 1, kept = kept + (NEW.score IN (0, 1))
+    WHERE judge_code = NEW.judge_code AND NOT EXISTS (
+        SELECT 1 FROM volume WHERE id = NEW.vol_id AND retired
+    );
+END;
+
+CREATE TRIGGER volume_total_insert AFTER INSERT ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol + (NEW.retired = 0);
+END;
+
+CREATE TRIGGER volume_total_delete AFTER DELETE ON volume
+BEGIN
+    UPDATE volume_total SET n_vol = n_vol - (OLD.retired = 0);
+END;
+
+CREATE TRIGGER volume_total_retire AFTER UPDATE OF retired ON volume
+BEGIN
+    UPDATE volume_total
+    SET n_vol = n_vol + (NEW.retired = 0) - (OLD.retired = 0);
+    UPDATE user_progress
+    SET done = done + (NEW.retired = 0) - (OLD.retired = 0),
+        kept = kept + ((NEW.retired = 0) - (OLD.retired = 0)) * (
+            SELECT R.score IN (0, 1) FROM review R
+            WHERE R.vol_id = NEW.id AND R.judge_code = user_progress.judge_code
+        )
+    WHERE judge_code IN (SELECT judge_code FROM review WHERE vol_id = NEW.id);
+END;
+
+CREATE TRIGGER review_count_insert AFTER INSERT ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count + 1,
+        kept_count = kept_count + (NEW.score IN (0, 1))
+    WHERE id = NEW.vol_id;
+END;
+
+CREATE TRIGGER review_count_delete AFTER DELETE ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count - 1,
+        kept_count = kept_count - (OLD.score IN (0, 1))
+    WHERE id = OLD.vol_id;
+END;
+
+CREATE TRIGGER review_count_update AFTER UPDATE OF vol_id, score ON review
+BEGIN
+    UPDATE volume
+    SET review_count = review_count - 1,
+        kept_count = kept_count - (OLD.score IN (0, 1))
+    WHERE id = OLD.vol_id;
+    UPDATE volume
+    SET review_count = review_count + 1,
+        kept_count = kept_count + (NEW.score IN (0, 1))
+    WHERE id = NEW.vol_id;
+END;
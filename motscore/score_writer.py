@@ -0,0 +1,253 @@
+"""Module implementing the write-behind queue of scores."""
+
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+from motscore.db import connect, write_reviews
+
+PendingScore = namedtuple(
+    "PendingScore", ["judge_code", "vol_id", "score", "blur", "lines"]
+)
+# Queued by flush so the batch being gathered is written at once
+_FLUSH = object()
+
+
+class ScoreWriter:
+    """Acknowledge scores at once and write them in batches.
+
+    A single thread owns a db connection and commits queued scores in group
+    commits, once `batch_size` scores are queued or `interval` seconds after
+    the first one. Scores not committed yet are listed per user so reads can
+    take them into account. Batches are retried while the db is locked or
+    otherwise unavailable, only scores the db rejects are dropped.
+    """
+
+    def __init__(
+        self,
+        config,
+        batch_size: int = 64,
+        interval: float = 0.005,
+        logger: logging.Logger | None = None,
+        max_backoff: float = 1.0,
+    ):
+        """Create a new writer and start its thread.
+
+        Args:
+            config (flask.Config): app config used to open the db connection
+            batch_size (int, optional): maximum number of scores per commit.
+             Defaults to 64.
+            interval (float, optional): maximum time in seconds a score waits
+             for others before being committed. Defaults to 0.005.
+            logger (logging.Logger | None, optional): logger of failed writes.
+             Defaults to None (module logger).
+            max_backoff (float, optional): maximum wait in seconds between
+             retries of a batch while the db is unavailable. Defaults to 1.0.
+        """
+        self.config = config
+        self.batch_size = batch_size
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_backoff = max_backoff
+        self.batches = 0
+        self.written = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: dict[str, dict[int, PendingScore]] = {}
+        self._unwritten = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="score-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, score: PendingScore) -> None:
+        """Queue a score.
+
+        Args:
+            score (PendingScore): score to write
+
+        Raises:
+            RuntimeError: the writer thread is stopped
+        """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The score writer is stopped.")
+            self._pending.setdefault(score.judge_code, {})[score.vol_id] = score
+            self._unwritten += 1
+        self._queue.put(score)
+
+    def pending(self, judge_code: str) -> list[PendingScore]:
+        """List a user's scores not committed yet.
+
+        Args:
+            judge_code (str): user code to use
+
+        Returns:
+            list[PendingScore]: latest pending score of each volume
+        """
+        with self._condition:
+            return list(self._pending.get(judge_code, {}).values())
+
+    def flush(self) -> None:
+        """Wait until every queued score is committed.
+
+        Raises:
+            RuntimeError: the writer thread stopped before writing every score
+        """
+        self._queue.put(_FLUSH)
+        with self._condition:
+            self._condition.wait_for(lambda: self._unwritten == 0 or self._stopped)
+            if self._unwritten > 0:
+                raise RuntimeError(
+                    f"The score writer stopped with {self._unwritten} scores queued."
+                )
+
+    def close(self) -> None:
+        """Commit queued scores and stop the writer thread.
+
+        Scores left behind by a failed writer thread are written from the
+        calling thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        batch = []
+        while not self._queue.empty():
+            score = self._queue.get_nowait()
+            if score is not None and score is not _FLUSH:
+                batch.append(score)
+        if batch:
+            try:
+                db = connect(self.config)
+            except Exception:
+                self.logger.exception("Lost %d queued scores", len(batch))
+                self._done(batch)
+                return
+            try:
+                self._write(db, batch)
+            finally:
+                db.close()
+
+    def _run(self) -> None:
+        try:
+            db = connect(self.config)
+        except Exception:
+            self.logger.exception("Score writer failed to connect to the db")
+            self._stop()
+            return
+        try:
+            stop = False
+            while not stop:
+                score = self._queue.get()
+                if score is None:
+                    break
+                if score is _FLUSH:
+                    continue
+                batch = [score]
+                deadline = time.monotonic() + self.interval
+                while len(batch) < self.batch_size:
+                    try:
+                        score = self._queue.get(
+                            timeout=max(0.0, deadline - time.monotonic())
+                        )
+                    except queue.Empty:
+                        break
+                    if score is None:
+                        stop = True
+                        break
+                    if score is _FLUSH:
+                        break
+                    batch.append(score)
+                self._write(db, batch)
+        except Exception:
+            self.logger.exception("Score writer stopped")
+        finally:
+            db.close()
+            self._stop()
+
+    def _stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _commit(self, db: sqlite3.Connection, scores: list[PendingScore]) -> None:
+        delay = 0.01
+        while True:
+            try:
+                write_reviews(db, scores)
+                db.commit()
+                return
+            except sqlite3.OperationalError:
+                # The db is locked or unavailable, the scores are still valid
+                db.rollback()
+                self.logger.warning(
+                    "Failed to write %d scores, retrying in %.2fs",
+                    len(scores),
+                    delay,
+                    exc_info=True,
+                )
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def _write(self, db: sqlite3.Connection, batch: list[PendingScore]) -> None:
+        written = 0
+        try:
+            try:
+                self._commit(db, batch)
+                written = len(batch)
+            except sqlite3.Error:
+                db.rollback()
+                # Write scores one by one so a bad score does not drop its batch
+                for score in batch:
+                    try:
+                        self._commit(db, [score])
+                        written += 1
+                    except sqlite3.Error:
+                        db.rollback()
+                        self.logger.exception("Failed to write score %s", score)
+        except Exception:
+            self.logger.exception("Failed to write %d scores", len(batch) - written)
+        finally:
+            self._done(batch, written)
+
+    def _done(self, batch: list[PendingScore], written: int = 0) -> None:
+        with self._condition:
+            for score in batch:
+                user_pending = self._pending.get(score.judge_code, {})
+                # A newer score of the same volume may still be queued
+                if user_pending.get(score.vol_id) is score:
+                    del user_pending[score.vol_id]
+            self._unwritten -= len(batch)
+            self.batches += 1
+            self.written += written
+            self._condition.notify_all()
+
+
+def get_score_writer() -> ScoreWriter | None:
+    """Fetch the app's score writer.
+
+    Returns:
+        ScoreWriter | None: score writer, None when scores are written at once
+    """
+    return current_app.extensions.get("motscore.score_writer")
+
+
+def init_app(app):
+    """Attach a score writer to app when write-behind is enabled."""
+    if app.config["SCORE_WRITE_BEHIND"]:
+        writer = ScoreWriter(
+            app.config,
+            app.config["SCORE_BATCH_SIZE"],
+            app.config["SCORE_FLUSH_INTERVAL"],
+            app.logger,
+        )
+        app.extensions["motscore.score_writer"] = writer
+        # Queued scores are committed when the server shuts down
+        atexit.register(writer.close)
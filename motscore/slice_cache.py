@@ -0,0 +1,457 @@
+"""Module implementing the on-disk cache of rendered slices."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+
+import click
+from flask import current_app
+
+from motscore.db import get_db
+from motscore.rand_bids import normalization, sampler
+from motscore.utils import ENCODINGS, PNG, Encoding, encode_image, encoding_key
+
+SLICE_NAMES = ("slice1", "slice2", "slice3")
+# Encodings browsers can display, "raw" is left to the Python API and benchmarks
+SERVED_ENCODINGS = ("png", "webp", "jpeg")
+
+# How slices are read, sampled, normalized and encoded
+RenderSettings = namedtuple(
+    "RenderSettings",
+    ["encoding", "sampling", "normalization", "backend"],
+    defaults=[
+        PNG,
+        sampler.DEFAULT_SAMPLING,
+        normalization.DEFAULT_NORMALIZATION,
+        "nibabel",
+    ],
+)
+DEFAULT_RENDER = RenderSettings()
+
+
+def cache_key(
+    vol_path: str, settings: RenderSettings = DEFAULT_RENDER, seed: int | None = None
+) -> str:
+    """Compute the cache key of a volume's slices.
+
+    The key changes whenever the volume file is modified or the rendering
+    settings are updated, so stale entries are never served.
+
+    Args:
+        vol_path (str): volume path
+        settings (RenderSettings, optional): rendering settings.
+         Defaults to DEFAULT_RENDER.
+        seed (int | None, optional): sampling jitter seed, only part of the
+         key when jitter is enabled. Defaults to None.
+
+    Returns:
+        str: hexadecimal key
+    """
+    stat = os.stat(vol_path)
+    parts = [
+        os.path.abspath(vol_path),
+        str(stat.st_mtime_ns),
+        repr(tuple(settings.sampling)),
+        repr(tuple(settings.normalization)),
+        settings.backend,
+        encoding_key(settings.encoding),
+    ]
+    if settings.sampling.jitter:
+        parts.append(str(seed))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def _entry_dir(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def slice_files(encoding: Encoding = PNG) -> list[str]:
+    """List the file names of a cache entry.
+
+    Args:
+        encoding (Encoding, optional): slice encoding. Defaults to PNG.
+
+    Returns:
+        list[str]: one file name per slice
+    """
+    extension = ENCODINGS[encoding.name][1]
+    return [f"{name}.{extension}" for name in SLICE_NAMES]
+
+
+def read_slices(
+    cache_dir: str, key: str, encoding: Encoding = PNG
+) -> tuple[bytes, bytes, bytes] | None:
+    """Read cached slices.
+
+    Args:
+        cache_dir (str): cache root folder
+        key (str): cache key of the volume
+        encoding (Encoding, optional): slice encoding. Defaults to PNG.
+
+    Returns:
+        tuple[bytes, bytes, bytes] | None: encoded slices, None on a miss
+    """
+    entry = _entry_dir(cache_dir, key)
+    try:
+        slices = []
+        for name in slice_files(encoding):
+            with open(os.path.join(entry, name), "rb") as f:
+                slices.append(f.read())
+    except FileNotFoundError:
+        return None
+    return slices[0], slices[1], slices[2]
+
+
+def write_slices(
+    cache_dir: str, key: str, slices: tuple[bytes, ...], encoding: Encoding = PNG
+) -> None:
+    """Store slices in the cache.
+
+    Slices are written in a temporary folder then renamed, so readers never
+    see a partially written entry.
+
+    Args:
+        cache_dir (str): cache root folder
+        key (str): cache key of the volume
+        slices (tuple[bytes, ...]): encoded slices
+        encoding (Encoding, optional): slice encoding. Defaults to PNG.
+    """
+    entry = _entry_dir(cache_dir, key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    for name, data in zip(slice_files(encoding), slices, strict=True):
+        with open(os.path.join(tmp_entry, name), "wb") as f:
+            f.write(data)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another worker already stored this entry
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def render_slices(
+    vol_path: str, settings: RenderSettings = DEFAULT_RENDER, seed: int | None = None
+) -> tuple[bytes, bytes, bytes]:
+    """Sample and encode the three slices, or contact sheets, of a volume.
+
+    Args:
+        vol_path (str): path of the file to sample
+        settings (RenderSettings, optional): rendering settings.
+         Defaults to DEFAULT_RENDER.
+        seed (int | None, optional): sampling jitter seed. Defaults to None.
+
+    Returns:
+        tuple[bytes, bytes, bytes]: encoded slices
+    """
+    encoding = settings.encoding
+    slice1, slice2, slice3 = (
+        encode_image(arr, encoding.name, **encoding.options)
+        for arr in sampler.retrieve_contact_sheets(
+            vol_path,
+            settings.sampling,
+            seed,
+            settings.normalization,
+            settings.backend,
+        )
+    )
+    return slice1, slice2, slice3
+
+
+def load_slices(
+    vol_path: str,
+    cache_dir: str | None,
+    source_path: str | None = None,
+    settings: RenderSettings = DEFAULT_RENDER,
+    seed: int | None = None,
+) -> tuple[bytes, bytes, bytes]:
+    """Retrieve slices from the cache, rendering and storing them on a miss.
+
+    Args:
+        vol_path (str): volume path
+        cache_dir (str | None): cache root folder, None disables caching
+        source_path (str | None, optional): uncompressed RPI copy of the volume
+         to sample instead of vol_path. Defaults to None.
+        settings (RenderSettings, optional): rendering settings.
+         Defaults to DEFAULT_RENDER.
+        seed (int | None, optional): sampling jitter seed. Defaults to None.
+
+    Returns:
+        tuple[bytes, bytes, bytes]: encoded slices
+    """
+    if cache_dir is None:
+        return render_slices(source_path or vol_path, settings, seed)
+
+    key = cache_key(vol_path, settings, seed)
+    slices = read_slices(cache_dir, key, settings.encoding)
+    if slices is None:
+        slices = render_slices(source_path or vol_path, settings, seed)
+        write_slices(cache_dir, key, slices, settings.encoding)
+    return slices
+
+
+class SliceRenderer:
+    """Share renders of a volume between concurrent and repeated requests.
+
+    The three planes of a volume are requested in parallel by the browser,
+    and ahead of time by the prefetcher. The first caller loads the slices,
+    callers arriving meanwhile wait for its result, and the slices of the
+    latest volumes are kept in memory for the requests that follow.
+    """
+
+    def __init__(self, recent: int = 32):
+        """Create a new renderer.
+
+        Args:
+            recent (int, optional): number of volumes whose slices are kept in
+             memory. Defaults to 32.
+        """
+        self.recent = recent
+        self.renders = 0
+        self.served = 0
+        self.prefetched = 0
+        # Entries also tell whether the prefetcher started the render
+        self._inflight: dict[str, tuple[Future, bool]] = {}
+        self._recent: OrderedDict[str, tuple[tuple[bytes, bytes, bytes], bool]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def load(
+        self,
+        vol_path: str,
+        cache_dir: str | None,
+        source_path: str | None = None,
+        settings: RenderSettings = DEFAULT_RENDER,
+        seed: int | None = None,
+        prefetch: bool = False,
+    ) -> tuple[bytes, bytes, bytes]:
+        """Retrieve slices, loading them at most once at a time per volume.
+
+        Args:
+            vol_path (str): volume path
+            cache_dir (str | None): cache root folder, None disables caching
+            source_path (str | None, optional): uncompressed RPI copy of the
+             volume to sample instead of vol_path. Defaults to None.
+            settings (RenderSettings, optional): rendering settings.
+             Defaults to DEFAULT_RENDER.
+            seed (int | None, optional): sampling jitter seed. Defaults to None.
+            prefetch (bool, optional): the slices are loaded ahead of time rather
+             than served. Defaults to False.
+
+        Returns:
+            tuple[bytes, bytes, bytes]: encoded slices
+        """
+        key = cache_key(vol_path, settings, seed)
+        with self._lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                slices, prefetched = self._recent[key]
+                self._count(prefetch, prefetched)
+                return slices
+            if key in self._inflight:
+                future, prefetched = self._inflight[key]
+                self._count(prefetch, prefetched)
+                owner = False
+            else:
+                future = Future()
+                self._inflight[key] = (future, prefetch)
+                self._count(prefetch, prefetch)
+                self.renders += 1
+                owner = True
+        if not owner:
+            return future.result()
+
+        try:
+            slices = load_slices(vol_path, cache_dir, source_path, settings, seed)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            if self.recent > 0:
+                self._recent[key] = (slices, prefetch)
+                while len(self._recent) > self.recent:
+                    self._recent.popitem(last=False)
+        future.set_result(slices)
+        return slices
+
+    def _count(self, prefetch: bool, prefetched: bool) -> None:
+        if not prefetch:
+            self.served += 1
+            if prefetched:
+                self.prefetched += 1
+
+
+def get_renderer() -> SliceRenderer:
+    """Fetch the app's slice renderer.
+
+    Returns:
+        SliceRenderer: renderer shared by slice requests and the prefetcher
+    """
+    return current_app.extensions["motscore.slice_renderer"]
+
+
+def render_settings(config) -> RenderSettings:
+    """Build rendering settings from an app config.
+
+    Args:
+        config (flask.Config): app config
+
+    Returns:
+        RenderSettings: settings set by `SLICE_ENCODING`,
+         `SLICE_ENCODING_OPTIONS`, `SLICE_SAMPLING`, `SLICE_NORMALIZATION`
+         and `SLICE_BACKEND`
+    """
+    sampling = dict(config["SLICE_SAMPLING"])
+    for field in ("offsets", "shifts"):
+        if sampling.get(field) is not None:
+            sampling[field] = tuple(sampling[field])
+    norm = dict(config["SLICE_NORMALIZATION"])
+    if "percentiles" in norm:
+        norm["percentiles"] = tuple(norm["percentiles"])
+    if norm.get("method", "slice") not in normalization.METHODS:
+        raise ValueError(f"Unknown normalization method: {norm['method']}")
+    if config["SLICE_BACKEND"] not in sampler.BACKENDS:
+        raise ValueError(f"Unknown SLICE_BACKEND: {config['SLICE_BACKEND']}")
+    return RenderSettings(
+        Encoding(config["SLICE_ENCODING"], config["SLICE_ENCODING_OPTIONS"]),
+        sampler.SamplingSpec(**sampling),
+        normalization.Normalization(**norm),
+        config["SLICE_BACKEND"],
+    )
+
+
+def get_render_settings() -> RenderSettings:
+    """Fetch the rendering settings configured for the app.
+
+    Returns:
+        RenderSettings: app's rendering settings
+    """
+    return render_settings(current_app.config)
+
+
+def get_slices(
+    vol_path: str, source_path: str | None = None, seed: int | None = None
+) -> tuple[bytes, bytes, bytes]:
+    """Retrieve slices using the app's cache and renderer.
+
+    Args:
+        vol_path (str): volume path
+        source_path (str | None, optional): uncompressed RPI copy of the volume.
+         Defaults to None.
+        seed (int | None, optional): sampling jitter seed, the volume id.
+         Defaults to None.
+
+    Returns:
+        tuple[bytes, bytes, bytes]: encoded slices
+    """
+    return get_renderer().load(
+        vol_path,
+        current_app.config["SLICE_CACHE"],
+        source_path,
+        get_render_settings(),
+        seed,
+    )
+
+
+def _precompute_volume(
+    vol_path: str,
+    source_path: str | None,
+    seed: int | None,
+    cache_dir: str,
+    settings: RenderSettings,
+) -> bool:
+    key = cache_key(vol_path, settings, seed)
+    if read_slices(cache_dir, key, settings.encoding) is not None:
+        return False
+    slices = render_slices(source_path or vol_path, settings, seed)
+    write_slices(cache_dir, key, slices, settings.encoding)
+    return True
+
+
+def precompute_slices(
+    vol_paths: list[tuple[str, str | None, int | None]],
+    cache_dir: str,
+    jobs: int | None = None,
+    settings: RenderSettings = DEFAULT_RENDER,
+) -> tuple[int, int, list[str]]:
+    """Render slices of many volumes into the cache using a process pool.
+
+    Args:
+        vol_paths (list[tuple[str, str | None, int | None]]): volumes to render,
+         with their uncompressed RPI copy if any and their sampling seed
+        cache_dir (str): cache root folder
+        jobs (int | None, optional): number of worker processes.
+         Defaults to None (CPU count).
+        settings (RenderSettings, optional): rendering settings.
+         Defaults to DEFAULT_RENDER.
+
+    Returns:
+        tuple[int, int, list[str]]: number of rendered volumes, number of
+         volumes already cached and paths that failed
+    """
+    rendered, cached, failed = 0, 0, []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                _precompute_volume, path, source_path, seed, cache_dir, settings
+            ): path
+            for path, source_path, seed in vol_paths
+        }
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    rendered += 1
+                else:
+                    cached += 1
+            except Exception:  # pylint: disable=broad-exception-caught
+                failed.append(futures[future])
+    return rendered, cached, failed
+
+
+@click.command("precompute-slices")
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of worker processes. Defaults to the number of CPUs",
+)
+def precompute_slices_command(jobs: int | None):
+    """Render the slices of every volume into the slice cache."""
+    cache_dir = current_app.config["SLICE_CACHE"]
+    if cache_dir is None:
+        raise click.UsageError("SLICE_CACHE is not configured.")
+
+    vol_paths = [
+        (row["volume_path"], row["optimized_path"], row["id"])
+        for row in get_db()
+        .execute("SELECT id, volume_path, optimized_path FROM volume")
+        .fetchall()
+    ]
+    rendered, cached, failed = precompute_slices(
+        vol_paths, cache_dir, jobs, get_render_settings()
+    )
+    for path in failed:
+        click.echo(f"Failed to render {path}.", err=True)
+    click.echo(f"Rendered {rendered} volumes ({cached} already cached).")
+
+
+def init_app(app):
+    """Check the rendering settings, attach a renderer and add commands to app."""
+    if app.config["SLICE_ENCODING"] not in SERVED_ENCODINGS:
+        raise ValueError(
+            f"SLICE_ENCODING must be one of {SERVED_ENCODINGS}, "
+            f"got {app.config['SLICE_ENCODING']}"
+        )
+    render_settings(app.config)
+    app.extensions["motscore.slice_renderer"] = SliceRenderer(
+        app.config["SLICE_MEMORY_CACHE"]
+    )
+    app.cli.add_command(precompute_slices_command)
@@ -2,10 +2,89 @@
 
 import base64
 import io
+import time
+from collections import namedtuple
 
 import numpy as np
 from PIL import Image
 
+# Encoding name to (MIME type, file extension)
+ENCODINGS = {
+    "png": ("image/png", "png"),
+    "webp": ("image/webp", "webp"),
+    "jpeg": ("image/jpeg", "jpg"),
+    "raw": ("application/x-npy", "npy"),
+}
+
+Encoding = namedtuple("Encoding", ["name", "options"], defaults=[{}])
+PNG = Encoding("png")
+
+EncodingReport = namedtuple("EncodingReport", ["encoding", "seconds", "n_bytes"])
+
+
+def encode_image(array: np.ndarray, encoding: str = "png", **options) -> bytes:
+    """Encode an image array.
+
+    Args:
+        array (np.ndarray): array to encode
+        encoding (str, optional): one of `ENCODINGS`. "raw" stores the array
+         itself in the numpy .npy format. Defaults to "png".
+        **options: encoder options, forwarded to Pillow (e.g. `compress_level`
+         for PNG, `lossless` or `quality` for WebP, `quality` for JPEG)
+
+    Returns:
+        bytes: encoded image
+    """
+    raw_bytes = io.BytesIO()
+    if encoding == "raw":
+        np.save(raw_bytes, array, allow_pickle=False)
+    elif encoding == "png":
+        Image.fromarray(array).save(raw_bytes, "PNG", **options)
+    elif encoding == "webp":
+        Image.fromarray(array).save(raw_bytes, "WEBP", **{"lossless": True, **options})
+    elif encoding == "jpeg":
+        Image.fromarray(array).save(raw_bytes, "JPEG", **{"quality": 95, **options})
+    else:
+        raise ValueError(f"Unknown encoding: {encoding}")
+    return raw_bytes.getvalue()
+
+
+def encoding_key(encoding: Encoding) -> str:
+    """Describe an encoding and its options as a stable string.
+
+    Args:
+        encoding (Encoding): encoding to describe
+
+    Returns:
+        str: description, equal for equal settings
+    """
+    options = ",".join(f"{k}={v!r}" for k, v in sorted(encoding.options.items()))
+    return f"{encoding.name}({options})"
+
+
+def array_to_png(array: np.ndarray) -> bytes:
+    """Encode an image array as PNG bytes.
+
+    Args:
+        array (np.ndarray): array to encode
+
+    Returns:
+        bytes: PNG encoded image
+    """
+    return encode_image(array, "png")
+
+
+def bytes_to_str(raw_bytes: bytes) -> str:
+    """Convert encoded image bytes to base64 string for HTML display.
+
+    Args:
+        raw_bytes (bytes): encoded image
+
+    Returns:
+        str: base64 encoding
+    """
+    return base64.b64encode(raw_bytes).decode("utf-8")
+
 
 def array_to_str(array: np.ndarray) -> str:
     """Convert image array base64 string for HTML display.
@@ -16,9 +95,34 @@ def array_to_str(array: np.ndarray) -> str:
     Returns:
         str: base64  encoding
     """
-    img = Image.fromarray(array)
-    raw_bytes = io.BytesIO()
-    img.save(raw_bytes, "PNG")
-    raw_bytes.seek(0)
-    img_base64 = base64.b64encode(raw_bytes.read())
-    return img_base64.decode("utf-8")
+    return bytes_to_str(array_to_png(array))
+
+
+def benchmark_encodings(
+    arrays: list[np.ndarray],
+    encodings: list[Encoding],
+    repeat: int = 5,
+) -> list[EncodingReport]:
+    """Measure encode time and output size of encodings.
+
+    Args:
+        arrays (list[np.ndarray]): images to encode, usually a volume's slices
+        encodings (list[Encoding]): encodings to compare
+        repeat (int, optional): number of timed runs. Defaults to 5.
+
+    Returns:
+        list[EncodingReport]: best time and total size to encode all arrays,
+         for each encoding
+    """
+    reports = []
+    for encoding in encodings:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n_bytes = sum(
+                len(encode_image(arr, encoding.name, **encoding.options))
+                for arr in arrays
+            )
+            best = min(best, time.perf_counter() - start)
+        reports.append(EncodingReport(encoding, best, n_bytes))
+    return reports
@@ -18,6 +18,9 @@ def fixt_init_test_db():
         {
             "TESTING": True,
             "DATABASE": os.path.join("tests", "test.sqlite"),
+            # The db file is deleted between tests while pooled connections
+            # may still be open, which is only safe without WAL
+            "DB_JOURNAL_MODE": "delete",
         }
     )
     with app.test_request_context("/", method="POST"):
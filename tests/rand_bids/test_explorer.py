@@ -1,4 +1,9 @@
-from motscore.rand_bids.explorer import list_volumes
+import os
+from collections.abc import Iterator
+
+import pytest
+
+from motscore.rand_bids.explorer import index_datasets, list_volumes, scan_volumes
 from tests import conftest as testconfig
 
 
@@ -7,3 +12,72 @@ def test_list_volumes():
     volumes = list_volumes(path)
 
     assert len(volumes) == 3
+
+
+def test_index_datasets():
+    paths = [
+        "tests/data/multiple/bids_01",
+        "tests/data/multiple/bids_02",
+        "tests/data/missing",
+    ]
+    results = {res.dataset_path: res for res in index_datasets(paths, jobs=2)}
+
+    assert set(results) == set(paths)
+    assert len(results["tests/data/multiple/bids_01"].volumes) == 1
+    assert len(results["tests/data/multiple/bids_02"].volumes) == 2
+    assert results["tests/data/multiple/bids_02"].error is None
+    assert results["tests/data/missing"].volumes == []
+    assert results["tests/data/missing"].error is not None
+
+
+@pytest.fixture
+def sessionless_dataset(tmp_path):
+    root = tmp_path / "sessionless"
+    files = [
+        "sub-01/anat/sub-01_T1w.nii.gz",
+        "sub-01/anat/sub-01_T1w.json",
+        "sub-02/anat/sub-02_acq-mprage_run-1_T1w.nii.gz",
+        "sub-02/anat/sub-02_T2w.nii.gz",
+        "sub-03/anat/sub-03_T1w.nii",
+        "derivatives/sub-01/anat/sub-01_T1w.nii.gz",
+    ]
+    for name in files:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(b"{}" if name.endswith(".json") else b"")
+    (root / "dataset_description.json").write_text(
+        '{"Name": "sessionless", "BIDSVersion": "1.8.0"}'
+    )
+    return str(root)
+
+
+def test_scan_volumes_sessionless(sessionless_dataset):
+    volumes = scan_volumes(sessionless_dataset)
+    assert isinstance(volumes, Iterator)
+
+    volumes = sorted(volumes)
+    assert [(vol.sub_id, vol.ses_id) for vol in volumes] == [("01", ""), ("02", "")]
+    assert all(vol.dataset == "sessionless" for vol in volumes)
+    assert all(os.path.isabs(vol.path) for vol in volumes)
+
+
+def test_scan_volumes_modality_extension(sessionless_dataset):
+    t2w = list(scan_volumes(sessionless_dataset, modality="T2w"))
+    assert [vol.sub_id for vol in t2w] == ["02"]
+
+    nii = list(scan_volumes(sessionless_dataset, extension=".nii"))
+    assert [vol.sub_id for vol in nii] == ["03"]
+
+
+def test_list_volumes_indexers(sessionless_dataset):
+    fs_volumes = sorted(list_volumes(sessionless_dataset, indexer="fs"))
+    pybids_volumes = sorted(list_volumes(sessionless_dataset, indexer="pybids"))
+    assert fs_volumes == pybids_volumes
+
+    with pytest.raises(ValueError):
+        list_volumes(sessionless_dataset, indexer="unknown")
+
+
+def test_list_volumes_pybids():
+    volumes = list_volumes(testconfig.TEST_SYNTETHIC_PATH, indexer="pybids")
+
+    assert sorted(volumes) == sorted(list_volumes(testconfig.TEST_SYNTETHIC_PATH))
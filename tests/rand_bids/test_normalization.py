@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from motscore.rand_bids import normalization
+
+
+def test_compute_window():
+    data = np.arange(1001, dtype=np.int16)
+
+    assert normalization.compute_window(data) == (0, 1000)
+    assert normalization.compute_window(data, "percentile", (1, 99)) == (10, 990)
+    with pytest.raises(ValueError):
+        normalization.compute_window(data, "median")
+
+
+def test_apply_window_clips():
+    image = np.array([[-10, 0, 50], [100, 200, 1000]], dtype=np.int16)
+
+    result = normalization.apply_window(image, normalization.Window(0, 100))
+
+    assert result.dtype == np.uint8
+    assert result.tolist() == [[0, 0, 127], [255, 255, 255]]
+
+
+def test_apply_window_flat():
+    image = np.full((4, 4), 7, dtype=np.float64)
+
+    result = normalization.apply_window(image, normalization.compute_window(image))
+
+    assert not result.any()
+
+
+def test_normalize_slices_shares_volume_window():
+    slices = [np.full((2, 2), 10.0), np.full((2, 2), 20.0)]
+    sample = np.array([0.0, 40.0])
+
+    per_slice = normalization.normalize_slices(slices, sample)
+    per_volume = normalization.normalize_slices(
+        slices, sample, normalization.Normalization("minmax")
+    )
+
+    assert not per_slice[0].any() and not per_slice[1].any()
+    assert per_volume[0][0, 0] == 63
+    assert per_volume[1][0, 0] == 127
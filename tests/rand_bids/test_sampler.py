@@ -1,6 +1,8 @@
+import nibabel as nib
 import numpy as np
+import pytest
 
-from motscore.rand_bids import sampler
+from motscore.rand_bids import normalization, sampler
 from tests import conftest as testconfig
 
 
@@ -31,3 +33,216 @@ def test_retrieve_three_slices():
     assert len(slices) == 3
     assert slices[0].ndim == 2
     assert slices[0].max() == 255 and slices[0].min() == 0
+
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+@pytest.mark.parametrize(
+    "affine",
+    [
+        np.diag([1, 1, 1, 1]),
+        np.diag([-1, 1, -1, 1]),
+        np.array([[0, 0, -1, 0], [1, 0, 0, 0], [0, -1, 0, 0], [0, 0, 0, 1]]),
+    ],
+)
+def test_read_planes_matches_orient(tmp_path, affine, extension):
+    vol = np.arange(6 * 7 * 8, dtype=np.int16).reshape((6, 7, 8))
+    vol_path = str(tmp_path / f"vol{extension}")
+    nib.save(nib.Nifti1Image(vol, affine.astype(float)), vol_path)
+
+    nib_img = nib.load(vol_path)
+    transform = sampler.rpi_transform(nib_img.affine)
+    oriented = sampler.orient(vol, nib_img.affine)
+    assert sampler.rpi_shape(vol.shape, transform) == oriented.shape
+
+    planes = sampler.read_planes(
+        nib_img, transform, [(0, 1), (1, 2), (2, 3), (2, 0)], chunk_bytes=100
+    )
+    assert np.array_equal(planes[0], oriented.take(1, axis=0))
+    assert np.array_equal(planes[1], oriented.take(2, axis=1))
+    assert np.array_equal(planes[2], oriented.take(3, axis=2))
+    assert np.array_equal(planes[3], oriented.take(0, axis=2))
+    assert planes[0].dtype == np.int16
+
+
+def test_transcode(tmp_path):
+    out_path = str(tmp_path / "sub" / "vol.nii")
+    assert sampler.transcode(testconfig.TEST_VOL_PATH, out_path) == out_path
+
+    nib_img = nib.load(out_path)
+    assert nib.aff2axcodes(nib_img.affine) == ("R", "P", "I")
+    for original, transcoded in zip(
+        sampler.retrieve_three_slices(testconfig.TEST_VOL_PATH),
+        sampler.retrieve_three_slices(out_path),
+        strict=True,
+    ):
+        assert np.array_equal(original, transcoded)
+
+
+def test_rescale_batch_flat_and_padding():
+    batch = np.zeros((2, 3, 4), dtype=np.float32)
+    batch[0, 0, 0] = 10
+    batch[0, 2, 3] = np.nan
+    batch[1] = 7
+
+    rescaled = sampler.rescale_batch(batch)
+
+    assert rescaled.dtype == np.uint8
+    assert rescaled[0, 0, 0] == 255
+    assert rescaled[0, 2, 3] == 0
+    assert not rescaled[1].any()
+
+
+def test_retrieve_slices_batch(tmp_path):
+    small_path = str(tmp_path / "small.nii.gz")
+    nib.save(
+        nib.Nifti1Image(
+            np.arange(6 * 7 * 8, dtype=np.int16).reshape((6, 7, 8)), np.eye(4)
+        ),
+        small_path,
+    )
+
+    batch = sampler.retrieve_slices_batch(
+        [testconfig.TEST_VOL_PATH, small_path], max_workers=2
+    )
+
+    assert batch.shape == (2, 3, 256, 256)
+    assert batch.dtype == np.uint8
+    slices = sampler.retrieve_three_slices(testconfig.TEST_VOL_PATH)
+    for plane, image in zip(batch[0], slices, strict=True):
+        offset = (256 - image.shape[1]) // 2
+        window = plane[:, offset : offset + image.shape[1]].astype(int)
+        assert np.abs(window - image).max() <= 1
+    # Small slices are centered, surrounded by zeros
+    assert not batch[1, :, :100].any()
+    assert batch[1, 2].max() == 255
+
+
+def test_retrieve_slices_batch_shape():
+    batch = sampler.retrieve_slices_batch([testconfig.TEST_VOL_PATH], shape=(128, 64))
+    assert batch.shape == (1, 3, 128, 64)
+
+
+def test_slice_indices():
+    dim_size = (100, 200, 50)
+
+    assert sampler.slice_indices(sampler.DEFAULT_SAMPLING, dim_size) == [
+        [35],
+        [100],
+        [5],
+    ]
+
+    spec = sampler.SamplingSpec(
+        slices_per_axis=3, offsets=(-0.1, 0, 0.1), shifts=(0, 0, 0)
+    )
+    assert sampler.slice_indices(spec, dim_size) == [
+        [40, 50, 60],
+        [80, 100, 120],
+        [20, 25, 30],
+    ]
+
+    jittered = spec._replace(jitter=3)
+    first = sampler.slice_indices(jittered, dim_size, seed=7)
+    assert first == sampler.slice_indices(jittered, dim_size, seed=7)
+    for indices, expected in zip(
+        first, sampler.slice_indices(spec, dim_size), strict=False
+    ):
+        assert all(abs(a - b) <= 3 for a, b in zip(indices, expected, strict=False))
+
+    with pytest.raises(ValueError):
+        sampler.slice_indices(spec._replace(slices_per_axis=2), dim_size)
+
+
+def test_retrieve_contact_sheets():
+    spec = sampler.SamplingSpec(slices_per_axis=4)
+
+    coronal, sagittal, axial = sampler.retrieve_contact_sheets(
+        testconfig.TEST_VOL_PATH, spec
+    )
+    single = sampler.retrieve_three_slices(testconfig.TEST_VOL_PATH)
+
+    for sheet, image in zip((coronal, sagittal, axial), single, strict=False):
+        assert sheet.shape == (4 * image.shape[0], image.shape[1])
+        assert sheet.dtype == np.uint8
+
+
+def test_rescale_flat():
+    assert not sampler.rescale(np.ones((3, 4))).any()
+
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+def test_read_planes_and_sample(tmp_path, extension):
+    vol = np.arange(6 * 7 * 8, dtype=np.int16).reshape((6, 7, 8))
+    vol_path = str(tmp_path / f"vol{extension}")
+    nib.save(nib.Nifti1Image(vol, np.eye(4)), vol_path)
+
+    nib_img = nib.load(vol_path)
+    transform = sampler.rpi_transform(nib_img.affine)
+    planes, sample = sampler.read_planes_and_sample(
+        nib_img, transform, [(2, 3)], sample_stride=3, chunk_bytes=100
+    )
+
+    assert np.array_equal(planes[0], sampler.orient(vol, nib_img.affine)[:, :, 3])
+    assert np.array_equal(sample, vol[::3, ::3, ::3])
+
+
+def test_read_planes_and_sample_scaled(tmp_path):
+    vol = np.arange(6 * 7 * 8, dtype=np.int16).reshape((6, 7, 8))
+    nib_img = nib.Nifti1Image(vol, np.eye(4))
+    nib_img.header.set_slope_inter(2.0, 10.0)
+    vol_path = str(tmp_path / "vol.nii")
+    nib.save(nib_img, vol_path)
+
+    nib_img = nib.load(vol_path)
+    assert sampler._memmap(nib_img) is not None
+    planes, sample = sampler.read_planes_and_sample(
+        nib_img, np.array([[0, 1], [1, 1], [2, 1]]), [(0, 2), (1, 4)], sample_stride=2
+    )
+
+    scaled = np.asanyarray(nib_img.dataobj)
+    assert np.array_equal(planes[0], scaled[2])
+    assert np.array_equal(planes[1], scaled[:, 4])
+    assert np.array_equal(sample, scaled[::2, ::2, ::2])
+
+
+def test_retrieve_contact_sheets_percentile():
+    norm = normalization.Normalization("percentile", (1, 99), stride=4)
+
+    sheets = sampler.retrieve_contact_sheets(testconfig.TEST_VOL_PATH, norm=norm)
+
+    assert all(sheet.dtype == np.uint8 for sheet in sheets)
+    assert max(sheet.max() for sheet in sheets) == 255
+
+
+@pytest.mark.parametrize("extension", [".nii", ".nii.gz"])
+@pytest.mark.parametrize(
+    "affine",
+    [
+        np.diag([1, 1, 1, 1]),
+        np.diag([-1, 1, -1, 1]),
+        np.array([[0, 0, -1, 0], [1, 0, 0, 0], [0, -1, 0, 0], [0, 0, 0, 1]]),
+    ],
+)
+def test_backends_match(tmp_path, affine, extension):
+    vol = np.arange(16 * 18 * 20, dtype=np.int16).reshape((16, 18, 20))
+    vol_path = str(tmp_path / f"vol{extension}")
+    nib.save(nib.Nifti1Image(vol, affine.astype(float)), vol_path)
+    spec = sampler.SamplingSpec(slices_per_axis=2, shifts=(0, 1, -2))
+
+    *nib_slices, nib_sample = sampler.read_sampled_slices(
+        vol_path, spec, sample_stride=3, backend="nibabel"
+    )
+    *itk_slices, itk_sample = sampler.read_sampled_slices(
+        vol_path, spec, sample_stride=3, backend="simpleitk"
+    )
+
+    for nib_axis, itk_axis in zip(nib_slices, itk_slices, strict=True):
+        for nib_plane, itk_plane in zip(nib_axis, itk_axis, strict=True):
+            assert np.array_equal(nib_plane, itk_plane)
+    assert np.array_equal(
+        np.sort(nib_sample, axis=None), np.sort(itk_sample, axis=None)
+    )
+
+
+def test_read_sampled_slices_unknown_backend():
+    with pytest.raises(ValueError):
+        sampler.read_sampled_slices(testconfig.TEST_VOL_PATH, backend="dcm2niix")
@@ -6,11 +6,13 @@ from motscore import create_app
 
 
 @pytest.fixture
-def client():
+def client(tmp_path):
     app = create_app(
         {
             "TESTING": True,
             "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
         }
     )
     with app.test_client() as client:
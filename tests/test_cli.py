@@ -18,11 +18,13 @@ def runner():
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     app = create_app(
         {
             "TESTING": True,
             "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
         }
     )
     return app
@@ -36,6 +38,22 @@ def test_init_db(runner, app):
         assert os.path.exists("tests/test.sqlite")
 
 
+def test_migrate_db(runner, app):
+    with app.test_request_context("/", method="POST"):
+        runner.invoke(app.cli, ["init-db"])
+
+        response = runner.invoke(app.cli, ["migrate-db"])
+        assert "Applied 0 migrations, database at version" in response.output
+
+
+def test_rebuild_progress(runner, app):
+    with app.test_request_context("/", method="POST"):
+        runner.invoke(app.cli, ["init-db"])
+
+        response = runner.invoke(app.cli, ["rebuild-progress"])
+        assert "Rebuilt progress counters." in response.output
+
+
 def test_create_user(runner, app):
     assert not os.path.exists("tests/test.sqlite")
     with app.test_request_context("/", method="POST"):
@@ -72,6 +90,52 @@ def test_populate_volume_multiple(runner, app):
         assert os.path.exists("tests/test.sqlite")
 
 
+def test_populate_volume_existing(runner, app):
+    with app.test_request_context("/", method="POST"):
+        runner.invoke(app.cli, ["init-db"])
+        runner.invoke(
+            app.cli, ["populate-volumes", "--dataset_path", "tests/data/bids_sub_ses"]
+        )
+
+        response = runner.invoke(
+            app.cli, ["populate-volumes", "--dataset_path", "tests/data/bids_sub_ses"]
+        )
+        assert response.exit_code != 0
+        assert "--skip_existing" in response.output
+
+        response = runner.invoke(
+            app.cli,
+            [
+                "populate-volumes",
+                "--dataset_path",
+                "tests/data/multiple",
+                "--multiple",
+                "--skip_existing",
+            ],
+        )
+        assert "Inserted 2 volumes." in response.output
+
+
+def test_sync_volumes(runner, app):
+    with app.test_request_context("/", method="POST"):
+        runner.invoke(app.cli, ["init-db"])
+        runner.invoke(
+            app.cli, ["populate-volumes", "--dataset_path", "tests/data/bids_sub_ses"]
+        )
+
+        response = runner.invoke(
+            app.cli,
+            ["sync-volumes", "--dataset_path", "tests/data/multiple", "--multiple"],
+        )
+        assert "bids_01: 1 added, 0 retired, 0 restored." in response.output
+        assert "bids_02: 2 added, 0 retired, 0 restored." in response.output
+
+        response = runner.invoke(
+            app.cli, ["sync-volumes", "--dataset_path", "tests/data/bids_sub_ses"]
+        )
+        assert "bids_sub_ses: 0 added, 0 retired, 0 restored." in response.output
+
+
 def test_export_csv(runner, app):
     assert not os.path.exists("tests/test.sqlite")
 
@@ -88,3 +152,85 @@ def test_export_csv(runner, app):
         assert os.path.exists("tests/tmp_out/out.csv")
 
         assert os.path.exists("tests/test.sqlite")
+
+
+def test_aggregate_labels(runner, app, tmp_path):
+    with app.test_request_context("/", method="POST"):
+        runner.invoke(app.cli, ["init-db"])
+
+        report = str(tmp_path / "report.json")
+        response = runner.invoke(
+            app.cli,
+            [
+                "aggregate-labels",
+                "--output",
+                str(tmp_path / "labels.csv"),
+                "--report",
+                report,
+            ],
+        )
+        assert "Labeled 0 volumes from 0 reviews." in response.output
+        assert f"Write at {report}." in response.output
+        assert os.path.exists(report)
+
+
+def test_bench_encodings(runner, app):
+    with app.test_request_context("/", method="POST"):
+        response = runner.invoke(
+            app.cli,
+            [
+                "bench",
+                "encodings",
+                "--vol_path",
+                "tests/data/bids_sub_ses/sub-000103/ses-headmotion2/anat/sub-000103_ses-headmotion2_T1w.nii.gz",
+                "--repeat",
+                "1",
+            ],
+        )
+    assert response.exit_code == 0
+    assert "webp lossless=True" in response.output
+    assert "raw" in response.output
+
+
+def test_bench_normalization(runner, app):
+    with app.test_request_context("/", method="POST"):
+        response = runner.invoke(
+            app.cli,
+            [
+                "bench",
+                "normalization",
+                "--vol_path",
+                "tests/data/bids_sub_ses/sub-000103/ses-headmotion2/anat/sub-000103_ses-headmotion2_T1w.nii.gz",
+                "--repeat",
+                "1",
+            ],
+        )
+    assert response.exit_code == 0
+    assert "legacy rescale" in response.output
+    assert "volume percentile" in response.output
+
+
+def test_bench_backends(runner, app):
+    with app.test_request_context("/", method="POST"):
+        response = runner.invoke(
+            app.cli,
+            [
+                "bench",
+                "backends",
+                "--vol_path",
+                "tests/data/bids_sub_ses/sub-000103/ses-headmotion2/anat/sub-000103_ses-headmotion2_T1w.nii.gz",
+                "--repeat",
+                "1",
+            ],
+        )
+    assert response.exit_code == 0
+    assert "simpleitk" in response.output
+
+
+def test_bench_scores(runner, app):
+    with app.test_request_context("/", method="POST"):
+        response = runner.invoke(
+            app.cli, ["bench", "scores", "--users", "2", "--posts", "3"]
+        )
+    assert response.exit_code == 0
+    assert "pooled, WAL" in response.output
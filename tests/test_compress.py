@@ -0,0 +1,46 @@
+import gzip
+import os
+
+import pytest
+
+from motscore import compress, create_app
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
+            "COMPRESS_MIN_SIZE": 0,
+        }
+    )
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": "test"})
+        yield client
+
+
+def test_json_gzip(client, monkeypatch):
+    monkeypatch.setattr(compress, "brotli", None)
+    response = client.get("/get_slices", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert b'"vol_id"' in gzip.decompress(response.data)
+
+
+def test_json_identity(client):
+    response = client.get("/get_slices")
+
+    assert "Content-Encoding" not in response.headers
+    assert response.json["vol_id"]
+
+
+def test_image_not_compressed(client):
+    url = client.get("/get_slices").json["slices"]["axial"]
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.content_type == "image/png"
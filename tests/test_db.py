@@ -1,5 +1,8 @@
+import json
 import os
+import shutil
 import sqlite3
+from datetime import datetime
 
 import pandas as pd
 import pytest
@@ -8,15 +11,55 @@ from motscore import create_app
 from motscore.db import (
     create_user,
     export_csv,
+    export_reviews,
     get_db,
     get_last_reviewed_volume,
+    get_last_reviewed_volumes,
     get_next_volume_to_review,
     get_review_status,
+    get_volumes_to_review,
     init_db,
+    list_migrations,
+    migrate_db,
     populate_volume,
+    rebuild_progress,
     remove_review,
     score_volume,
+    sync_volumes,
 )
+from motscore.rand_bids import explorer
+
+LEGACY_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_code TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE
+);
+CREATE TABLE volume (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sub_id TEXT NOT NULL,
+    ses_id TEXT NOT NULL,
+    volume_path TEXT NOT NULL,
+    dataset TEXT NOT NULL
+);
+CREATE TABLE review (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    judge_code TEXT NOT NULL,
+    vol_id INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    lines BOOLEAN DEFAULT False,
+    blur BOOLEAN DEFAULT False,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO user(user_code, email) VALUES ('test', 'fake@email.com');
+INSERT INTO volume(sub_id, ses_id, volume_path, dataset)
+VALUES
+    ('01', 'a', '/vol1.nii.gz', 'ds'),
+    ('02', 'a', '/vol2.nii.gz', 'ds'),
+    ('01', 'a', '/vol1.nii.gz', 'ds');
+INSERT INTO review(judge_code, vol_id, score)
+VALUES ('test', 1, 4), ('test', 1, 0), ('test', 2, 3), ('test', 3, 1), ('other', 3, 5);
+"""
 
 
 @pytest.fixture
@@ -31,6 +74,7 @@ def app():
         {
             "TESTING": True,
             "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
         }
     )
     yield app
@@ -69,6 +113,49 @@ def test_init_db(fixt_init_test_db, app):
     assert expected_tables.issubset(tables)
 
 
+def test_init_db_sets_latest_version(fixt_init_test_db, app):
+    with app.test_request_context("/", method="POST"):
+        init_db()
+
+        version = get_db().execute("PRAGMA user_version").fetchone()[0]
+        assert version == list_migrations()[-1][0]
+        assert migrate_db() == []
+
+
+def test_migrate_db(fixt_init_test_db, app):
+    with app.test_request_context("/", method="POST"):
+        db = get_db()
+        db.executescript(LEGACY_SCHEMA)
+
+        applied = migrate_db()
+        assert applied == [version for version, _ in list_migrations()]
+        assert db.execute("PRAGMA user_version").fetchone()[0] == applied[-1]
+
+        indexes = {
+            row["name"]
+            for row in db.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        }
+        assert {
+            "review_judge_vol_idx",
+            "review_judge_created_idx",
+            "volume_dataset_idx",
+        }.issubset(indexes)
+
+        reviews = db.execute(
+            "SELECT judge_code, vol_id, score FROM review ORDER BY judge_code, vol_id"
+        )
+        assert [tuple(row) for row in reviews] == [
+            ("other", 1, 5),
+            ("test", 1, 0),
+            ("test", 2, 3),
+        ]
+        assert get_next_volume_to_review("test") is None
+        assert get_review_status("test") == (2, 2, 1)
+        counts = db.execute("SELECT review_count, disputed FROM volume ORDER BY id")
+        assert [tuple(row) for row in counts] == [(2, 1), (1, 0)]
+        assert migrate_db() == []
+
+
 def test_get_next_volume_to_review(init_app):
     with init_app.test_request_context("/", method="POST"):
         next_vol = get_next_volume_to_review("test")
@@ -80,6 +167,76 @@ def test_get_next_volume_to_review(init_app):
         assert "dataset" in keys
 
 
+def test_get_volumes_to_review(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        volumes = get_volumes_to_review("test", 10)
+        assert sorted(vol["id"] for vol in volumes) == [1, 2, 3]
+
+        score_volume("test", 1, 0, False, False)
+        volumes = get_volumes_to_review("test", 10, exclude=[2])
+        assert [vol["id"] for vol in volumes] == [3]
+
+
+def test_review_count(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        create_user("other@email.com", "other")
+        db = get_db()
+
+        def counts():
+            row = db.execute(
+                "SELECT review_count, kept_count, disputed FROM volume WHERE id = 1"
+            ).fetchone()
+            return tuple(row)
+
+        score_volume("test", 1, 0, False, False)
+        assert counts() == (1, 1, 0)
+        score_volume("other", 1, 3, True, False)
+        assert counts() == (2, 1, 1)
+        score_volume("other", 1, 1, False, False)
+        assert counts() == (2, 2, 0)
+        remove_review(1, "test")
+        assert counts() == (1, 1, 0)
+
+        db.execute("UPDATE volume SET review_count = 0, kept_count = 0")
+        rebuild_progress()
+        assert counts() == (1, 1, 0)
+
+
+def test_get_volumes_to_review_schedulers(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        create_user("other@email.com", "other")
+        create_user("third@email.com", "third")
+        score_volume("other", 1, 0, False, False)
+        score_volume("third", 1, 3, False, False)
+        score_volume("other", 2, 0, False, False)
+        score_volume("third", 2, 1, False, False)
+
+        def order(scheduler):
+            volumes = get_volumes_to_review(
+                "test", 3, scheduler=scheduler, reviews_per_volume=2
+            )
+            return [volume["id"] for volume in volumes]
+
+        assert order("coverage")[0] == 3
+        assert order("disagreement") == [3, 1, 2]
+        assert sorted(order("random")) == [1, 2, 3]
+        assert get_volumes_to_review(
+            "test", 3, scheduler="coverage", reviews_per_volume=0
+        )
+
+
+def test_unknown_scheduler():
+    with pytest.raises(ValueError):
+        create_app({"TESTING": True, "ASSIGNMENT_SCHEDULER": "fifo"})
+
+
+def test_get_next_volume_to_review_all_reviewed(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        for vol_id in (1, 2, 3):
+            score_volume("test", vol_id, 0, False, False)
+        assert get_next_volume_to_review("test") is None
+
+
 def test_score_volume(init_app):
     with init_app.test_request_context("/", method="POST"):
         scored = score_volume("test", 1, 0, False, False)
@@ -96,6 +253,17 @@ def test_score_volume(init_app):
         assert not rows[0]["lines"]
 
 
+def test_score_volume_twice(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        score_volume("test", 1, 0, False, False)
+        score_volume("test", 1, 3, True, False)
+
+        rows = get_db().execute("SELECT * FROM review").fetchall()
+        assert len(rows) == 1
+        assert rows[0]["score"] == 3
+        assert rows[0]["blur"]
+
+
 def test_get_last_reviewed_volume(init_app):
     with init_app.test_request_context("/", method="POST"):
         score_volume("test", 1, 0, False, False)
@@ -109,6 +277,16 @@ def test_get_last_reviewed_volume(init_app):
         assert "dataset" in keys
 
 
+def test_get_last_reviewed_volumes_order(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        for vol_id in (2, 3, 1):
+            score_volume("test", vol_id, 0, False, False)
+
+        volumes = get_last_reviewed_volumes("test", 2)
+        assert [vol["id"] for vol in volumes] == [1, 3]
+        assert get_last_reviewed_volume("other") is None
+
+
 def test_remove_review(init_app):
     with init_app.test_request_context("/", method="POST"):
         score_volume("test", 1, 0, False, False)
@@ -149,6 +327,29 @@ def test_get_review_status_kept(init_app):
         assert kept == 1
 
 
+def test_get_review_status_rescore(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        score_volume("test", 1, 0, False, False)
+        score_volume("test", 2, 1, False, False)
+        score_volume("test", 1, 4, False, False)
+        assert get_review_status("test") == (3, 2, 1)
+
+        remove_review(2, "test")
+        assert get_review_status("test") == (3, 1, 0)
+
+
+def test_rebuild_progress(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        score_volume("test", 1, 0, False, False)
+        db = get_db()
+        db.execute("UPDATE user_progress SET done = 10, kept = 10")
+        db.execute("UPDATE volume_total SET n_vol = 0")
+        db.commit()
+
+        rebuild_progress()
+        assert get_review_status("test") == (3, 1, 1)
+
+
 def test_create_user_rand(init_app):
     with init_app.test_request_context("/", method="POST"):
         code = create_user("email@test.com")
@@ -194,6 +395,109 @@ def test_populate_volumes(fixt_init_test_db, app):
         ) in vol["volume_path"]
 
 
+def test_populate_volumes_optimized(fixt_init_test_db, app, tmp_path):
+    with app.test_request_context("/", method="POST"):
+        init_db()
+
+        populate_volume("tests/data/bids_sub_ses", str(tmp_path))
+        db = get_db()
+        rows = db.execute("SELECT * FROM volume").fetchall()
+        assert len(rows) == 3
+        for vol in rows:
+            assert vol["optimized_path"].startswith(
+                str(tmp_path / "bids_sub_ses" / f"sub-{vol['sub_id']}")
+            )
+            assert vol["optimized_path"].endswith("_T1w.nii")
+            assert os.path.exists(vol["optimized_path"])
+
+
+def test_populate_volumes_optimized_skips_unreadable(fixt_init_test_db, app, tmp_path):
+    dataset = tmp_path / "bids_sub_ses"
+    shutil.copytree("tests/data/bids_sub_ses", dataset)
+    broken = next(dataset.glob("sub-000103/*/anat/*_T1w.nii.gz"))
+    broken.write_bytes(b"not a volume")
+    with app.test_request_context("/", method="POST"):
+        init_db()
+
+        assert populate_volume(str(dataset), str(tmp_path / "optimized")) == 2
+        db = get_db()
+        rows = db.execute("SELECT sub_id FROM volume").fetchall()
+        assert sorted(vol["sub_id"] for vol in rows) == ["000120", "000148"]
+        assert not list((tmp_path / "optimized").rglob("*.tmp.nii"))
+
+
+def test_populate_volumes_twice(fixt_init_test_db, app):
+    with app.test_request_context("/", method="POST"):
+        init_db()
+        assert populate_volume("tests/data/bids_sub_ses") == 3
+
+        with pytest.raises(sqlite3.IntegrityError):
+            populate_volume("tests/data/bids_sub_ses")
+        assert populate_volume("tests/data/bids_sub_ses", skip_existing=True) == 0
+
+        db = get_db()
+        assert len(db.execute("SELECT * FROM volume").fetchall()) == 3
+        assert get_review_status("test") == (3, 0, 0)
+
+
+def test_sync_volumes(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        volumes = explorer.list_volumes("tests/data/bids_sub_ses")
+        new_volume = explorer.Volume("999", "ses", "/new/sub-999_T1w.nii.gz", "x")
+        db = get_db()
+
+        result = sync_volumes([*volumes[1:], new_volume], "tests/data/bids_sub_ses")
+        assert not db.in_transaction
+        assert result == (1, 1, 0)
+        assert get_review_status("test") == (3, 0, 0)
+        retired = db.execute("SELECT * FROM volume WHERE retired = 1").fetchone()
+        assert retired["volume_path"] == volumes[0].path
+        reviewable = get_volumes_to_review("test", 10)
+        assert retired["id"] not in {vol["id"] for vol in reviewable}
+        assert len(reviewable) == 3
+
+        result = sync_volumes(volumes, "tests/data/bids_sub_ses")
+        assert result == (0, 0, 1)
+        assert get_review_status("test") == (4, 0, 0)
+
+
+def test_sync_volumes_progress(init_app):
+    with init_app.test_request_context("/", method="POST"):
+        volumes = explorer.list_volumes("tests/data/bids_sub_ses")
+        db = get_db()
+        ids = {
+            row["volume_path"]: row["id"]
+            for row in db.execute("SELECT id, volume_path FROM volume")
+        }
+        score_volume("test", ids[volumes[0].path], 0, False, False)
+
+        sync_volumes(volumes[1:], "tests/data/bids_sub_ses")
+        assert get_review_status("test") == (2, 0, 0)
+        for vol in volumes[1:]:
+            score_volume("test", ids[vol.path], 1, False, False)
+        assert get_review_status("test") == (2, 2, 2)
+        rebuild_progress()
+        assert get_review_status("test") == (2, 2, 2)
+
+        sync_volumes(volumes, "tests/data/bids_sub_ses")
+        assert get_review_status("test") == (3, 3, 3)
+
+
+def test_sync_volumes_skips_unreadable(init_app, tmp_path):
+    with init_app.test_request_context("/", method="POST"):
+        volumes = explorer.list_volumes("tests/data/bids_sub_ses")
+        missing = explorer.Volume(
+            "999", "ses", str(tmp_path / "sub-999_T1w.nii.gz"), "x"
+        )
+
+        result = sync_volumes(
+            [*volumes, missing], "tests/data/bids_sub_ses", str(tmp_path)
+        )
+        assert result == (0, 0, 0)
+        assert not get_db().in_transaction
+        assert get_review_status("test") == (3, 0, 0)
+
+
 def test_export_csv(init_app):
     with init_app.test_request_context("/", method="POST"):
         score_volume("test", 1, 0, False, False)
@@ -219,3 +523,99 @@ def test_export_csv(init_app):
         assert csv["lines"][2] == 1
 
         os.remove("tests/tmp_out/tmp_export.csv")
+
+
+def test_export_reviews_filters(init_app, tmp_path):
+    output = str(tmp_path / "reviews.jsonl")
+    with init_app.test_request_context("/", method="POST"):
+        create_user("other@email.com", "other")
+        score_volume("test", 1, 0, False, False)
+        score_volume("other", 2, 3, True, False)
+        db = get_db()
+        db.execute("UPDATE review SET created_at = '2024-01-01 10:00:00'")
+        db.commit()
+
+        assert export_reviews(output, "jsonl", judges=["other"]) == 1
+        with open(output, encoding="utf8") as f:
+            reviews = [json.loads(line) for line in f]
+        assert reviews[0]["judge_code"] == "other"
+        assert (reviews[0]["score"], reviews[0]["blur"]) == (3, 1)
+
+        assert export_reviews(output, "jsonl", datasets=["bids_sub_ses"]) == 2
+        assert export_reviews(output, "jsonl", datasets=["missing"]) == 0
+        assert export_reviews(output, "jsonl", since=datetime(2024, 1, 1, 10)) == 2
+        assert export_reviews(output, "jsonl", until=datetime(2024, 1, 1, 10)) == 0
+        with pytest.raises(ValueError):
+            export_reviews(output, "xlsx")
+
+
+def test_export_reviews_incremental(init_app, tmp_path):
+    output = str(tmp_path / "reviews.csv")
+    with init_app.test_request_context("/", method="POST"):
+        score_volume("test", 1, 0, False, False)
+        db = get_db()
+        db.execute("UPDATE review SET created_at = '2024-01-01 10:00:00'")
+        db.commit()
+
+        assert export_reviews(output, watermark="daily") == 1
+        assert export_reviews(output, watermark="daily") == 0
+        assert export_reviews(output, watermark="weekly") == 1
+
+        # Export again as if the last daily export ran the same day
+        db.execute("UPDATE export_watermark SET exported_until = '2024-01-01 12:00:00'")
+        score_volume("test", 2, 3, False, False)
+        db.execute(
+            "UPDATE review SET created_at = '2024-01-02 10:00:00' WHERE vol_id = 2"
+        )
+        db.commit()
+        assert export_reviews(output, watermark="daily") == 1
+        assert len(pd.read_csv(output, index_col=0)) == 1
+
+
+def test_export_reviews_parquet(init_app, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output = str(tmp_path / "reviews.parquet")
+    with init_app.test_request_context("/", method="POST"):
+        score_volume("test", 1, 0, False, False)
+        score_volume("test", 3, 3, True, True)
+
+        assert export_reviews(output, "parquet") == 2
+        table = pq.read_table(output)
+        assert table.column("lines").to_pylist() == [0, 1]
+
+
+def test_connection_pool(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": str(tmp_path / "pool.sqlite"),
+            "DB_POOL_SIZE": 1,
+        }
+    )
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+        db.execute("CREATE TABLE t (x INTEGER)")
+        db.commit()
+        db.execute("INSERT INTO t VALUES (1)")
+
+    with app.app_context():
+        # Same connection, uncommitted changes of the previous context dropped
+        assert get_db() is db
+        assert db.execute("SELECT count(*) FROM t").fetchone()[0] == 0
+
+
+def test_no_connection_pool():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "DB_POOL_SIZE": 0,
+        }
+    )
+    with app.app_context():
+        db = get_db()
+    with app.app_context():
+        assert get_db() is not db
@@ -0,0 +1,111 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from motscore import create_app
+from motscore.db import create_user, get_db, score_volume
+from motscore.labels import (
+    aggregate_labels,
+    cohen_kappa,
+    consensus,
+    fleiss_kappa,
+    kept_counts,
+    write_labels,
+)
+
+
+@pytest.fixture
+def app():
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+        }
+    )
+    return app
+
+
+def test_fleiss_kappa():
+    counts = np.array(
+        [
+            [0, 0, 0, 0, 14],
+            [0, 2, 6, 4, 2],
+            [0, 0, 3, 5, 6],
+            [0, 3, 9, 2, 0],
+            [2, 2, 8, 1, 1],
+            [7, 7, 0, 0, 0],
+            [3, 2, 6, 3, 0],
+            [2, 5, 3, 2, 2],
+            [6, 5, 2, 1, 0],
+            [0, 2, 2, 3, 7],
+        ]
+    )
+    assert fleiss_kappa(counts) == pytest.approx(0.210, abs=1e-3)
+    assert fleiss_kappa(np.array([[1, 0], [0, 1]])) is None
+
+
+def test_cohen_kappa():
+    assert cohen_kappa(np.array([[20, 5], [10, 15]])) == pytest.approx(0.4)
+    assert cohen_kappa(np.array([[3, 0], [0, 0]])) is None
+
+
+def test_consensus():
+    counts = np.array([[2, 1, 0, 0, 0, 0], [1, 0, 0, 1, 0, 0]])
+    labels = consensus(counts, np.array([0, 1]), np.array([0, 2]))
+    assert labels.score.tolist() == [0, 3]
+    assert labels.blur.tolist() == [False, False]
+    assert labels.lines.tolist() == [False, True]
+    assert labels.agreement.tolist() == pytest.approx([2 / 3, 0.5])
+    assert kept_counts(counts).tolist() == [[0, 3], [1, 1]]
+
+
+def test_aggregate_labels(app, tmp_path):
+    with app.test_request_context("/", method="POST"):
+        create_user("other@email.com", "other")
+        for judge, scores in (("test", (0, 3, 4)), ("other", (1, 3, 5))):
+            for vol_id, score in enumerate(scores, start=1):
+                score_volume(judge, vol_id, score, score == 3, False)
+
+        report = aggregate_labels(min_reviews=2)
+        assert (report["volumes"], report["reviews"]) == (3, 6)
+        assert report["fleiss_kappa"]["kept"] == pytest.approx(1.0)
+        assert report["cohen_kappa"][0]["judges"] == ["other", "test"]
+        assert report["cohen_kappa"][0]["kept"] == pytest.approx(1.0)
+        assert report["confusion"]["test"][3][3] == 1
+        assert report["datasets"]["bids_sub_ses"]["kept"] == pytest.approx(1 / 3)
+        json.dumps(report)
+
+        labels = get_db().execute(
+            "SELECT vol_id, score, blur, kept FROM volume_label ORDER BY vol_id"
+        )
+        assert [tuple(row) for row in labels] == [
+            (1, 1, 0, 1),
+            (2, 3, 1, 0),
+            (3, 5, 0, 0),
+        ]
+
+        output = str(tmp_path / "labels.csv")
+        assert write_labels(output) == 3
+        with open(output, encoding="utf8") as f:
+            assert f.readline().startswith("vol_id,sub_id,ses_id")
+
+        assert aggregate_labels(min_reviews=3)["volumes"] == 0
+
+
+def test_aggregate_labels_keeps_other_datasets(app):
+    with app.test_request_context("/", method="POST"):
+        for vol_id in (1, 2, 3):
+            score_volume("test", vol_id, vol_id, False, False)
+        db = get_db()
+        db.execute("UPDATE volume SET dataset = 'other' WHERE id = 3")
+        db.commit()
+        assert aggregate_labels()["volumes"] == 3
+
+        score_volume("test", 1, 5, False, False)
+        report = aggregate_labels(["bids_sub_ses"])
+        assert (report["volumes"], report["reviews"]) == (2, 2)
+        labels = db.execute("SELECT vol_id, score FROM volume_label ORDER BY vol_id")
+        assert [tuple(row) for row in labels] == [(1, 5), (2, 2), (3, 3)]
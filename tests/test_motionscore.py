@@ -1,4 +1,3 @@
-import base64
 import io
 import os
 
@@ -6,15 +5,18 @@ import numpy as np
 import pytest
 from PIL import Image
 
-from motscore import create_app
+from motscore import create_app, slice_cache
+from motscore.db import get_db, get_review_status
 
 
 @pytest.fixture
-def client():
+def client(tmp_path):
     app = create_app(
         {
             "TESTING": True,
             "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
         }
     )
     with app.test_client() as client:
@@ -37,14 +39,50 @@ def test_get_slices(client):
     assert response.json["done"] == 0
     assert response.json["to_do"] == 3
     assert response.json["kept"] == 0
+    assert set(response.json["slices"]) == {"coronal", "sagittal", "axial"}
 
-    base64_decoded = base64.b64decode(response.json["slice1"])
+    response = client.get(response.json["slices"]["coronal"])
 
-    image = Image.open(io.BytesIO(base64_decoded))
+    assert response.status_code == 200
+    assert response.content_type == "image/png"
+    assert response.get_etag()[0]
+    assert response.cache_control.immutable
+    image = Image.open(io.BytesIO(response.data))
     image_np = np.array(image)
     assert image_np.shape == (256, 192)
 
 
+def test_get_slice_not_modified(client, monkeypatch):
+    url = client.get("/get_slices").json["slices"]["axial"]
+    etag = client.get(url).get_etag()[0]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("slices should not be rendered")
+
+    monkeypatch.setattr(slice_cache, "load_slices", fail)
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+
+    assert response.status_code == 304
+    assert response.get_etag() == (etag, False)
+    assert response.data == b""
+
+
+def test_get_slice_not_found(client):
+    assert client.get("/slice/1/oblique").status_code == 404
+    assert client.get("/slice/999/axial").status_code == 404
+
+
+def test_get_slice_retired_or_missing(client):
+    with client.application.app_context():
+        db = get_db()
+        db.execute("UPDATE volume SET retired = 1 WHERE id = 1")
+        db.execute("UPDATE volume SET volume_path = 'missing.nii.gz' WHERE id = 2")
+        db.commit()
+
+    assert client.get("/slice/1/axial").status_code == 404
+    assert client.get("/slice/2/axial").status_code == 404
+
+
 def test_score(client):
     response = client.post(
         "/score", json={"vol_id": 1, "score": 3, "blur": True, "lines": False}
@@ -73,6 +111,60 @@ def test_score_kept(client):
     assert response.json["kept"] == 1
 
 
+def test_score_and_next(client):
+    vol_id = client.get("/get_slices").json["vol_id"]
+    response = client.post(
+        "/score_and_next",
+        json={"vol_id": vol_id, "score": 0, "blur": False, "lines": False},
+    )
+
+    assert response.status_code == 200
+    assert response.json["vol_id"] != vol_id
+    assert response.json["done"] == 1
+    assert response.json["kept"] == 1
+    assert set(response.json["slices"]) == {"coronal", "sagittal", "axial"}
+
+    for vol_id in (1, 2, 3):
+        response = client.post(
+            "/score_and_next",
+            json={"vol_id": vol_id, "score": 3, "blur": True, "lines": False},
+        )
+    assert response.status_code == 404
+    assert client.get("/back").json["done"] == 2
+
+
+def test_score_and_next_missing_file(client):
+    with client.application.app_context():
+        db = get_db()
+        db.execute("UPDATE volume SET volume_path = 'missing-' || id WHERE id != 1")
+        db.commit()
+
+    response = client.post(
+        "/score_and_next",
+        json={"vol_id": 1, "score": 0, "blur": False, "lines": False},
+    )
+    assert response.status_code == 404
+    with client.application.app_context():
+        assert get_review_status("test") == (3, 1, 1)
+
+
+def test_score_and_next_file_removed(client, monkeypatch):
+    vol_id = client.get("/get_slices").json["vol_id"]
+
+    def missing(*args, **kwargs):
+        raise FileNotFoundError("missing")
+
+    # The next volume file is removed after being selected
+    monkeypatch.setattr(slice_cache, "cache_key", missing)
+    response = client.post(
+        "/score_and_next",
+        json={"vol_id": vol_id, "score": 0, "blur": False, "lines": False},
+    )
+    assert response.status_code == 404
+    with client.application.app_context():
+        assert get_review_status("test") == (3, 1, 1)
+
+
 def test_back(client):
     response_score = client.post(
         "/score", json={"vol_id": 1, "score": 0, "blur": False, "lines": False}
@@ -84,3 +176,47 @@ def test_back(client):
     assert response.json["done"] == 0
     assert response.json["to_do"] == 3
     assert response.json["kept"] == 0
+
+
+def test_get_slices_all_reviewed(client):
+    for vol_id in (1, 2, 3):
+        client.post(
+            "/score", json={"vol_id": vol_id, "score": 0, "blur": False, "lines": False}
+        )
+
+    response = client.get("/get_slices")
+    assert response.status_code == 404
+
+
+def test_back_steps(client):
+    for vol_id in (1, 2, 3):
+        client.post(
+            "/score", json={"vol_id": vol_id, "score": 0, "blur": False, "lines": False}
+        )
+
+    response = client.get("/back?steps=2")
+    assert response.status_code == 200
+    assert response.json["vol_id"] == 2
+    assert response.json["done"] == 1
+
+
+def test_back_no_review(client):
+    response = client.get("/back")
+    assert response.status_code == 404
+
+
+def test_back_retired_or_missing(client):
+    for vol_id in (1, 2):
+        client.post(
+            "/score", json={"vol_id": vol_id, "score": 0, "blur": False, "lines": False}
+        )
+    with client.application.app_context():
+        db = get_db()
+        db.execute("UPDATE volume SET retired = 1 WHERE id = 2")
+        db.execute("UPDATE volume SET volume_path = 'missing.nii.gz' WHERE id = 1")
+        db.commit()
+
+    response = client.get("/back")
+    assert response.status_code == 404
+    with client.application.app_context():
+        assert get_review_status("test") == (2, 1, 1)
@@ -0,0 +1,112 @@
+import os
+import time
+
+import pytest
+
+from motscore import create_app
+from motscore.prefetch import Prefetcher
+from tests import conftest as testconfig
+
+
+@pytest.fixture
+def prefetcher(tmp_path):
+    prefetcher = Prefetcher(2, str(tmp_path))
+    yield prefetcher
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
+            "PREFETCH_DEPTH": 1,
+        }
+    )
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": "test"})
+        yield client
+
+
+def make_volume(vol_id):
+    return {"id": vol_id, "volume_path": testconfig.TEST_VOL_PATH}
+
+
+def test_push_is_bounded(prefetcher):
+    prefetcher.push("test", [make_volume(1), make_volume(2), make_volume(3)])
+
+    assert prefetcher.reserved("test") == [1, 2]
+    assert prefetcher.missing("test") == 0
+    assert prefetcher.missing("other") == 2
+
+
+def test_pop_shares_render(prefetcher):
+    prefetcher.push("test", [make_volume(1)])
+
+    volume = prefetcher.pop("test", lambda vol_id: False)
+    assert volume["id"] == 1
+    # Slices requested before the prefetch render starts would be misses
+    deadline = time.monotonic() + 10
+    while prefetcher.renderer.renders == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    for _ in range(3):
+        slices = prefetcher.renderer.load(
+            volume["volume_path"], prefetcher.cache_dir, seed=volume["id"]
+        )
+        assert len(slices) == 3
+    assert prefetcher.renderer.renders == 1
+
+    assert prefetcher.pop("test", lambda vol_id: False) is None
+    assert prefetcher.stats() == {
+        "hits": 3,
+        "misses": 0,
+        "stale": 0,
+        "hit_rate": 1.0,
+    }
+
+
+def test_pop_drops_stale(prefetcher):
+    prefetcher.push("test", [make_volume(1), make_volume(2)])
+
+    volume = prefetcher.pop("test", lambda vol_id: vol_id == 1)
+    assert volume["id"] == 2
+    assert prefetcher.stats()["stale"] == 1
+
+
+def test_discard(prefetcher):
+    prefetcher.push("test", [make_volume(1), make_volume(2)])
+    prefetcher.discard("test", 1)
+
+    assert prefetcher.reserved("test") == [2]
+    assert prefetcher.stats()["stale"] == 1
+
+
+def test_get_slices_uses_queue(client):
+    first = client.get("/get_slices")
+    assert first.status_code == 200
+    for url in first.json["slices"].values():
+        assert client.get(url).status_code == 200
+    assert client.get("/prefetch_stats").json["misses"] == 3
+
+    client.post(
+        "/score",
+        json={
+            "vol_id": first.json["vol_id"],
+            "score": 0,
+            "blur": False,
+            "lines": False,
+        },
+    )
+    second = client.get("/get_slices")
+    assert second.status_code == 200
+    assert second.json["vol_id"] != first.json["vol_id"]
+    assert second.json["done"] == 1
+    for url in second.json["slices"].values():
+        assert client.get(url).status_code == 200
+
+    stats = client.get("/prefetch_stats").json
+    assert stats["enabled"]
+    assert stats["hits"] == 3
+    assert stats["misses"] == 3
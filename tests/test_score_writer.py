@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from motscore import create_app
+from motscore.db import get_db, get_review_status
+from motscore.score_writer import PendingScore, ScoreWriter
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
+            "SCORE_WRITE_BEHIND": True,
+            # Keep scores queued until a test flushes them
+            "SCORE_FLUSH_INTERVAL": 60,
+        }
+    )
+    yield app
+    app.extensions["motscore.score_writer"].close()
+
+
+def count_reviews(app):
+    with app.app_context():
+        return get_db().execute("SELECT count(*) FROM review").fetchone()[0]
+
+
+def test_score_writer_batches(app):
+    writer = ScoreWriter(app.config, batch_size=2, interval=60)
+    writer.submit(PendingScore("test", 1, 0, False, False))
+    writer.submit(PendingScore("test", 1, 3, True, False))
+    writer.flush()
+    assert writer.pending("test") == []
+    assert (writer.batches, writer.written) == (1, 2)
+
+    writer.submit(PendingScore("test", 2, 1, False, True))
+    assert writer.pending("test") == [PendingScore("test", 2, 1, False, True)]
+    writer.close()
+    assert writer.pending("test") == []
+    assert writer.written == 3
+
+    with app.app_context():
+        assert get_review_status("test") == (3, 2, 1)
+
+
+def test_score_writer_bad_score(app):
+    writer = ScoreWriter(app.config, batch_size=2, interval=60)
+    writer.submit(PendingScore("test", 1, 0, False, False))
+    writer.submit(PendingScore("test", 2, None, False, False))
+    writer.close()
+    assert count_reviews(app) == 1
+
+
+def test_write_behind_reads_pending(app):
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": "test"})
+        vol_id = client.get("/get_slices").json["vol_id"]
+        response = client.post(
+            "/score", json={"vol_id": vol_id, "score": 1, "blur": False, "lines": False}
+        )
+        assert response.status_code == 200
+        assert count_reviews(app) == 0
+
+        response = client.get("/get_slices")
+        assert response.json["vol_id"] != vol_id
+        assert (response.json["done"], response.json["kept"]) == (1, 1)
+
+        response = client.get("/back")
+        assert response.json["vol_id"] == vol_id
+        assert response.json["done"] == 0
+        assert count_reviews(app) == 0
+
+
+def test_write_behind_durable_on_close(app):
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": "test"})
+        client.post("/score", json={"vol_id": 1, "score": 2})
+    app.extensions["motscore.score_writer"].close()
+    assert count_reviews(app) == 1
+
+
+def test_write_behind_score_and_next(app):
+    with app.test_client() as client:
+        client.post("/auth/login", data={"user_code": "test"})
+        vol_id = client.get("/get_slices").json["vol_id"]
+        response = client.post("/score_and_next", json={"vol_id": vol_id, "score": 0})
+        assert response.json["vol_id"] != vol_id
+        assert (response.json["done"], response.json["kept"]) == (1, 1)
+
+
+def test_score_writer_retries_locked_db(app):
+    config = dict(app.config, DB_BUSY_TIMEOUT=10)
+    # Another connection holds the write lock, like a long sync-volumes
+    lock = sqlite3.connect(config["DATABASE"], isolation_level=None)
+    lock.execute("BEGIN IMMEDIATE")
+    writer = ScoreWriter(config, batch_size=1, interval=0, max_backoff=0.05)
+    writer.submit(PendingScore("test", 1, 0, False, False))
+    time.sleep(0.3)
+    assert writer.pending("test") == [PendingScore("test", 1, 0, False, False)]
+    assert count_reviews(app) == 0
+
+    lock.rollback()
+    lock.close()
+    writer.flush()
+    assert writer.pending("test") == []
+    assert writer.written == 1
+    writer.close()
+    assert count_reviews(app) == 1
+
+
+def test_score_writer_dead_thread(app, monkeypatch):
+    writer = ScoreWriter(app.config, batch_size=2, interval=60)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(PendingScore("test", 1, 0, False, False))
+    writer.flush()
+
+
+def test_score_writer_unexpected_error(app, monkeypatch):
+    import motscore.score_writer as score_writer
+
+    def fail(db, reviews):
+        raise TypeError("unexpected")
+
+    monkeypatch.setattr(score_writer, "write_reviews", fail)
+    writer = ScoreWriter(app.config, batch_size=1, interval=60)
+    writer.submit(PendingScore("test", 1, 0, False, False))
+    writer.flush()
+    assert writer.pending("test") == []
+    assert writer.written == 0
+    writer.close()
+
+
+def test_score_writer_close_after_failed_connect(app, monkeypatch):
+    import motscore.score_writer as score_writer
+
+    connect = score_writer.connect
+    submitted = threading.Event()
+
+    def fail(config):
+        submitted.wait()
+        raise sqlite3.OperationalError("unable to open database file")
+
+    monkeypatch.setattr(score_writer, "connect", fail)
+    writer = ScoreWriter(app.config, batch_size=1, interval=60)
+    writer.submit(PendingScore("test", 1, 0, False, False))
+    submitted.set()
+    with pytest.raises(RuntimeError):
+        writer.flush()
+
+    monkeypatch.setattr(score_writer, "connect", connect)
+    writer.close()
+    assert count_reviews(app) == 1
@@ -0,0 +1,166 @@
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from PIL import Image
+
+from motscore import create_app, slice_cache
+from motscore.rand_bids.sampler import SamplingSpec
+from motscore.slice_cache import (
+    RenderSettings,
+    SliceRenderer,
+    cache_key,
+    load_slices,
+    precompute_slices,
+    read_slices,
+    slice_files,
+)
+from motscore.utils import Encoding
+from tests import conftest as testconfig
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join("tests", "test.sqlite"),
+            "DB_JOURNAL_MODE": "delete",
+            "SLICE_CACHE": str(tmp_path / "cache"),
+        }
+    )
+    return app
+
+
+def test_raw_encoding_not_served():
+    with pytest.raises(ValueError):
+        create_app({"TESTING": True, "SLICE_ENCODING": "raw"})
+
+
+def test_cache_key_changes_with_mtime(tmp_path):
+    vol_path = tmp_path / "vol.nii.gz"
+    vol_path.write_bytes(b"")
+    key = cache_key(str(vol_path))
+    assert key == cache_key(str(vol_path))
+
+    stat = os.stat(vol_path)
+    os.utime(vol_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert key != cache_key(str(vol_path))
+
+
+def test_load_slices_miss_then_hit(tmp_path):
+    cache_dir = str(tmp_path)
+    key = cache_key(testconfig.TEST_VOL_PATH)
+    assert read_slices(cache_dir, key) is None
+
+    slices = load_slices(testconfig.TEST_VOL_PATH, cache_dir)
+    assert len(slices) == 3
+    assert read_slices(cache_dir, key) == slices
+
+    image_np = np.array(Image.open(io.BytesIO(slices[0])))
+    assert image_np.shape == (256, 192)
+
+
+def test_load_slices_encoding(tmp_path):
+    cache_dir = str(tmp_path)
+    webp = RenderSettings(encoding=Encoding("webp", {"lossless": True}))
+    assert cache_key(testconfig.TEST_VOL_PATH, webp) != cache_key(
+        testconfig.TEST_VOL_PATH
+    )
+
+    slices = load_slices(testconfig.TEST_VOL_PATH, cache_dir, settings=webp)
+    assert Image.open(io.BytesIO(slices[0])).format == "WEBP"
+    key = cache_key(testconfig.TEST_VOL_PATH, webp)
+    entry = os.path.join(cache_dir, key[:2], key)
+    assert sorted(os.listdir(entry)) == slice_files(webp.encoding)
+    assert read_slices(cache_dir, key) is None
+
+
+def test_load_slices_contact_sheet(tmp_path):
+    cache_dir = str(tmp_path)
+    sheets = RenderSettings(sampling=SamplingSpec(slices_per_axis=3, jitter=2))
+    assert cache_key(testconfig.TEST_VOL_PATH, sheets, 1) != cache_key(
+        testconfig.TEST_VOL_PATH, sheets, 2
+    )
+    assert cache_key(testconfig.TEST_VOL_PATH, seed=1) == cache_key(
+        testconfig.TEST_VOL_PATH, seed=2
+    )
+
+    slices = load_slices(testconfig.TEST_VOL_PATH, cache_dir, settings=sheets, seed=1)
+    image_np = np.array(Image.open(io.BytesIO(slices[0])))
+    assert image_np.shape == (3 * 256, 192)
+
+
+def test_renderer_single_flight(monkeypatch):
+    renders = []
+    render_slices = slice_cache.render_slices
+
+    def slow_render(*args, **kwargs):
+        renders.append(args[0])
+        time.sleep(0.1)
+        return render_slices(*args, **kwargs)
+
+    monkeypatch.setattr(slice_cache, "render_slices", slow_render)
+    renderer = SliceRenderer()
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                renderer.load(testconfig.TEST_VOL_PATH, None, seed=1)
+            )
+        )
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Without a disk cache, later requests are served from memory
+    results.append(renderer.load(testconfig.TEST_VOL_PATH, None, seed=1))
+
+    assert len(renders) == 1
+    assert renderer.renders == 1
+    assert renderer.served == 4
+    assert all(slices == results[0] for slices in results)
+
+
+def test_renderer_failure_not_shared(monkeypatch):
+    renderer = SliceRenderer()
+    with pytest.raises(FileNotFoundError):
+        renderer.load("missing.nii.gz", None)
+
+    def fail(*args, **kwargs):
+        raise ValueError("unreadable")
+
+    monkeypatch.setattr(slice_cache, "render_slices", fail)
+    with pytest.raises(ValueError):
+        renderer.load(testconfig.TEST_VOL_PATH, None)
+    monkeypatch.undo()
+    assert len(renderer.load(testconfig.TEST_VOL_PATH, None)) == 3
+
+
+def test_precompute_slices(tmp_path):
+    cache_dir = str(tmp_path)
+    rendered, cached, failed = precompute_slices(
+        [(testconfig.TEST_VOL_PATH, None, 1), ("missing.nii.gz", None, 2)],
+        cache_dir,
+        jobs=2,
+    )
+    assert (rendered, cached, failed) == (1, 0, ["missing.nii.gz"])
+
+    rendered, cached, failed = precompute_slices(
+        [(testconfig.TEST_VOL_PATH, None, 1)], cache_dir, jobs=1
+    )
+    assert (rendered, cached, failed) == (0, 1, [])
+
+
+def test_precompute_slices_command(app):
+    runner = CliRunner()
+    with app.test_request_context("/", method="POST"):
+        response = runner.invoke(app.cli, ["precompute-slices", "--jobs", "2"])
+    assert "Rendered 3 volumes (0 already cached)." in response.output
+    assert len(os.listdir(app.config["SLICE_CACHE"])) > 0
@@ -2,9 +2,10 @@ import base64
 import io
 
 import numpy as np
+import pytest
 from PIL import Image
 
-from motscore.utils import array_to_str
+from motscore.utils import Encoding, array_to_str, benchmark_encodings, encode_image
 
 
 def test_array_to_str():
@@ -22,3 +23,38 @@ def test_array_to_str():
     assert np.allclose(img, image_np)
     assert image_np[5, 5] == 255
     assert image_np[9, 9] == 1
+
+
+@pytest.mark.parametrize(
+    "encoding,options",
+    [
+        ("png", {"compress_level": 1}),
+        ("webp", {"lossless": True}),
+        ("raw", {}),
+    ],
+)
+def test_encode_image_lossless(encoding, options):
+    img = np.random.default_rng(0).integers(0, 256, (20, 30), dtype=np.uint8)
+
+    encoded = encode_image(img, encoding, **options)
+
+    if encoding == "raw":
+        decoded = np.load(io.BytesIO(encoded))
+    else:
+        decoded = np.array(Image.open(io.BytesIO(encoded)).convert("L"))
+    assert np.array_equal(img, decoded)
+
+
+def test_encode_image_unknown():
+    with pytest.raises(ValueError):
+        encode_image(np.zeros((2, 2), dtype=np.uint8), "gif")
+
+
+def test_benchmark_encodings():
+    img = np.zeros((20, 30), dtype=np.uint8)
+    encodings = [Encoding("png"), Encoding("jpeg", {"quality": 80})]
+
+    reports = benchmark_encodings([img, img], encodings, repeat=1)
+
+    assert [report.encoding for report in reports] == encodings
+    assert all(report.seconds > 0 and report.n_bytes > 0 for report in reports)